@@ -0,0 +1,344 @@
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from rgbd_codec import encode_rgb, encode_depth, decode_rgb, decode_depth
+from rgbd_protocol import (V2_HEADER_SIZE, MAX_DATAGRAM, TIMING_SIZE, TYPE_RGB, TYPE_DEPTH, codec_id, pack_packet_v2,
+                           pack_timing, unpack_packet, unpack_timing)
+from rgbd_latency import now_us
+from rgbd_decode_pool import DecodePool
+from udp_netem_relay import NetemRelay, parse_netem
+
+RESOLUTIONS = ('424x240', '640x480', '848x480', '1280x720')
+RGB_CODECS = ('jpeg:50', 'jpeg:80', 'jpeg:95', 'webp:80')
+DEPTH_CODECS = ('png:1', 'png:3', 'png:9')
+DECODE_WORKERS = (0, 1, 2, 4)
+
+# Metrics where a larger value is an improvement; everything else is better smaller
+HIGHER_IS_BETTER = {'fps'}
+
+
+def parse_resolution(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def synthetic_frames(width, height, count, seed=0):
+    # Gradients, sensor noise and solid blobs (leaves, grape clusters) so the codecs do real work
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    frames = []
+    for i in range(count):
+        shift = 4 * i
+        color = np.dstack([(xx + shift) % width / width * 255, yy / height * 255, (xx + yy + 2 * shift) % 64 * 4])
+        for _ in range(12):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            radius = int(rng.integers(4, max(5, height // 8)))
+            cv2.circle(color, center, radius, rng.integers(0, 256, 3).tolist(), -1)
+        color += rng.normal(0, 6, color.shape)
+        color = np.clip(color, 0, 255).astype(np.uint8)
+        depth = 600 + 3 * yy + (xx + shift) % 200 + rng.normal(0, 1, yy.shape)
+        for _ in range(20):  # invalid (zero) patches, like shadows and specular spots
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            cv2.circle(depth, center, int(rng.integers(2, 12)), 0, -1)
+        frames.append((color, depth.astype(np.uint16)))
+    return frames
+
+
+def recorded_frames(root, width, height, count):
+    # Output of record_and_store.py: <root>/rgb_frames/*.jpg and <root>/depth_frames/*.png
+    rgb_files = sorted(glob.glob(os.path.join(root, 'rgb_frames', '*.jpg')))[:count]
+    depth_files = sorted(glob.glob(os.path.join(root, 'depth_frames', '*.png')))[:count]
+    if not rgb_files or len(rgb_files) != len(depth_files):
+        raise SystemExit(f"No matching rgb_frames/depth_frames in {root}")
+    frames = []
+    for rgb_file, depth_file in zip(rgb_files, depth_files):
+        color = cv2.cvtColor(cv2.imread(rgb_file, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+        depth = cv2.imread(depth_file, cv2.IMREAD_UNCHANGED)
+        frames.append((cv2.resize(color, (width, height), interpolation=cv2.INTER_AREA),
+                       cv2.resize(depth, (width, height), interpolation=cv2.INTER_NEAREST)))
+    return frames
+
+
+def summarize(values):
+    if not values:
+        return {'mean': 0.0, 'p50': 0.0, 'p90': 0.0}
+    values = np.asarray(values, dtype=np.float64)
+    return {'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+            'p90': float(np.percentile(values, 90))}
+
+
+def bench_codec(images, encode, decode, repeat):
+    encode_ms, decode_ms, sizes = [], [], []
+    for _ in range(repeat):
+        for image in images:
+            start = time.perf_counter()
+            data = encode(image)
+            encoded = time.perf_counter()
+            decode(data)
+            decoded = time.perf_counter()
+            encode_ms.append((encoded - start) * 1000)
+            decode_ms.append((decoded - encoded) * 1000)
+            sizes.append(len(data))
+    return {
+        'encode_ms': summarize(encode_ms)['mean'],
+        'decode_ms': summarize(decode_ms)['mean'],
+        'bytes': float(np.mean(sizes)),
+        'max_bytes': int(max(sizes)),
+        'fits_datagram': max(sizes) + V2_HEADER_SIZE + TIMING_SIZE <= MAX_DATAGRAM,
+    }
+
+
+def bench_decode_scaling(frames, rgb_codec, depth_codec, workers, sessions, count):
+    # Frame decode throughput with a DecodePool: each session keeps one frame in flight, as the
+    # receivers do, so the speedup is what several streams gain from extra cores
+    payloads = [(encode_rgb(color, rgb_codec), encode_depth(depth, depth_codec)) for color, depth in frames]
+    pool = DecodePool(workers)
+    in_flight = [None] * sessions
+    submitted = completed = 0
+    start = time.perf_counter()
+    while completed < count:
+        for index in range(sessions):
+            job = in_flight[index]
+            if job is not None and job.done():
+                job.result()
+                in_flight[index] = job = None
+                completed += 1
+            if job is None and submitted < count:
+                in_flight[index] = pool.submit(*payloads[submitted % len(payloads)])
+                submitted += 1
+        # Only futures still running: a finished RGB next to a pending depth would make wait()
+        # return at once, and the busy loop would take CPU from the decoders
+        pending = [future for job in in_flight if job is not None for future in (job.rgb, job.depth)
+                   if not future.done()]
+        if pending:
+            concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return {'fps': count / elapsed}
+
+
+def bench_loopback(frames, rgb_codec, depth_codec, count, fps, netem=None):
+    # Streamer loop in a thread, receiver loop here, real headers over 127.0.0.1.
+    # netem: optional impairment parameters, routes the stream through a NetemRelay
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    rx.bind(('127.0.0.1', 0))
+    rx.settimeout(0.5)
+    relay = None
+    target = rx.getsockname()
+    if netem is not None:
+        relay = NetemRelay(('127.0.0.1', 0), target, **netem).start()
+        target = relay.address
+    done = threading.Event()
+    sent = {'packets': 0, 'too_large': 0}
+
+    def sender():
+        tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        period = 1.0 / fps if fps else 0.0
+        next_time = time.perf_counter()
+        for frame_id in range(count):
+            color, depth = frames[frame_id % len(frames)]
+            height, width = depth.shape
+            capture_us = now_us()
+            for typ, payload, codec in ((TYPE_RGB, encode_rgb(color, rgb_codec), rgb_codec),
+                                        (TYPE_DEPTH, encode_depth(depth, depth_codec), depth_codec)):
+                encode_us = now_us()
+                if V2_HEADER_SIZE + len(payload) + TIMING_SIZE > MAX_DATAGRAM:
+                    sent['too_large'] += 1
+                    continue
+                trailer = pack_timing(0, 0, capture_us, encode_us, now_us())
+                tx.sendto(pack_packet_v2(typ, frame_id, sent['packets'], encode_us, width, height, payload, trailer,
+                                         codec=codec_id(codec)), target)
+                sent['packets'] += 1
+            if period:
+                next_time += period
+                time.sleep(max(0.0, next_time - time.perf_counter()))
+        tx.close()
+        done.set()
+
+    thread = threading.Thread(target=sender, daemon=True)
+    parts = {}
+    latencies = []
+    received = 0
+    start = time.perf_counter()
+    last_complete = start
+    thread.start()
+    while True:
+        try:
+            packet = rx.recv(65536)
+        except socket.timeout:
+            if done.is_set():
+                break
+            continue
+        received += 1
+        parsed = unpack_packet(packet)
+        frame_id, typ = parsed.frame_id, parsed.type
+        timing = unpack_timing(parsed.trailer)
+        decoded = decode_rgb(parsed.data) if typ == TYPE_RGB else decode_depth(parsed.data)
+        if decoded is None:
+            continue
+        entry = parts.setdefault(frame_id, set())
+        entry.add(typ)
+        if len(entry) == 2:
+            del parts[frame_id]
+            last_complete = time.perf_counter()
+            latencies.append((now_us() - timing['capture']) / 1000.0)
+    thread.join()
+    rx.close()
+    if relay is not None:
+        relay.stop()
+    elapsed = last_complete - start
+    expected = sent['packets']
+    stats = {
+        'frames_sent': count,
+        'frames_complete': len(latencies),
+        'fps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_ms': summarize(latencies)['p50'],
+        'latency_p90_ms': summarize(latencies)['p90'],
+        'loss': 1.0 - received / expected if expected else 0.0,
+        'too_large': sent['too_large'],
+    }
+    if relay is not None:
+        stats['netem'] = relay.stats
+    return stats
+
+
+def run(args):
+    results = {'meta': {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'source': args.frames_dir or 'synthetic',
+        'frames': args.frames,
+        'fps': args.fps,
+        'netem': args.netem,
+        'cpus': os.cpu_count(),
+    }, 'codecs': [], 'loopback': [], 'decode_scaling': []}
+    for resolution in args.resolutions:
+        width, height = parse_resolution(resolution)
+        if args.frames_dir:
+            frames = recorded_frames(args.frames_dir, width, height, args.frames)
+        else:
+            frames = synthetic_frames(width, height, args.frames)
+        colors = [color for color, _ in frames]
+        depths = [depth for _, depth in frames]
+        for codec in args.rgb_codecs:
+            stats = bench_codec(colors, lambda image: encode_rgb(image, codec), decode_rgb, args.repeat)
+            results['codecs'].append(dict(resolution=resolution, stream='rgb', codec=codec, **stats))
+            print(f"{resolution} rgb   {codec:<8} encode {stats['encode_ms']:6.2f} ms  decode {stats['decode_ms']:6.2f} ms"
+                  f"  {stats['bytes']:9.0f} B", file=sys.stderr)
+        for codec in args.depth_codecs:
+            stats = bench_codec(depths, lambda image: encode_depth(image, codec), decode_depth, args.repeat)
+            results['codecs'].append(dict(resolution=resolution, stream='depth', codec=codec, **stats))
+            print(f"{resolution} depth {codec:<8} encode {stats['encode_ms']:6.2f} ms  decode {stats['decode_ms']:6.2f} ms"
+                  f"  {stats['bytes']:9.0f} B", file=sys.stderr)
+        baseline = None
+        for workers in args.decode_workers:
+            stats = bench_decode_scaling(frames, args.rgb_codecs[0], args.depth_codecs[0], workers,
+                                         args.decode_sessions, args.decode_frames)
+            baseline = baseline or stats['fps']
+            stats['speedup'] = stats['fps'] / baseline
+            results['decode_scaling'].append(dict(resolution=resolution, workers=workers, sessions=args.decode_sessions,
+                                                  **stats))
+            print(f"{resolution} decode {args.decode_sessions} sessions, {workers} workers: {stats['fps']:6.1f} fps"
+                  f"  x{stats['speedup']:.2f}", file=sys.stderr)
+        # Vary one codec at a time against the other's first option
+        pairs = [(codec, args.depth_codecs[0]) for codec in args.rgb_codecs]
+        pairs += [(args.rgb_codecs[0], codec) for codec in args.depth_codecs[1:]]
+        for rgb_codec, depth_codec in pairs:
+            stats = bench_loopback(frames, rgb_codec, depth_codec, args.loopback_frames, args.fps,
+                                   parse_netem(args.netem) if args.netem else None)
+            results['loopback'].append(dict(resolution=resolution, rgb_codec=rgb_codec, depth_codec=depth_codec, **stats))
+            print(f"{resolution} loopback {rgb_codec}+{depth_codec}: {stats['fps']:6.1f} fps"
+                  f"  latency p50 {stats['latency_p50_ms']:6.2f} ms  p90 {stats['latency_p90_ms']:6.2f} ms"
+                  f"  loss {stats['loss']:.1%}", file=sys.stderr)
+    return results
+
+
+def entry_key(section, entry):
+    if section == 'codecs':
+        return entry['resolution'], entry['stream'], entry['codec']
+    if section == 'decode_scaling':
+        return entry['resolution'], f"{entry['workers']} workers", f"{entry['sessions']} sessions"
+    return entry['resolution'], entry['rgb_codec'], entry['depth_codec']
+
+
+def compare(base, new, threshold):
+    # Returns the list of regressions larger than threshold (relative)
+    regressions = []
+    for section, metrics in (('codecs', ('encode_ms', 'decode_ms', 'bytes')),
+                             ('loopback', ('fps', 'latency_p50_ms', 'latency_p90_ms', 'loss')),
+                             ('decode_scaling', ('fps',))):
+        baseline = {entry_key(section, entry): entry for entry in base.get(section, [])}
+        for entry in new.get(section, []):
+            key = entry_key(section, entry)
+            if key not in baseline:
+                continue
+            for metric in metrics:
+                old, cur = baseline[key][metric], entry[metric]
+                if metric == 'loss':
+                    change = cur - old  # already a ratio
+                elif old:
+                    change = (cur - old) / old
+                else:
+                    continue
+                if metric in HIGHER_IS_BETTER:
+                    change = -change
+                status = 'REGRESSION' if change > threshold else ''
+                print(f"{'/'.join(key):<32} {metric:<15} {old:12.3f} -> {cur:12.3f}  {change:+7.1%} {status}")
+                if status:
+                    regressions.append((key, metric, old, cur))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark encode -> UDP loopback -> decode for each codec option")
+    parser.add_argument('--out', help="Write JSON results here (default: stdout)")
+    parser.add_argument('--resolutions', type=lambda s: s.split(','), default=list(RESOLUTIONS))
+    parser.add_argument('--rgb-codecs', type=lambda s: s.split(','), default=list(RGB_CODECS))
+    parser.add_argument('--depth-codecs', type=lambda s: s.split(','), default=list(DEPTH_CODECS))
+    parser.add_argument('--frames-dir', help="Use frames saved by record_and_store.py instead of synthetic ones")
+    parser.add_argument('--frames', type=int, default=10, help="Distinct frames per resolution")
+    parser.add_argument('--repeat', type=int, default=2, help="Passes over the frames for codec timing")
+    parser.add_argument('--loopback-frames', type=int, default=150)
+    parser.add_argument('--decode-workers', type=lambda s: [int(v) for v in s.split(',')], default=list(DECODE_WORKERS),
+                        help="DecodePool sizes to measure; the first is the speedup baseline")
+    parser.add_argument('--decode-sessions', type=int, default=4, help="Streams decoding concurrently")
+    parser.add_argument('--decode-frames', type=int, default=200, help="Frames decoded per pool size")
+    parser.add_argument('--fps', type=float, default=0, help="Pace the loopback sender, 0 = as fast as possible")
+    parser.add_argument('--netem', help="Run loopback through the impairment relay, e.g. loss=0.02,delay=20")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="Compare two result files")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Relative change counted as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold)
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    results = run(args)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
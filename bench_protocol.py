@@ -0,0 +1,127 @@
+import argparse
+import json
+import random
+import sys
+import time
+
+from rgbd_protocol import (HEADER_SIZE, V2_HEADER_SIZE, TYPE_RGB, crc32c, pack_header, pack_packet_v2, pack_timing,
+                           unpack_packet)
+
+# Per-packet cost of building and parsing each header variant, and a fuzzer that feeds
+# mutated datagrams to unpack_packet: anything other than a Packet or a ValueError is a bug,
+# and so is accepting a CRC packet that differs from the one sent.
+
+PAYLOAD_SIZES = (1000, 20000, 60000)
+VARIANTS = ('v1', 'v2', 'v2+crc')
+
+
+def build(variant, payload, seq=0):
+    trailer = pack_timing(0, 1, 2, 3, 4)
+    if variant == 'v1':
+        return pack_header(seq, TYPE_RGB, 123, 424, 240, len(payload)) + payload + trailer
+    return pack_packet_v2(TYPE_RGB, seq, seq, 123, 424, 240, payload, trailer, codec=1, crc=variant == 'v2+crc')
+
+
+def time_per_call(function, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def bench(sizes, iterations):
+    results = []
+    for size in sizes:
+        payload = random.randbytes(size)
+        for variant in VARIANTS:
+            packet = build(variant, payload)
+            stats = {
+                'variant': variant,
+                'payload': size,
+                'pack_us': time_per_call(lambda: build(variant, payload), iterations),
+                'parse_us': time_per_call(lambda: unpack_packet(packet), iterations),
+            }
+            results.append(stats)
+            print(f"{variant:<7} {size:6d} B  pack {stats['pack_us']:7.2f} us  parse {stats['parse_us']:7.2f} us",
+                  file=sys.stderr)
+    return results
+
+
+def mutate(rng, packet):
+    kind = rng.randrange(5)
+    data = bytearray(packet)
+    if kind == 0:
+        return bytes(data[:rng.randrange(len(data) + 1)]), 'truncate'
+    if kind == 1:
+        for _ in range(rng.randint(1, 4)):
+            data[rng.randrange(len(data))] ^= 1 << rng.randrange(8)
+        return bytes(data), 'bitflip'
+    if kind == 2:
+        # Corrupt header fields only
+        limit = min(len(data), V2_HEADER_SIZE + 4)
+        for _ in range(rng.randint(1, 3)):
+            data[rng.randrange(limit)] = rng.randrange(256)
+        return bytes(data), 'header'
+    if kind == 3:
+        return bytes(data) + rng.randbytes(rng.randrange(1, 64)), 'extend'
+    return rng.randbytes(rng.randrange(0, 2 * HEADER_SIZE + V2_HEADER_SIZE)), 'garbage'
+
+
+def fuzz(iterations, seed):
+    rng = random.Random(seed)
+    outcomes = {}
+    crashes = []
+    accepted_corrupt = []
+    for variant in VARIANTS:
+        for i in range(iterations):
+            packet = build(variant, rng.randbytes(rng.randrange(0, 2000)), i)
+            mutated, kind = mutate(rng, packet)
+            try:
+                parsed = unpack_packet(mutated)
+                result = 'accepted'
+                if len(parsed.data) > len(mutated):
+                    crashes.append((variant, kind, mutated.hex(), 'payload longer than datagram'))
+                if variant == 'v2+crc' and mutated != packet:
+                    accepted_corrupt.append((variant, kind, mutated.hex()))
+            except ValueError as e:
+                result = str(e)
+            except Exception as e:
+                result = 'crash'
+                crashes.append((variant, kind, mutated.hex(), repr(e)))
+            key = f'{variant}/{kind}/{result}'
+            outcomes[key] = outcomes.get(key, 0) + 1
+    for key in sorted(outcomes):
+        print(f"{key:<40} {outcomes[key]}", file=sys.stderr)
+    return {'outcomes': outcomes, 'crashes': crashes, 'accepted_corrupt': accepted_corrupt}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and fuzz the RGB-D packet parser")
+    parser.add_argument('--out', help="Write JSON results here (default: stdout)")
+    parser.add_argument('--sizes', type=lambda s: [int(v) for v in s.split(',')], default=list(PAYLOAD_SIZES))
+    parser.add_argument('--iterations', type=int, default=20000, help="Calls timed per variant and size")
+    parser.add_argument('--fuzz', type=int, default=20000, help="Mutated packets per variant, 0 skips fuzzing")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = {
+        'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+                 'crc32c': crc32c is not None},
+        'bench': bench(args.sizes, args.iterations),
+    }
+    if args.fuzz:
+        results['fuzz'] = fuzz(args.fuzz, args.seed)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    if args.fuzz and (results['fuzz']['crashes'] or results['fuzz']['accepted_corrupt']):
+        print(f"{len(results['fuzz']['crashes'])} parser crash(es), {len(results['fuzz']['accepted_corrupt'])}"
+              f" corrupted CRC packet(s) accepted", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
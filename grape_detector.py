@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+
+YOLO_CFG = 'yolov3.cfg'
+YOLO_WEIGHTS = 'yv3_grapes.weights'
+YOLO_NAMES = 'obj.names'
+INPUT_SIZE = 416
+CONF_THRESHOLD = 0.5
+NMS_THRESHOLD = 0.4
+
+
+def load_yolo(cfg=YOLO_CFG, weights=YOLO_WEIGHTS, names=YOLO_NAMES):
+    net = cv2.dnn.readNetFromDarknet(cfg, weights)
+    with open(names, 'r') as f:
+        classes = [line.strip() for line in f.readlines()]
+    return net, classes
+
+
+def detect(frame, net, classes, scale=1):
+    # Returns a list of detections: {'box': [x, y, w, h], 'class_id', 'label', 'confidence'}
+    # Boxes are multiplied by scale, so a frame decoded at reduced size yields stream pixels
+    blob = cv2.dnn.blobFromImage(frame, 1/255.0, (INPUT_SIZE, INPUT_SIZE), swapRB=True, crop=False)
+    net.setInput(blob)
+    outs = net.forward(net.getUnconnectedOutLayersNames())
+    height, width = frame.shape[:2]
+    class_ids = []
+    confidences = []
+    boxes = []
+    for out in outs:
+        for detection in out:
+            scores = detection[5:]
+            class_id = np.argmax(scores)
+            confidence = scores[class_id]
+            if confidence > CONF_THRESHOLD:
+                center_x = int(detection[0] * width)
+                center_y = int(detection[1] * height)
+                w = int(detection[2] * width)
+                h = int(detection[3] * height)
+                x = int(center_x - w / 2)
+                y = int(center_y - h / 2)
+                class_ids.append(class_id)
+                confidences.append(float(confidence))
+                boxes.append([x, y, w, h])
+    indices = cv2.dnn.NMSBoxes(boxes, confidences, CONF_THRESHOLD, NMS_THRESHOLD)
+    detections = []
+    for i in indices:
+        i = i[0] if isinstance(i, (list, np.ndarray)) else i
+        detections.append({
+            'box': [int(v * scale) for v in boxes[i]] if scale != 1 else boxes[i],
+            'class_id': int(class_ids[i]),
+            'label': classes[class_ids[i]],
+            'confidence': confidences[i],
+        })
+    return detections
+
+
+def draw_detections(frame, detections, scale=1):
+    # scale: how many stream pixels one frame pixel covers, as passed to detect()
+    for det in detections:
+        x, y, w, h = (int(v / scale) for v in det['box'])
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+        cv2.circle(frame, ((x + int(w / 2)), (y + int(h / 2))), 5, (0, 0, 255), -1)
+        text = f"{det['label']}: {det['confidence']:.2f}"
+        if det.get('depth_m') is not None:
+            # Added by grape_localize when registered depth is available
+            text += f" {det['depth_m']:.2f}m"
+        cv2.putText(frame, text, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    return frame
@@ -0,0 +1,63 @@
+import numpy as np
+
+from rgbd_calibration import scaled_intrinsics
+
+# Distance and 3D position per detection from depth registered to the color image.
+# Each box is sampled on a fixed grid over its central part, so the cost is the same for
+# every box size and all boxes are handled in one vectorized pass.
+
+SAMPLE_GRID = 9
+INNER_FRACTION = 0.5  # sample the central half of the box, away from background at the edges
+MIN_VALID_FRACTION = 0.1
+
+
+def box_depths(boxes, depth, percentile=50, grid=SAMPLE_GRID, inner=INNER_FRACTION):
+    # boxes: (N, 4) x, y, w, h in depth pixels -> (N,) depth units, NaN where too few valid samples.
+    # Zero depth (no data) is ignored rather than pulling the estimate toward the camera.
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if not len(boxes):
+        return np.zeros(0, np.float32)
+    height, width = depth.shape
+    steps = np.linspace(-inner / 2, inner / 2, grid, dtype=np.float32)
+    cx = boxes[:, 0] + boxes[:, 2] / 2
+    cy = boxes[:, 1] + boxes[:, 3] / 2
+    us = np.clip(np.rint(cx[:, None] + steps[None, :] * boxes[:, 2:3]), 0, width - 1).astype(np.intp)
+    vs = np.clip(np.rint(cy[:, None] + steps[None, :] * boxes[:, 3:4]), 0, height - 1).astype(np.intp)
+    samples = depth[vs[:, :, None], us[:, None, :]].reshape(len(boxes), -1).astype(np.float32)
+    valid = samples > 0
+    count = valid.sum(axis=1)
+    samples[~valid] = np.inf
+    samples.sort(axis=1)
+    index = np.rint(percentile / 100 * np.maximum(count - 1, 0)).astype(np.intp)
+    result = samples[np.arange(len(boxes)), index]
+    result[count < max(1, MIN_VALID_FRACTION * grid * grid)] = np.nan
+    return result
+
+
+def deproject(u, v, z, intr):
+    # Pixel coordinates and depth in metres -> (N, 3) XYZ in the color camera frame
+    x = (np.asarray(u, np.float32) - intr['ppx']) / intr['fx'] * z
+    y = (np.asarray(v, np.float32) - intr['ppy']) / intr['fy'] * z
+    return np.stack([x, y, z], axis=1)
+
+
+def localize(detections, depth, calib, frame_size=None, percentile=50):
+    # Adds 'depth_m' and 'xyz' (metres, or None) to each detection. depth must be registered to
+    # the color image the boxes were found in (frame_size=(w, h), default the depth size).
+    if not detections:
+        return detections
+    height, width = depth.shape
+    intr = scaled_intrinsics(calib['color_intrinsics'], width, height)
+    boxes = np.array([det['box'] for det in detections], dtype=np.float32)
+    frame_w, frame_h = frame_size or (width, height)
+    if (frame_w, frame_h) != (width, height):
+        boxes *= np.array([width / frame_w, height / frame_h] * 2, dtype=np.float32)
+    z = box_depths(boxes, depth, percentile) * calib['depth_scale']
+    xyz = deproject(boxes[:, 0] + boxes[:, 2] / 2, boxes[:, 1] + boxes[:, 3] / 2, z, intr)
+    for det, distance, point in zip(detections, z, xyz):
+        if np.isnan(distance):
+            det['depth_m'] = det['xyz'] = None
+        else:
+            det['depth_m'] = float(distance)
+            det['xyz'] = [float(c) for c in point]
+    return detections
@@ -1,15 +1,26 @@
-import pyrealsense2 as rs
 import numpy as np
 import cv2
-import time
 import os
+import collections
+import argparse
+
+from rgbd_config import add_config_arguments, config_from_args, validate_config
+from rgbd_capture import FrameSource, WarmUp, add_capture_arguments
 
 # Settings
-WIDTH = 424
-HEIGHT = 240
-FPS = 30
 DURATION_SEC = 120  # 2 minutes
-FRAME_COUNT = FPS * DURATION_SEC
+
+parser = argparse.ArgumentParser(description="Record RealSense RGB-D frames to JPEG/PNG files")
+add_config_arguments(parser, codecs=False)
+add_capture_arguments(parser, provisional=False)
+parser.add_argument('--duration', type=int, default=DURATION_SEC, help="Seconds to record")
+args = parser.parse_args()
+config = config_from_args(args)
+error = validate_config(config)
+if error:
+    parser.error(error)
+FPS = config['fps']
+FRAME_COUNT = FPS * args.duration
 
 rgb_output_dir = "rgb_frames"
 depth_output_dir = "depth_frames"
@@ -17,21 +28,18 @@ os.makedirs(rgb_output_dir, exist_ok=True)
 os.makedirs(depth_output_dir, exist_ok=True)
 
 # RealSense pipeline
-pipeline = rs.pipeline()
-cfg = rs.config()
-cfg.enable_stream(rs.stream.color, WIDTH, HEIGHT, rs.format.rgb8, FPS)
-cfg.enable_stream(rs.stream.depth, WIDTH, HEIGHT, rs.format.z16, FPS)
-pipeline.start(cfg)
+pipeline = FrameSource(config, args.capture, args.frame_queue_capacity)
 
-# Warm up
-for _ in range(30):
-    pipeline.wait_for_frames()
+# Warm up until auto-exposure settles
+print(WarmUp(args.warmup_timeout).run(pipeline).describe())
+lost = collections.Counter()
 
-print(f"Recording {DURATION_SEC} seconds ({FRAME_COUNT} frames) at {FPS} FPS...")
+print(f"Recording {args.duration} seconds ({FRAME_COUNT} frames) at {FPS} FPS...")
 
 try:
     for frame_id in range(FRAME_COUNT):
         frames = pipeline.wait_for_frames()
+        lost.update(pipeline.take_drops())
         color_frame = frames.get_color_frame()
         depth_frame = frames.get_depth_frame()
         if not color_frame or not depth_frame:
@@ -50,8 +58,10 @@ try:
         cv2.imwrite(depth_filename, depth)
 
         if frame_id % 30 == 0:
-            print(f"Saved frame {frame_id}/{FRAME_COUNT}")
+            print(f"Saved frame {frame_id}/{FRAME_COUNT} | {sum(lost.values())} frames lost in capture")
 
     print("Recording complete.")
+    for (stream, reason), count in sorted(lost.items()):
+        print(f"  {stream}: {count} frames lost ({reason})")
 finally:
     pipeline.stop()
@@ -0,0 +1,104 @@
+import numpy as np
+
+from rgbd_calibration import scaled_intrinsics
+
+# Depth -> color registration on the host, replacing rs.align on the Pi.
+#
+# For a depth pixel with ray r (from the depth intrinsics) and depth z, its position in the
+# color camera is P = z * (R @ r) + t. R @ r is fixed per pixel, so it is computed once per
+# depth resolution; each frame then costs a multiply-add, a projection and a z-buffered
+# scatter, all vectorized.
+#
+# As in rs.align, each depth pixel covers the color pixels between the projections of its top
+# left and bottom right corners, so a color image denser than the projected depth grid has no
+# holes between samples. Footprints are capped at MAX_SPLAT pixels a side (depth edges at
+# grazing angles would otherwise smear across the image).
+
+DISTORTED_MODELS = ('brown_conrady', 'modified_brown_conrady')
+MAX_SPLAT = 8
+
+
+def pixel_rays(intr, offset=0.0):
+    # Unit-depth rays (x/z, y/z) through every pixel centre (or the point offset from it, in
+    # pixels), shape (2, h*w). RealSense depth streams are undistorted, so no distortion model
+    # is applied here.
+    u, v = np.meshgrid(np.arange(intr['width'], dtype=np.float32) + offset,
+                       np.arange(intr['height'], dtype=np.float32) + offset)
+    return np.stack([((u - intr['ppx']) / intr['fx']).ravel(), ((v - intr['ppy']) / intr['fy']).ravel()])
+
+
+def project(points, intr):
+    # points: (3, N) metres in the camera frame -> pixel coordinates (u, v)
+    x = points[0] / points[2]
+    y = points[1] / points[2]
+    coeffs = intr.get('coeffs') or [0, 0, 0, 0, 0]
+    if intr.get('model') in DISTORTED_MODELS and any(coeffs):
+        k1, k2, p1, p2, k3 = coeffs[:5]
+        r2 = x * x + y * y
+        radial = 1 + k1 * r2 + k2 * r2 * r2 + k3 * r2 * r2 * r2
+        x, y = (x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x),
+                y * radial + 2 * p2 * x * y + p1 * (r2 + 2 * y * y))
+    return x * intr['fx'] + intr['ppx'], y * intr['fy'] + intr['ppy']
+
+
+class DepthToColorAligner:
+    def __init__(self, calib):
+        self.calib = calib
+        self.color = calib['color_intrinsics']
+        self.rotation = np.array(calib['depth_to_color']['rotation'], dtype=np.float32).reshape(3, 3)
+        self.translation = np.array(calib['depth_to_color']['translation'], dtype=np.float32).reshape(3, 1)
+        self.depth_scale = calib['depth_scale']
+        self.cache = {}  # (depth shape, corner offset) -> rotated rays (3, h*w)
+
+    def rotated_rays(self, shape, offset=0.0):
+        rays = self.cache.get((shape, offset))
+        if rays is None:
+            intr = scaled_intrinsics(self.calib['depth_intrinsics'], shape[1], shape[0])
+            xy = pixel_rays(intr, offset)
+            rays = self.rotation @ np.vstack([xy, np.ones((1, xy.shape[1]), np.float32)])
+            self.cache[(shape, offset)] = rays = rays.astype(np.float32)
+        return rays
+
+    def align(self, depth, out_size=None):
+        # depth: HxW uint16 in depth units -> uint16 depth registered to the color image
+        # (size out_size=(w, h), default the color intrinsics). 0 means no depth.
+        color = self.color
+        if out_size is not None and out_size != (color['width'], color['height']):
+            color = scaled_intrinsics(color, *out_size)
+        width, height = color['width'], color['height']
+        flat = depth.ravel()
+        valid = np.flatnonzero(flat)
+        z = flat[valid].astype(np.float32) * self.depth_scale
+        first_corner = self.rotated_rays(depth.shape, -0.5)[:, valid] * z + self.translation
+        last_corner = self.rotated_rays(depth.shape, 0.5)[:, valid] * z + self.translation
+        front = (first_corner[2] > 0) & (last_corner[2] > 0)
+        first_corner, last_corner = first_corner[:, front], last_corner[:, front]
+        u0, v0 = project(first_corner, color)
+        u1, v1 = project(last_corner, color)
+        z_units = np.clip(np.rint((first_corner[2] + last_corner[2]) / 2 / self.depth_scale), 1, 65535)
+        # Covered color pixels, clipped to the image; at least the pixel under the depth sample
+        left = np.maximum(np.rint(np.minimum(u0, u1)), 0).astype(np.int64)
+        right = np.minimum(np.rint(np.maximum(u0, u1)), width - 1).astype(np.int64)
+        top = np.maximum(np.rint(np.minimum(v0, v1)), 0).astype(np.int64)
+        bottom = np.minimum(np.rint(np.maximum(v0, v1)), height - 1).astype(np.int64)
+        inside = (left <= right) & (top <= bottom)
+        left, top, z_units = left[inside], top[inside], z_units[inside].astype(np.int64)
+        spans_x = np.minimum(right[inside] - left + 1, MAX_SPLAT)
+        spans_y = np.minimum(bottom[inside] - top + 1, MAX_SPLAT)
+        targets, depths = [], []
+        for dy in range(int(spans_y.max(initial=0))):
+            for dx in range(int(spans_x.max(initial=0))):
+                covered = (dy < spans_y) & (dx < spans_x)
+                targets.append((top[covered] + dy) * width + left[covered] + dx)
+                depths.append(z_units[covered])
+        aligned = np.zeros(height * width, np.uint16)
+        if not targets:
+            return aligned.reshape(height, width)
+        target, z_units = np.concatenate(targets), np.concatenate(depths)
+        # z-buffer: sort by (target pixel, depth) once and keep the nearest sample per pixel
+        order = np.argsort(target * 65536 + z_units, kind='stable')
+        target, z_units = target[order], z_units[order]
+        first = np.ones(target.shape, bool)
+        first[1:] = target[1:] != target[:-1]
+        aligned[target[first]] = z_units[first]
+        return aligned.reshape(height, width)
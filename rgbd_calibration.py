@@ -0,0 +1,51 @@
+import json
+
+import numpy as np
+
+# Camera calibration sent by the streamer so the host can register depth to color:
+# {'depth_intrinsics': {...}, 'color_intrinsics': {...}, 'depth_to_color': {'rotation', 'translation'},
+#  'depth_scale': metres per depth unit}
+# Intrinsics dicts mirror rs.intrinsics; rotation is row-major 3x3 (librealsense stores it column-major).
+
+
+def intrinsics_to_dict(intr):
+    return {
+        'width': intr.width, 'height': intr.height,
+        'fx': intr.fx, 'fy': intr.fy, 'ppx': intr.ppx, 'ppy': intr.ppy,
+        'model': str(intr.model).split('.')[-1], 'coeffs': list(intr.coeffs),
+    }
+
+
+def calibration_from_profile(profile):
+    # profile: the rs.pipeline_profile returned by pipeline.start()
+    import pyrealsense2 as rs
+    depth_profile = profile.get_stream(rs.stream.depth).as_video_stream_profile()
+    color_profile = profile.get_stream(rs.stream.color).as_video_stream_profile()
+    extrinsics = depth_profile.get_extrinsics_to(color_profile)
+    rotation = np.array(extrinsics.rotation, dtype=np.float64).reshape(3, 3).T
+    return {
+        'depth_intrinsics': intrinsics_to_dict(depth_profile.get_intrinsics()),
+        'color_intrinsics': intrinsics_to_dict(color_profile.get_intrinsics()),
+        'depth_to_color': {'rotation': rotation.ravel().tolist(), 'translation': list(extrinsics.translation)},
+        'depth_scale': profile.get_device().first_depth_sensor().get_depth_scale(),
+    }
+
+
+def pack_calibration(calib):
+    return json.dumps(calib, separators=(',', ':')).encode()
+
+
+def parse_calibration(data):
+    try:
+        return json.loads(data.decode())
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+
+def scaled_intrinsics(intr, width, height):
+    # Intrinsics for the same sensor delivered at another resolution (e.g. after decimation)
+    sx, sy = width / intr['width'], height / intr['height']
+    if sx == 1 and sy == 1:
+        return intr
+    return dict(intr, width=width, height=height, fx=intr['fx'] * sx, fy=intr['fy'] * sy,
+                ppx=(intr['ppx'] + 0.5) * sx - 0.5, ppy=(intr['ppy'] + 0.5) * sy - 0.5)
@@ -0,0 +1,201 @@
+import collections
+import threading
+import time
+
+from rgbd_config import start_pipeline
+from rgbd_protocol import TIMING_FLAG_GLOBAL_CLOCK
+
+# Frame delivery from the camera for the streamer, the capture daemon and record_and_store.py.
+#
+# 'wait' is the SDK pipeline's blocking wait_for_frames(): its internal queue is a frame or two
+# deep and drops framesets without telling anyone whenever processing falls behind.
+# 'queue' has the SDK hand every frameset to a frame_queue of --frame-queue-capacity framesets,
+# kept (frame.keep()) so queued frames do not starve the SDK's frame pool. The queue absorbs
+# capture jitter and slow iterations, and counts the framesets it discards when full.
+#
+# In both modes a gap in a stream's frame numbers is a dropped frame. Gaps the frame_queue's
+# overflows account for are 'host_queue' drops; the rest are 'upstream' drops (camera, USB or
+# SDK, and in 'wait' mode also the pipeline's own queue).
+#
+# Warm-up after (re)starting the camera watches the exposure and gain reported in the frame
+# metadata and ends once both have held still for WARMUP_STABLE_FRAMES frames, or after
+# --warmup-timeout seconds. Without exposure metadata (kernels without the RealSense metadata
+# patch) it falls back to the fixed WARMUP_FALLBACK_FRAMES.
+
+CAPTURE_MODES = ('wait', 'queue')
+DEFAULT_CAPTURE_MODE = 'wait'
+DEFAULT_QUEUE_CAPACITY = 8
+WAIT_TIMEOUT_MS = 5000
+DEFAULT_WARMUP_TIMEOUT = 2.0
+WARMUP_MIN_FRAMES = 3  # the first frames after start come before auto-exposure reacts
+WARMUP_STABLE_FRAMES = 5
+WARMUP_TOLERANCE = 0.05  # relative exposure/gain change still counted as settled
+WARMUP_FALLBACK_FRAMES = 30
+
+
+def add_capture_arguments(parser, provisional=True):
+    # provisional: the script can pass warm-up frames on, flagged (--warmup-stream)
+    parser.add_argument('--warmup-timeout', type=float, default=DEFAULT_WARMUP_TIMEOUT,
+                        help="Seconds to wait at most for auto-exposure to settle after the camera starts")
+    if provisional:
+        parser.add_argument('--warmup-stream', action='store_true',
+                            help="Send frames during warm-up, flagged provisional, instead of discarding them")
+    parser.add_argument('--capture', choices=CAPTURE_MODES, default=DEFAULT_CAPTURE_MODE,
+                        help="'queue' buffers framesets between the camera and processing and counts its drops")
+    parser.add_argument('--frame-queue-capacity', type=int, default=DEFAULT_QUEUE_CAPACITY,
+                        help="Framesets the 'queue' capture mode holds before it discards the oldest")
+
+
+class FrameSource:
+    # Takes the place of rs.pipeline in the capture loops: wait_for_frames() and stop()
+    def __init__(self, config, mode=DEFAULT_CAPTURE_MODE, capacity=DEFAULT_QUEUE_CAPACITY):
+        import pyrealsense2 as rs
+        if mode not in CAPTURE_MODES:
+            raise ValueError(f"Unknown capture mode {mode!r}, expected one of {', '.join(CAPTURE_MODES)}")
+        self.mode = mode
+        self.capacity = max(1, capacity)
+        self.ready = threading.Condition()
+        self.pending = 0  # framesets in the queue
+        self.overflows = 0  # framesets the full queue discarded, not yet matched to gaps
+        self.single_frames = 0  # callbacks with one frame instead of a frameset, skipped
+        self.last_numbers = {}
+        self.drops = collections.Counter()  # (stream, reason) -> frames, see take_drops()
+        self.queue = None
+        if mode == 'queue':
+            self.queue = rs.frame_queue(self.capacity, keep_frames=True)
+            self.pipeline, self.profile = start_pipeline(config, self.enqueue)
+        else:
+            self.pipeline, self.profile = start_pipeline(config)
+
+    def enqueue(self, frame):
+        # SDK thread; a full frame_queue discards its oldest frameset to make room. The SDK may
+        # also call back with single frames (e.g. while a stream starts); those are not usable.
+        if not frame.is_frameset():
+            with self.ready:
+                self.single_frames += 1
+            return
+        with self.ready:
+            if self.pending >= self.capacity:
+                self.overflows += 1
+            else:
+                self.pending += 1
+            self.queue.enqueue(frame)
+            self.ready.notify()
+
+    def wait_for_frames(self, timeout_ms=WAIT_TIMEOUT_MS):
+        if self.queue is None:
+            frames = self.pipeline.wait_for_frames(timeout_ms)
+            self.account(frames, 0)
+            return frames
+        with self.ready:
+            frame = self.queue.poll_for_frame()
+            while not frame:
+                if not self.ready.wait(timeout_ms / 1000):
+                    raise RuntimeError(f"Frame didn't arrive within {timeout_ms}")
+                frame = self.queue.poll_for_frame()
+            self.pending -= 1
+            overflows, self.overflows = self.overflows, 0
+        frames = frame.as_frameset()
+        self.account(frames, overflows)
+        return frames
+
+    def account(self, frames, overflows):
+        for stream, frame in (('rgb', frames.get_color_frame()), ('depth', frames.get_depth_frame())):
+            if not frame:
+                continue
+            number = frame.get_frame_number()
+            last = self.last_numbers.get(stream)
+            self.last_numbers[stream] = number
+            if last is None or number <= last + 1:
+                continue  # first frame, or the counter restarted with the camera
+            missing = number - last - 1
+            host = min(missing, overflows)
+            if host:
+                self.drops[(stream, 'host_queue')] += host
+            if missing > host:
+                self.drops[(stream, 'upstream')] += missing - host
+
+    def backlog(self):
+        return self.pending
+
+    def take_drops(self):
+        # {(stream, reason): frames} since the last call
+        with self.ready:
+            single_frames, self.single_frames = self.single_frames, 0
+        drops, self.drops = self.drops, collections.Counter()
+        if single_frames:
+            drops[('rgbd', 'single_frame')] += single_frames
+        return drops
+
+    def stop(self):
+        self.pipeline.stop()
+
+
+def exposure_state(frame):
+    # (actual exposure, gain) from the frame metadata, or None when the driver does not report them
+    import pyrealsense2 as rs
+    keys = (rs.frame_metadata_value.actual_exposure, rs.frame_metadata_value.gain_level)
+    if not frame or not all(frame.supports_frame_metadata(key) for key in keys):
+        return None
+    return tuple(frame.get_frame_metadata(key) for key in keys)
+
+
+def sensor_stamp(frame, flags=0):
+    # (timing flags, frame timestamp in us); only comparable with time.time() in the global time domain
+    import pyrealsense2 as rs
+    if frame.get_frame_timestamp_domain() == rs.timestamp_domain.global_time:
+        flags |= TIMING_FLAG_GLOBAL_CLOCK
+    return flags, int(frame.get_timestamp() * 1000)
+
+
+def settled(history):
+    # Every state in history within WARMUP_TOLERANCE of the latest one
+    if len(history) < history.maxlen:
+        return False
+    latest = history[-1]
+    return all(abs(value - ref) <= WARMUP_TOLERANCE * max(abs(ref), 1)
+               for state in history for value, ref in zip(state, latest))
+
+
+class WarmUp:
+    # Feed it the framesets after a camera start; update() returns True once they are usable
+    def __init__(self, timeout=DEFAULT_WARMUP_TIMEOUT):
+        self.timeout = timeout
+        self.start = time.monotonic()
+        self.frames = 0
+        self.history = {stream: collections.deque(maxlen=WARMUP_STABLE_FRAMES) for stream in ('rgb', 'depth')}
+        self.done = False
+        self.reason = None  # 'settled', 'timeout' or 'no_metadata'
+        self.elapsed = 0.0
+
+    def update(self, frames):
+        if self.done:
+            return True
+        self.frames += 1
+        self.elapsed = time.monotonic() - self.start
+        for stream, frame in (('rgb', frames.get_color_frame()), ('depth', frames.get_depth_frame())):
+            state = exposure_state(frame)
+            if state is not None:
+                self.history[stream].append(state)
+        reporting = [history for history in self.history.values() if history]
+        if not reporting:
+            if self.frames >= WARMUP_FALLBACK_FRAMES:
+                self.reason = 'no_metadata'
+        elif self.frames >= WARMUP_MIN_FRAMES and all(settled(history) for history in reporting):
+            self.reason = 'settled'
+        if self.reason is None and self.elapsed >= self.timeout:
+            self.reason = 'timeout'
+        self.done = self.reason is not None
+        return self.done
+
+    def run(self, source):
+        # Blocking warm-up: reads and discards framesets until done
+        while not self.update(source.wait_for_frames()):
+            pass
+        source.take_drops()
+        return self
+
+    def describe(self):
+        state = ', '.join(f"{stream} exposure {history[-1][0]} gain {history[-1][1]}"
+                          for stream, history in self.history.items() if history)
+        return f"warm-up {self.reason} after {self.frames} frames ({self.elapsed:.2f} s){': ' + state if state else ''}"
@@ -0,0 +1,275 @@
+import numpy as np
+import socket
+import os
+import time
+import argparse
+
+from rgbd_protocol import (PORT, MAX_DATAGRAM, V2_HEADER_SIZE, CRC_SIZE, TIMING_FLAG_PROVISIONAL,
+                           TYPE_RGB, TYPE_DEPTH, TYPE_CALIB, CTRL_CONFIG_GET, CTRL_CONFIG_SET, CODEC_IDS, codec_id,
+                           control_port, pack_packet_v2, pack_timing)
+from rgbd_latency import now_us, control_messages
+from rgbd_codec import encode_rgb, encode_depth
+from rgbd_calibration import calibration_from_profile, pack_calibration
+from rgbd_config import add_config_arguments, config_from_args, validate_config, pack_config_message, describe
+from rgbd_capture import FrameSource, WarmUp, add_capture_arguments, sensor_stamp
+from rgbd_depth_filters import DepthFilterChain, parse_filters
+from rgbd_recording import RecordingWriter, sniff_extension
+from rgbd_fanout import DEFAULT_QUEUE_DEPTH, Consumer, FanOut
+from rgbd_net import is_multicast, configure_multicast_sender
+from rgbd_metrics import REGISTRY, RateMeter, PeriodicReport, start_http_server
+
+# One camera pipeline feeding both the network and local storage: every frame is encoded once
+# and the same payloads go to the UDP sender and the disk writer, each on its own thread.
+# The stream is protocol v2, as udp_rgbd_streamer.py sends it; recordings are the receivers'
+# --record format (or record_and_store.py's file layout with --record-dir).
+
+# Settings
+CALIB_INTERVAL = 2.0
+
+parser = argparse.ArgumentParser(description="Capture RealSense RGB-D frames once, stream and record them")
+parser.add_argument('receiver_ip', nargs='?', help="Receiver address or multicast group; omit to only record")
+add_config_arguments(parser)
+add_capture_arguments(parser)
+parser.add_argument('--record', help="Recording file, readable with rgbd_recording.py and the receivers' --play")
+parser.add_argument('--record-dir', help="Write rgb_frames/ and depth_frames/ here instead, as record_and_store.py")
+parser.add_argument('--duration', type=float, default=0, help="Seconds to capture, 0 until interrupted")
+parser.add_argument('--queue-depth', type=int, default=DEFAULT_QUEUE_DEPTH,
+                    help="Frames each output may fall behind before it drops frames")
+parser.add_argument('--depth-filters', default='',
+                    help="Pre-encode depth filters in order, e.g. decimation:2,spatial,temporal,hole")
+parser.add_argument('--depth-filter-budget', type=float, help="ms per frame; expensive filters are switched off above it")
+parser.add_argument('--port', type=int, default=PORT, help="UDP data port")
+parser.add_argument('--stream-id', type=int, default=0, help="Distinguishes cameras sharing one address")
+parser.add_argument('--crc', action='store_true', help="Checksum every packet")
+parser.add_argument('--multicast-ttl', type=int, default=1, help="Hops a multicast stream may cross")
+parser.add_argument('--multicast-if', help="IP of the interface to send multicast on")
+parser.add_argument('--metrics-port', type=int, default=9110, help="HTTP metrics port, 0 disables")
+parser.add_argument('--metrics-host', default='127.0.0.1')
+parser.add_argument('--report-interval', type=float, default=5.0, help="Seconds between console summaries")
+args = parser.parse_args()
+
+config = config_from_args(args)
+error = validate_config(config)
+if error:
+    parser.error(error)
+if not args.receiver_ip and not args.record and not args.record_dir:
+    parser.error("nothing to do: give a receiver address, --record or --record-dir")
+if args.record and args.record_dir:
+    parser.error("--record and --record-dir are exclusive")
+
+# Metrics
+frames_captured = REGISTRY.counter('rgbd_frames_captured_total', "Framesets captured and encoded")
+frames_out = REGISTRY.counter('rgbd_output_frames_total', "Frames handed to an output", ['output'])
+frames_dropped = REGISTRY.counter('rgbd_output_dropped_total', "Frames an output fell too far behind for",
+                                  ['output'])
+drops = REGISTRY.counter('rgbd_frames_dropped_total', "Frames not sent", ['stream', 'reason'])
+capture_drops = REGISTRY.counter('rgbd_capture_dropped_total', "Frames lost between the camera and encoding",
+                                 ['stream', 'reason'])
+bytes_sent = REGISTRY.counter('rgbd_bytes_sent_total', "Payload bytes sent", ['stream'])
+bytes_written = REGISTRY.counter('rgbd_bytes_written_total', "Payload bytes written to disk")
+encode_ms = REGISTRY.histogram('rgbd_encode_ms', "Encode time in ms", ['stream'])
+filter_ms = REGISTRY.histogram('rgbd_depth_filter_ms', "Depth filter time in ms", ['filter'])
+in_flight = REGISTRY.gauge('rgbd_frames_in_flight', "Encoded frames still held by an output")
+fps_gauge = REGISTRY.gauge('rgbd_fps', "Frames captured per second")
+provisional_frames = REGISTRY.counter('rgbd_provisional_frames_total', "Frames captured before warm-up ended")
+backlog_gauge = REGISTRY.gauge('rgbd_capture_backlog', "Framesets waiting in the capture queue")
+fps_meter = RateMeter()
+report = PeriodicReport(args.report_interval)
+if args.metrics_port:
+    start_http_server(args.metrics_port, args.metrics_host)
+
+depth_filters = None
+if args.depth_filters:
+    depth_filters = DepthFilterChain(parse_filters(args.depth_filters), args.depth_filter_budget, filter_ms)
+
+header_size = V2_HEADER_SIZE + (CRC_SIZE if args.crc else 0)
+
+
+def part_trailer(part, handed_us):
+    # Timing trailer for an RGB or depth part; calibration has none
+    typ, width, height, payload, codec, stamp, capture_us, encode_us = part
+    if stamp is None:
+        return b''
+    return pack_timing(stamp[0], stamp[1], capture_us, encode_us, handed_us)
+
+
+class UdpSender:
+    # Output: the frame's parts as v2 datagrams
+    def __init__(self, receiver_ip):
+        self.address = (receiver_ip, args.port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if is_multicast(receiver_ip):
+            configure_multicast_sender(self.sock, args.multicast_ttl, args.multicast_if)
+        self.seq = 0
+
+    def __call__(self, frame):
+        for part in frame.parts:
+            typ, width, height, payload, codec = part[:5]
+            name = {TYPE_RGB: 'rgb', TYPE_DEPTH: 'depth'}.get(typ, 'calibration')
+            trailer = part_trailer(part, now_us())
+            if header_size + len(payload) + len(trailer) > MAX_DATAGRAM:
+                drops.inc(stream=name, reason='too_large')
+                continue
+            self.sock.sendto(pack_packet_v2(typ, frame.frame_id, self.seq, frame.timestamp, width, height, payload,
+                                            trailer, args.stream_id, codec, args.crc), self.address)
+            self.seq += 1
+            bytes_sent.inc(len(payload), stream=name)
+        frames_out.inc(output='udp')
+
+    def close(self):
+        self.sock.close()
+
+
+class RecordingOutput:
+    # Output: the payloads as they would arrive at a receiver, into a --play-able recording
+    def __init__(self, path):
+        self.writer = RecordingWriter(path)
+
+    def __call__(self, frame):
+        for part in frame.parts:
+            typ, width, height, payload, codec = part[:5]
+            handed_us = now_us()
+            self.writer.write_payload(typ, frame.frame_id, frame.timestamp, width, height, payload,
+                                      part_trailer(part, handed_us), handed_us, stream_id=args.stream_id,
+                                      codec=codec)
+            bytes_written.inc(len(payload))
+        frames_out.inc(output='disk')
+
+    def close(self):
+        self.writer.close()
+
+
+class DirectoryOutput:
+    # Output: record_and_store.py's layout, the encoded payloads written as they are
+    def __init__(self, root):
+        self.dirs = {TYPE_RGB: ('rgb', os.path.join(root, 'rgb_frames')),
+                     TYPE_DEPTH: ('depth', os.path.join(root, 'depth_frames'))}
+        for _, path in self.dirs.values():
+            os.makedirs(path, exist_ok=True)
+
+    def __call__(self, frame):
+        for typ, width, height, payload, codec, stamp, *_ in frame.parts:
+            if typ not in self.dirs or stamp[0] & TIMING_FLAG_PROVISIONAL:
+                continue  # image files cannot carry the provisional flag
+            name, path = self.dirs[typ]
+            with open(os.path.join(path, f"{name}_{frame.frame_id:06d}{sniff_extension(payload)}"), 'wb') as f:
+                f.write(payload)
+            bytes_written.inc(len(payload))
+        frames_out.inc(output='disk')
+
+    def close(self):
+        pass
+
+
+def serve_control():
+    # Clock probes and configuration queries; the daemon does not reconfigure while recording
+    for kind, payload, addr in control_messages(ctrl_sock):
+        if kind == CTRL_CONFIG_GET:
+            ctrl_sock.sendto(pack_config_message(config, calibration, 0), addr)
+        elif kind == CTRL_CONFIG_SET:
+            ctrl_sock.sendto(pack_config_message(config, calibration, 0,
+                                                 "the capture daemon does not change settings while running"), addr)
+
+
+outputs = {}
+if args.receiver_ip:
+    outputs['udp'] = UdpSender(args.receiver_ip)
+if args.record:
+    outputs['disk'] = RecordingOutput(args.record)
+elif args.record_dir:
+    outputs['disk'] = DirectoryOutput(args.record_dir)
+fanout = FanOut([Consumer(name, output, args.queue_depth) for name, output in outputs.items()])
+consumers = dict(zip(outputs, fanout.consumers))
+
+ctrl_sock = None
+if args.receiver_ip:
+    ctrl_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ctrl_sock.bind(("", control_port(args.stream_id)))
+
+# RealSense pipeline
+pipeline = FrameSource(config, args.capture, args.frame_queue_capacity)
+warmup = WarmUp(args.warmup_timeout)
+if not args.warmup_stream:
+    print(warmup.run(pipeline).describe())
+calibration = calibration_from_profile(pipeline.profile)
+calib_bytes = pack_calibration(calibration)
+last_calib = 0.0
+
+frame_id = 0
+targets = [f"{args.receiver_ip}:{args.port}"] if args.receiver_ip else []
+targets += [path for path in (args.record, args.record_dir) if path]
+print(f"Capturing {describe(config)} to {', '.join(targets)}")
+start = time.monotonic()
+
+try:
+    while not args.duration or time.monotonic() - start < args.duration:
+        if ctrl_sock is not None:
+            serve_control()
+        frames = pipeline.wait_for_frames()
+        capture_us = now_us()
+        for (stream, reason), count in pipeline.take_drops().items():
+            capture_drops.inc(count, stream=stream, reason=reason)
+        provisional = 0
+        if not warmup.done:
+            # --warmup-stream: frames go out flagged until auto-exposure has settled
+            if warmup.update(frames):
+                print(warmup.describe())
+            else:
+                provisional = TIMING_FLAG_PROVISIONAL
+                provisional_frames.inc()
+        color_frame = frames.get_color_frame()
+        depth_frame = frames.get_depth_frame()
+        if not color_frame or not depth_frame:
+            capture_drops.inc(stream='rgbd', reason='incomplete_frameset')
+            continue
+        fps_meter.tick()
+
+        color = np.asanyarray(color_frame.get_data())  # HWC, RGB
+        depth = np.asanyarray(depth_frame.get_data())  # HW, uint16
+        if depth_filters is not None:
+            depth = depth_filters(depth)
+        encode_start_us = now_us()
+        rgb_bytes = encode_rgb(color, config['rgb_codec'])
+        rgb_encode_us = now_us()
+        encode_ms.observe((rgb_encode_us - encode_start_us) / 1000.0, stream='rgb')
+        depth_bytes = encode_depth(depth, config['depth_codec'])
+        depth_encode_us = now_us()
+        encode_ms.observe((depth_encode_us - rgb_encode_us) / 1000.0, stream='depth')
+        timestamp = int(time.time() * 1e6)
+
+        parts = []
+        if time.monotonic() - last_calib >= CALIB_INTERVAL:
+            last_calib = time.monotonic()
+            parts.append((TYPE_CALIB, config['width'], config['height'], calib_bytes, CODEC_IDS['json'], None, 0, 0))
+        parts.append((TYPE_RGB, color.shape[1], color.shape[0], rgb_bytes, codec_id(config['rgb_codec']),
+                      sensor_stamp(color_frame, provisional), capture_us, rgb_encode_us))
+        parts.append((TYPE_DEPTH, depth.shape[1], depth.shape[0], depth_bytes, codec_id(config['depth_codec']),
+                      sensor_stamp(depth_frame, provisional), capture_us, depth_encode_us))
+        fanout.publish(frame_id, timestamp, parts)
+        frames_captured.inc()
+        frame_id += 1
+
+        if report.due():
+            fps_gauge.set(fps_meter.update())
+            in_flight.set(fanout.in_flight)
+            backlog_gauge.set(pipeline.backlog())
+            for name, consumer in consumers.items():
+                frames_dropped.inc(consumer.dropped - frames_dropped.value(output=name), output=name)
+            print(f"Frame {frame_id} | {fps_gauge.value():.1f} fps"
+                  f" | encode RGB {encode_ms.mean(stream='rgb'):.1f} ms, depth {encode_ms.mean(stream='depth'):.1f} ms"
+                  f" | {capture_drops.total()} lost in capture"
+                  f" | {fanout.in_flight} in flight ({fanout.in_flight_bytes / 1024:.0f} KiB) | "
+                  + ", ".join(f"{name} {consumer.handled} done/{consumer.dropped} dropped/{consumer.backlog()} queued"
+                              for name, consumer in consumers.items()))
+except KeyboardInterrupt:
+    print("Stopped.")
+finally:
+    pipeline.stop()
+    fanout.close()
+    for output in outputs.values():
+        output.close()
+    if ctrl_sock is not None:
+        ctrl_sock.close()
+    print(f"Captured {frame_id} frames, {capture_drops.total()} lost before encoding: "
+          + ", ".join(f"{name} {consumer.handled} handled, {consumer.dropped} dropped"
+                      for name, consumer in consumers.items()))
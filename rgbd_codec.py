@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+
+# Codec specs are "name" or "name:level", e.g. "jpeg:80", "webp:60", "png:3".
+# All of them are decodable by cv2.imdecode, so the receiver needs no codec negotiation.
+RGB_CODECS = {
+    'jpeg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+DEPTH_CODECS = {
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION),
+}
+DEFAULT_RGB_CODEC = 'jpeg:80'
+DEFAULT_DEPTH_CODEC = 'png'
+
+# Decode-time downscaling. libjpeg scales JPEGs in the DCT domain, so a 1/2 or 1/4 decode
+# costs a fraction of a full one; other formats are decoded in full and resized by OpenCV.
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+DECODE_SLACK = 0.85  # accept images this much smaller than the consumer asked for
+
+
+def parse_codec(spec, codecs):
+    name, _, level = spec.partition(':')
+    if name not in codecs:
+        raise ValueError(f"Unknown codec '{name}', expected one of {sorted(codecs)}")
+    ext, param = codecs[name]
+    params = [int(param), int(level)] if level else []
+    return ext, params
+
+
+def encode_rgb(color, spec=DEFAULT_RGB_CODEC, bgr=False):
+    # color is HWC RGB as delivered by the camera, unless bgr=True
+    ext, params = parse_codec(spec, RGB_CODECS)
+    if not bgr:
+        color = cv2.cvtColor(color, cv2.COLOR_RGB2BGR)
+    _, encoded = cv2.imencode(ext, color, params)
+    return encoded.tobytes()
+
+
+def encode_depth(depth, spec=DEFAULT_DEPTH_CODEC):
+    ext, params = parse_codec(spec, DEPTH_CODECS)
+    _, encoded = cv2.imencode(ext, depth, params)
+    return encoded.tobytes()
+
+
+def decode_scale(width, height, target, slack=DECODE_SLACK):
+    # Largest reduction that keeps a width x height image at least slack * target (w, h)
+    for scale in (8, 4, 2):
+        if width / scale >= target[0] * slack and height / scale >= target[1] * slack:
+            return scale
+    return 1
+
+
+def decode_rgb(data, scale=1):
+    # Returns BGR at 1/scale of the encoded size, or None if the payload is corrupt
+    return cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_COLOR_FLAGS[scale])
+
+
+def matches_size(image, width, height, scale=1):
+    # True if image is a width x height frame decoded at 1/scale (libjpeg rounds up, OpenCV down)
+    return abs(image.shape[1] * scale - width) < scale and abs(image.shape[0] * scale - height) < scale
+
+
+def decode_depth(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
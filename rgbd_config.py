@@ -0,0 +1,156 @@
+import argparse
+import json
+import socket
+import time
+
+from rgbd_protocol import CTRL_CONFIG, CTRL_CONFIG_GET, CTRL_CONFIG_SET, control_port, pack_control, unpack_control
+from rgbd_codec import DEFAULT_RGB_CODEC, DEFAULT_DEPTH_CODEC, RGB_CODECS, DEPTH_CODECS, parse_codec
+
+# Stream settings shared by the streamer, the receivers and record_and_store.py.
+#
+# The streamer owns the live configuration. Receivers ask for it on the control port
+# (CTRL_CONFIG_GET) and may request changes (CTRL_CONFIG_SET); the streamer answers both with
+# CTRL_CONFIG: {'generation': n, 'config': {...}, 'calibration': {...}, 'error': str or None}.
+# generation increases every time the camera is restarted with new settings.
+
+DEFAULT_CONFIG = {
+    'width': 424,
+    'height': 240,
+    'fps': 30,
+    'rgb_codec': DEFAULT_RGB_CODEC,
+    'depth_codec': DEFAULT_DEPTH_CODEC,
+}
+SUPPORTED_FPS = (6, 15, 30, 60, 90)
+MAX_SIZE = (1280, 720)
+
+
+def add_config_arguments(parser, codecs=True):
+    parser.add_argument('--width', type=int, default=DEFAULT_CONFIG['width'])
+    parser.add_argument('--height', type=int, default=DEFAULT_CONFIG['height'])
+    parser.add_argument('--fps', type=int, default=DEFAULT_CONFIG['fps'])
+    if codecs:
+        parser.add_argument('--rgb-codec', default=DEFAULT_CONFIG['rgb_codec'], help="e.g. jpeg:80, webp:60")
+        parser.add_argument('--depth-codec', default=DEFAULT_CONFIG['depth_codec'], help="e.g. png, png:3")
+
+
+def config_from_args(args):
+    config = dict(DEFAULT_CONFIG)
+    for key in config:
+        if getattr(args, key, None) is not None:
+            config[key] = getattr(args, key)
+    return config
+
+
+def validate_config(config):
+    # Returns an error message, or None if the streamer can try these settings
+    try:
+        width, height, fps = int(config['width']), int(config['height']), int(config['fps'])
+        parse_codec(config['rgb_codec'], RGB_CODECS)
+        parse_codec(config['depth_codec'], DEPTH_CODECS)
+    except (KeyError, TypeError, ValueError) as e:
+        return f"invalid configuration: {e}"
+    if not (0 < width <= MAX_SIZE[0] and 0 < height <= MAX_SIZE[1]):
+        return f"resolution {width}x{height} outside 1x1..{MAX_SIZE[0]}x{MAX_SIZE[1]}"
+    if fps not in SUPPORTED_FPS:
+        return f"fps {fps} not one of {SUPPORTED_FPS}"
+    return None
+
+
+def apply_changes(config, changes):
+    # Returns (new config, error); on error the config is unchanged
+    if not isinstance(changes, dict):
+        return config, "changes must be a JSON object"
+    unknown = set(changes) - set(DEFAULT_CONFIG)
+    if unknown:
+        return config, f"unknown settings: {', '.join(sorted(unknown))}"
+    new = dict(config, **changes)
+    for key in ('width', 'height', 'fps'):
+        try:
+            new[key] = int(new[key])
+        except (TypeError, ValueError):
+            return config, f"{key} must be an integer"
+    error = validate_config(new)
+    return (config, error) if error else (new, None)
+
+
+def parse_changes(items):
+    # ["width=848", "fps=15"] -> {'width': '848', 'fps': '15'}
+    changes = {}
+    for item in items:
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"Expected key=value, got {item!r}")
+        changes[key.strip().replace('-', '_')] = value.strip()
+    return changes
+
+
+def pack_config_message(config, calibration, generation, error=None):
+    message = {'generation': generation, 'config': config, 'calibration': calibration, 'error': error}
+    return pack_control(CTRL_CONFIG, json.dumps(message, separators=(',', ':')).encode())
+
+
+def parse_config_message(payload):
+    try:
+        message = json.loads(payload.decode())
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(message, dict) or not isinstance(message.get('config'), dict):
+        return None
+    return message
+
+
+def describe(config):
+    return f"{config['width']}x{config['height']}@{config['fps']} {config['rgb_codec']}/{config['depth_codec']}"
+
+
+def start_pipeline(config, callback=None):
+    # Returns (pipeline, profile) streaming RGB and z16 depth at the configured size and rate.
+    # With a callback the SDK hands it every frameset and wait_for_frames() is not available.
+    import pyrealsense2 as rs
+    pipeline = rs.pipeline()
+    cfg = rs.config()
+    cfg.enable_stream(rs.stream.color, config['width'], config['height'], rs.format.rgb8, config['fps'])
+    cfg.enable_stream(rs.stream.depth, config['width'], config['height'], rs.format.z16, config['fps'])
+    if callback is not None:
+        return pipeline, pipeline.start(cfg, callback)
+    return pipeline, pipeline.start(cfg)
+
+
+def main():
+    # Query or change a running streamer's configuration
+    parser = argparse.ArgumentParser(description="Show or change the configuration of a running streamer")
+    parser.add_argument('streamer_ip')
+    parser.add_argument('--stream-id', type=int, default=0, help="Camera, when several stream from that address")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="e.g. --set width=848 --set height=480 --set fps=15")
+    parser.add_argument('--timeout', type=float, default=5.0, help="Seconds to wait; restarts take a while")
+    args = parser.parse_args()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(args.timeout)
+    if args.set:
+        request = pack_control(CTRL_CONFIG_SET, json.dumps(parse_changes(args.set)).encode())
+    else:
+        request = pack_control(CTRL_CONFIG_GET)
+    target = (args.streamer_ip, control_port(args.stream_id))
+    sock.sendto(request, target)
+    deadline = time.monotonic() + args.timeout
+    try:
+        while time.monotonic() < deadline:
+            parsed = unpack_control(sock.recvfrom(65536)[0])
+            if parsed is None or parsed[0] != CTRL_CONFIG:
+                continue
+            message = parse_config_message(parsed[1])
+            if message is None:
+                continue
+            if message.get('error'):
+                print(f"Rejected: {message['error']}")
+            print(f"Generation {message['generation']}: {describe(message['config'])}")
+            return
+    except socket.timeout:
+        pass
+    print(f"No answer from {target[0]}:{target[1]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import concurrent.futures
+import os
+import time
+
+from rgbd_codec import decode_rgb, decode_depth
+
+# Thread pool for payload decoding. cv2.imdecode releases the GIL, so the RGB and depth of a
+# frame, and frames of different sessions, decode on separate cores. Callers keep at most one
+# job in flight per session and consume jobs in submission order, which keeps frames ordered.
+# On a single core a pool only adds hand-off cost (bench_pipeline decode_scaling: x0.88-1.02 of
+# inline), so the default decodes inline there and uses two threads, RGB and depth side by side,
+# elsewhere. Larger pools are opt-in until decode_scaling has been measured on multi-core hosts.
+
+
+def default_workers():
+    return 0 if (os.cpu_count() or 1) < 2 else 2
+
+
+def timed_decode(function, *args):
+    start = time.perf_counter()
+    image = function(*args)
+    return image, (time.perf_counter() - start) * 1000
+
+
+class DecodeJob:
+    def __init__(self, rgb, depth):
+        self.rgb = rgb  # futures of (image or None, decode ms)
+        self.depth = depth
+
+    def done(self):
+        return self.rgb.done() and self.depth.done()
+
+    def result(self):
+        # ((rgb, rgb_ms), (depth, depth_ms)); blocks until both are decoded
+        return self.rgb.result(), self.depth.result()
+
+
+class DecodePool:
+    def __init__(self, workers=None):
+        # workers=0 decodes in the calling thread when the job is submitted
+        self.workers = default_workers() if workers is None else workers
+        self.executor = (concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='decode')
+                         if self.workers else None)
+
+    def run(self, function, *args):
+        if self.executor is not None:
+            return self.executor.submit(timed_decode, function, *args)
+        future = concurrent.futures.Future()
+        future.set_result(timed_decode(function, *args))
+        return future
+
+    def submit(self, rgb_data, depth_data, scale=1):
+        # RGB is decoded at 1/scale, see rgbd_codec.decode_rgb
+        return DecodeJob(self.run(decode_rgb, rgb_data, scale), self.run(decode_depth, depth_data))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,217 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from rgbd_codec import encode_depth
+
+# Pre-encode depth post-processing on the Pi, NumPy/OpenCV versions of the librealsense
+# decimation -> spatial -> temporal -> hole filling chain. They work on plain z16 arrays, so
+# they run the same on recorded frames and on hosts without pyrealsense2.
+# Depth 0 means no data everywhere; filters never invent depth except the hole filler.
+
+DEFAULT_BUDGET_SETTLE = 30  # frames between automatic changes
+REENABLE_HEADROOM = 0.8  # a disabled filter returns once the chain would stay under this share of the budget
+DEFAULT_RETRY_FRAMES = 300  # frames before a disabled filter is measured again; doubles while it keeps failing
+
+
+class DecimationFilter:
+    # Mean of the valid pixels in each factor x factor block; shrinks every later stage too
+    name = 'decimation'
+    can_disable = False
+
+    def __init__(self, factor=2):
+        self.factor = int(factor)
+
+    def __call__(self, depth):
+        f = self.factor
+        h, w = depth.shape[0] // f * f, depth.shape[1] // f * f
+        blocks = depth[:h, :w].reshape(h // f, f, w // f, f)
+        total = blocks.sum(axis=(1, 3), dtype=np.uint32)
+        count = np.count_nonzero(blocks, axis=(1, 3))
+        return (total // np.maximum(count, 1)).astype(np.uint16)
+
+
+class SpatialFilter:
+    # Edge-preserving smoothing: a bilateral filter whose range kernel (sigma, in depth units)
+    # keeps neighbours across depth edges and holes from mixing
+    name = 'spatial'
+    can_disable = True
+
+    def __init__(self, sigma=50, diameter=5):
+        self.sigma = float(sigma)
+        self.diameter = int(diameter)
+
+    def __call__(self, depth):
+        smoothed = cv2.bilateralFilter(depth.astype(np.float32), self.diameter, self.sigma, self.diameter)
+        return np.where(depth > 0, np.rint(smoothed), 0).astype(np.uint16)
+
+
+class TemporalFilter:
+    # Exponential average with the previous output where the change is below delta;
+    # pixels that drop out keep their last value for one frame (persistence)
+    name = 'temporal'
+    can_disable = True
+
+    def __init__(self, alpha=0.4, delta=20):
+        self.alpha = float(alpha)
+        self.delta = float(delta)
+        self.previous = None
+
+    def __call__(self, depth):
+        previous = self.previous
+        if previous is None or previous.shape != depth.shape:
+            self.previous = depth.astype(np.float32)
+            return depth
+        current = depth.astype(np.float32)
+        blend = (depth > 0) & (previous > 0) & (np.abs(current - previous) < self.delta)
+        out = np.where(blend, self.alpha * current + (1 - self.alpha) * previous, current)
+        out = np.where(depth > 0, out, previous)
+        self.previous = out.astype(np.float32)
+        self.previous[depth == 0] = 0  # persist one frame only
+        return np.rint(out).astype(np.uint16)
+
+
+class HoleFillingFilter:
+    # Fills holes up to radius pixels from valid neighbours: 'nearest' takes the closest
+    # depth around the hole, 'farthest' the most distant one
+    name = 'hole_filling'
+    can_disable = True
+
+    def __init__(self, mode='nearest', radius=2):
+        self.mode = mode
+        self.radius = int(radius)
+        self.kernel = np.ones((3, 3), np.uint8)
+
+    def __call__(self, depth):
+        if self.mode == 'farthest':
+            filled = cv2.dilate(depth, self.kernel, iterations=self.radius)
+        else:
+            marked = np.where(depth > 0, depth, np.uint16(65535))
+            filled = cv2.erode(marked, self.kernel, iterations=self.radius)
+            filled[filled == 65535] = 0
+        return np.where(depth > 0, depth, filled)
+
+
+FILTERS = {
+    'decimation': DecimationFilter,
+    'spatial': SpatialFilter,
+    'temporal': TemporalFilter,
+    'hole': HoleFillingFilter,
+}
+
+
+def parse_filters(spec):
+    # "decimation:2,spatial:50,temporal,hole:nearest" -> list of filters, applied in that order
+    filters = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, param = item.partition(':')
+        if name not in FILTERS:
+            raise ValueError(f"Unknown depth filter {name!r}, expected one of {', '.join(FILTERS)}")
+        filters.append(FILTERS[name](param) if param else FILTERS[name]())
+    return filters
+
+
+class DepthFilterChain:
+    def __init__(self, filters, budget_ms=None, metric=None, settle=DEFAULT_BUDGET_SETTLE,
+                 retry=DEFAULT_RETRY_FRAMES):
+        self.filters = filters
+        self.enabled = {f.name: True for f in filters}
+        self.cost_ms = {f.name: 0.0 for f in filters}  # moving average per filter, last known while disabled
+        self.budget_ms = budget_ms
+        self.metric = metric
+        self.settle = settle
+        self.default_retry = retry
+        self.retry = {f.name: retry for f in filters}
+        self.disabled_at = {}
+        self.enabled_at = {}  # frame each filter was last re-enabled
+        self.reseed = set()  # re-enabled filters whose next measurement replaces the old average
+        self.frames = 0
+        self.last_change = 0
+
+    def __call__(self, depth):
+        for f in self.filters:
+            if not self.enabled[f.name]:
+                continue
+            start = time.perf_counter()
+            depth = f(depth)
+            elapsed = (time.perf_counter() - start) * 1000
+            if self.frames and f.name not in self.reseed:
+                self.cost_ms[f.name] += 0.1 * (elapsed - self.cost_ms[f.name])
+            else:
+                self.cost_ms[f.name] = elapsed
+                self.reseed.discard(f.name)
+            if self.metric is not None:
+                self.metric.observe(elapsed, filter=f.name)
+        self.frames += 1
+        self.enforce_budget()
+        return depth
+
+    def total_ms(self):
+        return sum(cost for name, cost in self.cost_ms.items() if self.enabled[name])
+
+    def enforce_budget(self):
+        # Over budget on average: turn off the most expensive filter that may be turned off.
+        # Well under budget: turn the cheapest disabled filter back on. Its last cost may come
+        # from a one-off stall (GC pause, first frames), so after its retry interval it is turned
+        # on to be measured again even if that cost does not fit.
+        if self.budget_ms is None or self.frames - self.last_change < self.settle:
+            return None
+        total = self.total_ms()
+        if total > self.budget_ms:
+            candidates = [f for f in self.filters if f.can_disable and self.enabled[f.name]]
+            if not candidates:
+                return None
+            victim = max(candidates, key=lambda f: self.cost_ms[f.name])
+            self.enabled[victim.name] = False
+            if self.frames - self.enabled_at.get(victim.name, -self.default_retry) < self.retry[victim.name]:
+                self.retry[victim.name] *= 2  # over budget again soon after coming back, wait longer
+            else:
+                self.retry[victim.name] = self.default_retry
+            self.disabled_at[victim.name] = self.frames
+            self.last_change = self.frames
+            print(f"Depth filters over {self.budget_ms:.1f} ms budget, disabled {victim.name}"
+                  f" ({self.cost_ms[victim.name]:.1f} ms)")
+            return victim.name
+        disabled = [f for f in self.filters if not self.enabled[f.name]]
+        if not disabled:
+            return None
+        name = min(disabled, key=lambda f: self.cost_ms[f.name]).name
+        if (total + self.cost_ms[name] > self.budget_ms * REENABLE_HEADROOM
+                and self.frames - self.disabled_at[name] < self.retry[name]):
+            return None
+        self.enabled[name] = True
+        self.enabled_at[name] = self.frames
+        self.reseed.add(name)
+        self.last_change = self.frames
+        print(f"Depth filters at {total:.1f} ms of {self.budget_ms:.1f} ms budget, re-enabled {name}"
+              f" (last {self.cost_ms[name]:.1f} ms)")
+        return name
+
+    def summary(self):
+        return ', '.join(f"{name} {self.cost_ms[name]:.1f} ms" + ('' if self.enabled[name] else ' (off)')
+                         for name in self.cost_ms)
+
+
+def main():
+    # Cost and compressed-size effect of a filter chain on recorded depth frames
+    parser = argparse.ArgumentParser(description="Measure a depth filter chain on saved depth PNGs")
+    parser.add_argument('frames', nargs='+', help="16-bit depth PNG files, e.g. from record_and_store.py")
+    parser.add_argument('--filters', default='decimation:2,spatial,temporal,hole')
+    parser.add_argument('--depth-codec', default='png')
+    args = parser.parse_args()
+
+    chain = DepthFilterChain(parse_filters(args.filters))
+    raw_bytes = filtered_bytes = 0
+    for path in args.frames:
+        depth = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        raw_bytes += len(encode_depth(depth, args.depth_codec))
+        filtered_bytes += len(encode_depth(chain(depth), args.depth_codec))
+    count = len(args.frames)
+    print(f"{count} frames | {chain.summary()}")
+    print(f"Encoded depth {raw_bytes / count / 1024:.1f} KiB -> {filtered_bytes / count / 1024:.1f} KiB per frame")
+
+
+if __name__ == '__main__':
+    main()
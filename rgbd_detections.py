@@ -0,0 +1,212 @@
+import argparse
+import json
+import math
+import socket
+import struct
+import sys
+import time
+
+# Detection output for headless receivers: one record per processed frame, as JSON lines or
+# packed binary, written to a file, stdout ('-'), udp://host:port (one record per datagram)
+# or tcp://host:port (records back to back; reconnects if the consumer goes away). File and
+# stdout records are flushed as they are written, so readers tailing them see every frame.
+#
+# Binary record: RECORD_FORMAT header, then count x DETECTION_FORMAT. Distances and positions
+# are NaN when depth was not available for a box.
+#
+# Frames the streamer sent during camera warm-up (--warmup-stream) are marked provisional: their
+# exposure had not settled, so consumers may want to ignore their detections.
+
+DETECTION_MAGIC = b'DET2'
+RECORD_FORMAT = '<4s4sHHIQBH'  # magic, source IPv4, source port, stream_id, frame_id, timestamp us, flags, count
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+DETECTION_FORMAT = '<hhHHHfffff'  # x, y, w, h, class_id, confidence, depth_m, X, Y, Z (m)
+DETECTION_SIZE = struct.calcsize(DETECTION_FORMAT)
+MAX_DETECTIONS = 1000  # keeps a binary record inside one datagram
+RECONNECT_INTERVAL = 1.0
+FORMATS = ('json', 'binary')
+
+RECORD_FLAG_PROVISIONAL = 0x01
+
+
+def detection_record(source, frame_id, timestamp, detections, provisional=False):
+    # source: (ip, port, stream_id) as in the async receiver's session key
+    return {
+        'source': f'{source[0]}:{source[1]}',
+        'stream_id': source[2],
+        'frame_id': frame_id,
+        'timestamp': timestamp,
+        'provisional': provisional,
+        'detections': [{
+            'box': [int(v) for v in det['box']],
+            'class_id': det['class_id'],
+            'label': det['label'],
+            'confidence': round(float(det['confidence']), 4),
+            'depth_m': det.get('depth_m'),
+            'xyz': det.get('xyz'),
+        } for det in detections],
+    }
+
+
+def pack_detections(source, frame_id, timestamp, detections, provisional=False):
+    detections = detections[:MAX_DETECTIONS]
+    flags = RECORD_FLAG_PROVISIONAL if provisional else 0
+    parts = [struct.pack(RECORD_FORMAT, DETECTION_MAGIC, socket.inet_aton(source[0]), source[1], source[2],
+                         frame_id, timestamp, flags, len(detections))]
+    nan = float('nan')
+    for det in detections:
+        depth_m = det.get('depth_m')
+        xyz = det.get('xyz') or (nan, nan, nan)
+        parts.append(struct.pack(DETECTION_FORMAT, *(int(v) for v in det['box']), det['class_id'],
+                                 det['confidence'], nan if depth_m is None else depth_m, *xyz))
+    return b''.join(parts)
+
+
+def unpack_detections(data, offset=0):
+    # Returns (record like detection_record() without labels, next offset), or None if incomplete
+    if len(data) - offset < RECORD_SIZE:
+        return None
+    magic, ip, port, stream_id, frame_id, timestamp, flags, count = struct.unpack_from(RECORD_FORMAT, data, offset)
+    if magic != DETECTION_MAGIC:
+        raise ValueError("not a detection record")
+    end = offset + RECORD_SIZE + count * DETECTION_SIZE
+    if len(data) < end:
+        return None
+    detections = []
+    for index in range(count):
+        x, y, w, h, class_id, confidence, depth_m, *xyz = struct.unpack_from(
+            DETECTION_FORMAT, data, offset + RECORD_SIZE + index * DETECTION_SIZE)
+        detections.append({
+            'box': [x, y, w, h],
+            'class_id': class_id,
+            'confidence': round(confidence, 4),
+            'depth_m': None if math.isnan(depth_m) else round(depth_m, 4),
+            'xyz': None if math.isnan(xyz[2]) else [round(c, 4) for c in xyz],
+        })
+    record = {'source': f'{socket.inet_ntoa(ip)}:{port}', 'stream_id': stream_id, 'frame_id': frame_id,
+              'timestamp': timestamp, 'provisional': bool(flags & RECORD_FLAG_PROVISIONAL), 'detections': detections}
+    return record, end
+
+
+class DetectionWriter:
+    def __init__(self, target, fmt=None):
+        # fmt defaults to binary for *.bin targets, JSON lines otherwise
+        self.target = target
+        self.format = fmt or ('binary' if target.endswith('.bin') else 'json')
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown detection format {self.format!r}, expected one of {', '.join(FORMATS)}")
+        self.records = 0
+        self.dropped = 0
+        self.file = self.sock = self.address = None
+        self.last_connect = 0.0
+        self.scheme, _, rest = target.partition('://') if '://' in target else ('file', '', target)
+        if self.scheme in ('udp', 'tcp'):
+            host, _, port = rest.rpartition(':')
+            self.address = (host or '127.0.0.1', int(port))
+            if self.scheme == 'udp':
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        elif self.scheme != 'file':
+            raise ValueError(f"Unsupported detection target {target!r}")
+        elif target == '-':
+            self.file = sys.__stdout__.buffer  # the real stdout, see console_to_stderr()
+        else:
+            self.file = open(target, 'wb')
+
+    def connect(self):
+        # TCP only; retried at most every RECONNECT_INTERVAL, records in between are dropped
+        now = time.monotonic()
+        if now - self.last_connect < RECONNECT_INTERVAL:
+            return False
+        self.last_connect = now
+        try:
+            self.sock = socket.create_connection(self.address, timeout=RECONNECT_INTERVAL)
+        except OSError:
+            return False
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        print(f"Sending detections to tcp://{self.address[0]}:{self.address[1]}")
+        return True
+
+    def write(self, source, frame_id, timestamp, detections, provisional=False):
+        if self.format == 'binary':
+            data = pack_detections(source, frame_id, timestamp, detections, provisional)
+        else:
+            data = json.dumps(detection_record(source, frame_id, timestamp, detections, provisional),
+                              separators=(',', ':')).encode() + b'\n'
+        try:
+            if self.file is not None:
+                self.file.write(data)
+                self.file.flush()
+            elif self.scheme == 'udp':
+                self.sock.sendto(data, self.address)
+            else:
+                if self.sock is None and not self.connect():
+                    self.dropped += 1
+                    return
+                self.sock.sendall(data)
+        except OSError:
+            self.dropped += 1
+            if self.scheme == 'tcp' and self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            return
+        self.records += 1
+
+    def close(self):
+        if self.file is not None and self.file is not sys.__stdout__.buffer:
+            self.file.close()
+        if self.sock is not None:
+            self.sock.close()
+
+
+def console_to_stderr(target):
+    # Records written to stdout ('-') must not mix with the receivers' status lines
+    if target == '-':
+        sys.stdout = sys.stderr
+
+
+def read_detections(path):
+    # Yields records from a file written by DetectionWriter, in either format
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(DETECTION_MAGIC):
+        offset = 0
+        while True:
+            parsed = unpack_detections(data, offset)
+            if parsed is None:
+                return
+            record, offset = parsed
+            yield record
+    else:
+        for line in data.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def main():
+    # Print detection records as JSON lines, from a file or as they arrive on a UDP port
+    parser = argparse.ArgumentParser(description="Print detection records from a file or a UDP port")
+    parser.add_argument('source', help="File written with --detections-out, or a UDP port number to listen on")
+    args = parser.parse_args()
+
+    if not args.source.isdigit():
+        for record in read_detections(args.source):
+            print(json.dumps(record))
+        return
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('', int(args.source)))
+    try:
+        while True:
+            data = sock.recv(65536)
+            try:
+                record = unpack_detections(data)[0] if data.startswith(DETECTION_MAGIC) else json.loads(data)
+            except (TypeError, ValueError):
+                continue  # truncated or foreign datagram
+            print(json.dumps(record), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import time
+
+import cv2
+import numpy as np
+
+from grape_detector import draw_detections
+
+# Display stage for the receivers. Frames are shrunk to the window size before anything is
+# drawn, overlays go on that copy (the decoded frame stays clean for inference, shared memory
+# and point clouds), and windows refresh at most max_fps times a second whatever the stream rate.
+
+DEFAULT_DISPLAY_FPS = 60
+
+
+def fit_size(width, height, max_size):
+    # Largest size with the frame's aspect ratio inside max_size (w, h); never upscales
+    ratio = min(max_size[0] / width, max_size[1] / height, 1.0)
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+
+class DisplayStage:
+    def __init__(self, max_size, max_fps=DEFAULT_DISPLAY_FPS, suffix=''):
+        self.max_size = max_size
+        self.period = 1.0 / max_fps if max_fps else 0.0
+        self.suffix = suffix  # appended to the window names, e.g. ' <session>'
+        self.last_render = 0.0
+
+    def due(self):
+        return time.monotonic() - self.last_render >= self.period
+
+    def show(self, rgb, depth, detections=(), stream_size=None):
+        # stream_size: (w, h) the detection boxes refer to, default the rgb size.
+        # Returns True if the windows were updated, False if throttled.
+        if not self.due():
+            return False
+        self.last_render = time.monotonic()
+        if rgb is not None:
+            size = fit_size(rgb.shape[1], rgb.shape[0], self.max_size)
+            if size != rgb.shape[1::-1]:
+                small = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+            else:
+                small = rgb.copy()
+            scale = (stream_size or rgb.shape[1::-1])[0] / size[0]
+            cv2.imshow('RGB' + self.suffix, draw_detections(small, detections, scale))
+        if depth is not None:
+            size = fit_size(depth.shape[1], depth.shape[0], self.max_size)
+            if size != depth.shape[1::-1]:
+                depth = cv2.resize(depth, size, interpolation=cv2.INTER_NEAREST)
+            d_norm = cv2.normalize(depth, None, 255, 0, cv2.NORM_MINMAX).astype(np.uint8)
+            cv2.imshow('Depth' + self.suffix, cv2.applyColorMap(d_norm, cv2.COLORMAP_JET))
+        return True
@@ -0,0 +1,106 @@
+import queue
+import threading
+
+# Hands each encoded frame to several consumers (UDP sender, disk writer) from one capture loop.
+# A frame is encoded once and shared: every consumer holds a reference, and the payloads are
+# released when the last one is done with them. Each consumer has its own bounded queue and
+# thread, so a slow consumer loses frames (counted) instead of stalling capture or the others.
+
+DEFAULT_QUEUE_DEPTH = 8
+
+
+class SharedFrame:
+    def __init__(self, frame_id, timestamp, parts, on_release=None):
+        # parts: [(type, width, height, payload, codec, (timing flags, sensor_us), capture_us, encode_us)]
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.parts = parts
+        self.size = sum(len(part[3]) for part in parts)
+        self.on_release = on_release
+        self.refs = 1  # the publisher's
+        self.lock = threading.Lock()
+
+    def retain(self):
+        with self.lock:
+            self.refs += 1
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            last = self.refs == 0
+        if last:
+            self.parts = None
+            if self.on_release is not None:
+                self.on_release(self)
+
+
+class Consumer:
+    def __init__(self, name, handle, depth=DEFAULT_QUEUE_DEPTH):
+        # handle(frame) runs on the consumer's thread, in publish order
+        self.name = name
+        self.handle = handle
+        self.queue = queue.Queue(depth)
+        self.handled = 0
+        self.dropped = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def offer(self, frame):
+        frame.retain()
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            frame.release()
+            self.dropped += 1
+            return False
+        return True
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            try:
+                self.handle(frame)
+                self.handled += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"{self.name}: {e}")
+            finally:
+                frame.release()
+
+    def backlog(self):
+        return self.queue.qsize()
+
+    def stop(self):
+        # Lets the consumer finish what is queued
+        self.queue.put(None)
+        self.thread.join()
+
+
+class FanOut:
+    def __init__(self, consumers):
+        self.consumers = consumers
+        self.lock = threading.Lock()
+        self.in_flight = 0  # frames still referenced by a consumer
+        self.in_flight_bytes = 0
+
+    def publish(self, frame_id, timestamp, parts):
+        frame = SharedFrame(frame_id, timestamp, parts, self.released)
+        with self.lock:
+            self.in_flight += 1
+            self.in_flight_bytes += frame.size
+        for consumer in self.consumers:
+            consumer.offer(frame)
+        frame.release()
+        return frame
+
+    def released(self, frame):
+        with self.lock:
+            self.in_flight -= 1
+            self.in_flight_bytes -= frame.size
+
+    def close(self):
+        for consumer in self.consumers:
+            consumer.stop()
@@ -0,0 +1,154 @@
+import bisect
+import collections
+import select
+import struct
+import time
+
+from rgbd_protocol import (CTRL_CLOCK_PROBE, CTRL_CLOCK_REPLY, CLOCK_PROBE_FORMAT, CLOCK_REPLY_FORMAT,
+                           TIMING_FLAG_GLOBAL_CLOCK, pack_control, unpack_control)
+
+
+def now_us():
+    return time.time_ns() // 1000
+
+
+# Clock offset between Pi and host, NTP style. t0/t3 are host clock, t1/t2 Pi clock.
+# The sample with the smallest round trip is the least disturbed by queuing, so it wins.
+class ClockOffsetEstimator:
+    def __init__(self, window=32):
+        self.samples = collections.deque(maxlen=window)
+
+    def make_probe(self):
+        return pack_control(CTRL_CLOCK_PROBE, struct.pack(CLOCK_PROBE_FORMAT, now_us()))
+
+    def add_reply(self, payload, t3=None):
+        t3 = now_us() if t3 is None else t3
+        t0, t1, t2 = struct.unpack(CLOCK_REPLY_FORMAT, payload[:struct.calcsize(CLOCK_REPLY_FORMAT)])
+        delay = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self.samples.append((delay, offset))
+
+    @property
+    def ready(self):
+        return bool(self.samples)
+
+    @property
+    def offset_us(self):
+        # Pi clock minus host clock
+        return min(self.samples)[1] if self.samples else 0.0
+
+    @property
+    def rtt_us(self):
+        return min(self.samples)[0] if self.samples else 0.0
+
+    def to_host(self, pi_us):
+        return pi_us - self.offset_us
+
+
+def make_clock_reply(payload, t1):
+    t0, = struct.unpack(CLOCK_PROBE_FORMAT, payload[:struct.calcsize(CLOCK_PROBE_FORMAT)])
+    return pack_control(CTRL_CLOCK_REPLY, struct.pack(CLOCK_REPLY_FORMAT, t0, t1, now_us()))
+
+
+def control_messages(sock):
+    # Non-blocking: yields (kind, payload, addr) for the control messages already queued on the
+    # Pi's control socket. Clock probes are answered here, stamped as soon as they are read.
+    while select.select([sock], [], [], 0)[0]:
+        message, addr = sock.recvfrom(2048)
+        t1 = now_us()
+        parsed = unpack_control(message)
+        if parsed is None:
+            continue
+        kind, payload = parsed
+        if kind == CTRL_CLOCK_PROBE:
+            sock.sendto(make_clock_reply(payload, t1), addr)
+        else:
+            yield kind, payload, addr
+
+
+# Fixed buckets in milliseconds plus a window of recent samples for percentiles
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf'))
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=BUCKETS_MS, window=1000):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.recent = collections.deque(maxlen=window)
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.recent.append(ms)
+
+    def percentile(self, p):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+# (name, start stage, end stage). sensor/capture/encode/send are stamped on the Pi,
+# the rest on the host.
+STAGES = (
+    ('sensor_to_capture', 'sensor', 'capture'),
+    ('capture_to_encode', 'capture', 'encode'),
+    ('encode_to_send', 'encode', 'send'),
+    ('network', 'send', 'receive'),
+    ('decode', 'receive', 'decode'),
+    ('inference', 'decode', 'inference'),
+    ('display', 'inference', 'display'),
+    ('end_to_end', 'sensor', 'display'),
+)
+PI_STAGES = ('sensor', 'capture', 'encode', 'send')
+
+
+class StageLatency:
+    def __init__(self, clock, report_interval=5.0, metric=None):
+        # metric: optional rgbd_metrics.Histogram labelled by stage, for the metrics endpoint
+        self.clock = clock
+        self.metric = metric
+        self.histograms = collections.OrderedDict((name, LatencyHistogram()) for name, _, _ in STAGES)
+        self.report_interval = report_interval
+        self.last_report = time.monotonic()
+
+    def record(self, timing):
+        # timing maps stage name to microseconds; Pi stamps come straight from the trailer
+        stamps = dict(timing)
+        if not stamps.get('flags', 0) & TIMING_FLAG_GLOBAL_CLOCK:
+            stamps.pop('sensor', None)  # device clock, not comparable
+        for name, start, end in STAGES:
+            if name == 'end_to_end' and 'sensor' not in stamps:
+                start = 'capture'
+            begin, finish = stamps.get(start), stamps.get(end)
+            if begin is None or finish is None:
+                continue
+            if (start in PI_STAGES) != (end in PI_STAGES):
+                if not self.clock.ready:
+                    continue
+                begin = self.clock.to_host(begin)
+            ms = (finish - begin) / 1000.0
+            self.histograms[name].record(ms)
+            if self.metric is not None:
+                self.metric.observe(ms, stage=name)
+
+    def summary(self):
+        lines = [f"Latency ms (clock offset {self.clock.offset_us / 1000:.2f} ms, rtt {self.clock.rtt_us / 1000:.2f} ms)"]
+        for name, hist in self.histograms.items():
+            if hist.count:
+                lines.append(f"  {name:<18} p50 {hist.percentile(50):7.2f}  p90 {hist.percentile(90):7.2f}"
+                             f"  p99 {hist.percentile(99):7.2f}  n={hist.count}")
+        return '\n'.join(lines)
+
+    def maybe_report(self):
+        now = time.monotonic()
+        if now - self.last_report >= self.report_interval:
+            self.last_report = now
+            print(self.summary())
@@ -0,0 +1,35 @@
+import ipaddress
+import socket
+import struct
+
+
+def is_multicast(ip):
+    try:
+        return ipaddress.ip_address(ip).is_multicast
+    except ValueError:
+        return False  # hostname
+
+
+def configure_multicast_sender(sock, ttl=1, interface=None, loop=True):
+    # ttl 1 keeps the stream on the local subnet; raise it only if routers should forward it
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1 if loop else 0)
+    if interface:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+
+
+def open_receiver_socket(port, group=None, interface=None, rcvbuf=None):
+    # Unicast: plain bind on port. Multicast: several receivers on one host may share the port,
+    # and the socket joins group on interface (default: whatever the routing table picks).
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if group:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('', port))
+    if group:
+        mreq = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface or '0.0.0.0'))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    return sock
@@ -0,0 +1,161 @@
+import argparse
+import struct
+
+import numpy as np
+
+from rgbd_align import pixel_rays
+from rgbd_calibration import scaled_intrinsics
+
+# Depth (+ color) -> XYZ(RGB) point arrays.
+#
+# Rays through every pixel are computed once per resolution, so a frame costs one masked
+# multiply. Depth registered to the color image (what the receivers display) uses the color
+# intrinsics and its colors are a plain per-pixel lookup.
+#
+# Stream file: magic(8s), then one record per frame:
+# frame_id(uint32), timestamp(uint64), count(uint32), flags(uint8), scale(float32)
+# followed by count x int16 xyz (scale metres per unit) and, with FLAG_COLOR, count x uint8 rgb.
+
+STREAM_MAGIC = b'RGBDPCL1'
+RECORD_FORMAT = '<IQIBf'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+FLAG_COLOR = 0x01
+DEFAULT_SCALE = 0.001  # 1 mm steps, +-32 m range
+
+
+class PointCloudBuilder:
+    def __init__(self, intr, depth_scale):
+        self.intr = intr
+        self.depth_scale = depth_scale
+        self.cache = {}  # depth shape -> rays (2, h*w)
+
+    @classmethod
+    def from_calibration(cls, calib, aligned=True):
+        # aligned: the depth frames are registered to the color image
+        intr = calib['color_intrinsics'] if aligned else calib['depth_intrinsics']
+        return cls(intr, calib['depth_scale'])
+
+    def rays(self, shape):
+        rays = self.cache.get(shape)
+        if rays is None:
+            self.cache[shape] = rays = pixel_rays(scaled_intrinsics(self.intr, shape[1], shape[0]))
+        return rays
+
+    def points(self, depth, color=None, max_depth=None):
+        # Returns (N, 3) float32 metres and (N, 3) uint8 RGB or None. color is BGR, same size as depth.
+        rays = self.rays(depth.shape)
+        flat = depth.ravel()
+        valid = flat > 0
+        if max_depth is not None:
+            valid &= flat <= max_depth / self.depth_scale
+        index = np.flatnonzero(valid)
+        z = flat[index].astype(np.float32) * self.depth_scale
+        xyz = np.empty((len(index), 3), np.float32)
+        xyz[:, 0] = rays[0, index] * z
+        xyz[:, 1] = rays[1, index] * z
+        xyz[:, 2] = z
+        colors = None
+        if color is not None:
+            colors = color.reshape(-1, 3)[index, ::-1]
+        return xyz, colors
+
+
+def voxel_downsample(points, colors=None, voxel=0.01):
+    # One averaged point (and color) per occupied voxel of edge voxel metres
+    if not len(points):
+        return points, colors
+    # 21 bits per axis: +-10 km at 1 cm voxels
+    cells = np.floor(points.T / voxel).astype(np.int64) + (1 << 20)
+    keys = (cells[0] << 42) | (cells[1] << 21) | cells[2]
+    # One sort groups points by voxel; bincount then averages each group per column
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    new_voxel = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    inverse = np.empty(len(keys), np.intp)
+    inverse[order] = np.cumsum(new_voxel) - 1
+    counts = np.bincount(inverse)
+
+    def average(values):
+        return np.stack([np.bincount(inverse, values[:, axis], len(counts)) / counts
+                         for axis in range(values.shape[1])], axis=1)
+
+    points = average(points).astype(np.float32)
+    if colors is not None:
+        colors = np.rint(average(colors)).astype(np.uint8)
+    return points, colors
+
+
+def write_ply(path, points, colors=None):
+    # Binary little-endian PLY, readable by Open3D, MeshLab, CloudCompare
+    properties = ['property float x', 'property float y', 'property float z']
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    if colors is not None:
+        properties += ['property uchar red', 'property uchar green', 'property uchar blue']
+        fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    vertices = np.empty(len(points), dtype=fields)
+    vertices['x'], vertices['y'], vertices['z'] = points[:, 0], points[:, 1], points[:, 2]
+    if colors is not None:
+        vertices['red'], vertices['green'], vertices['blue'] = colors[:, 0], colors[:, 1], colors[:, 2]
+    header = '\n'.join(['ply', 'format binary_little_endian 1.0', f'element vertex {len(points)}',
+                        *properties, 'end_header']) + '\n'
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(vertices.tobytes())
+
+
+def pack_pointcloud(frame_id, timestamp, points, colors=None, scale=DEFAULT_SCALE):
+    quantized = np.clip(np.rint(points / scale), -32768, 32767).astype('<i2')
+    flags = FLAG_COLOR if colors is not None else 0
+    parts = [struct.pack(RECORD_FORMAT, frame_id, timestamp, len(points), flags, scale), quantized.tobytes()]
+    if colors is not None:
+        parts.append(np.ascontiguousarray(colors, np.uint8).tobytes())
+    return b''.join(parts)
+
+
+class PointCloudStreamWriter:
+    def __init__(self, path, scale=DEFAULT_SCALE):
+        self.file = open(path, 'wb')
+        self.file.write(STREAM_MAGIC)
+        self.scale = scale
+        self.frames = 0
+
+    def write(self, frame_id, timestamp, points, colors=None):
+        self.file.write(pack_pointcloud(frame_id, timestamp, points, colors, self.scale))
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_pointcloud_stream(path):
+    # Yields (frame_id, timestamp, points float32 (N, 3), colors uint8 (N, 3) or None)
+    with open(path, 'rb') as f:
+        if f.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+            raise ValueError(f"{path} is not a point cloud stream")
+        while True:
+            record = f.read(RECORD_SIZE)
+            if len(record) < RECORD_SIZE:
+                return
+            frame_id, timestamp, count, flags, scale = struct.unpack(RECORD_FORMAT, record)
+            points = np.frombuffer(f.read(count * 6), '<i2').reshape(count, 3).astype(np.float32) * scale
+            colors = None
+            if flags & FLAG_COLOR:
+                colors = np.frombuffer(f.read(count * 3), np.uint8).reshape(count, 3)
+            yield frame_id, timestamp, points, colors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export frames of a point cloud stream to PLY")
+    parser.add_argument('stream')
+    parser.add_argument('--ply-prefix', default='cloud', help="Write <prefix>_<frame_id>.ply per frame")
+    parser.add_argument('--every', type=int, default=1, help="Export every Nth frame")
+    args = parser.parse_args()
+
+    for index, (frame_id, _, points, colors) in enumerate(read_pointcloud_stream(args.stream)):
+        if index % args.every == 0:
+            write_ply(f"{args.ply_prefix}_{frame_id}.ply", points, colors)
+            print(f"Frame {frame_id}: {len(points)} points")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import struct
+import zlib
+
+try:
+    from crc32c import crc32c  # optional, hardware-accelerated CRC32C
+except ImportError:
+    crc32c = None
+
+PORT = 9999
+CONTROL_PORT = PORT + 1
+MAX_DATAGRAM = 65507
+
+# Header: frame_id(uint32), type(uint8), timestamp(uint64), width(uint16), height(uint16), data_size(uint32)
+HEADER_FORMAT = '<IBQHHI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+TYPE_RGB = 0
+TYPE_DEPTH = 1
+TYPE_CALIB = 2  # JSON camera calibration, see rgbd_calibration
+
+# Protocol v2 header, told apart from v1 by magic and version:
+# magic(4s), version(uint8), type(uint8), codec(uint8), flags(uint8), stream_id(uint16),
+# frag_index(uint16), frag_count(uint16), header_check(uint16), seq(uint32), frame_id(uint32),
+# timestamp(uint64), width(uint16), height(uint16), data_size(uint32)
+# seq counts every datagram of one stream (sender socket + stream_id), so receivers can measure
+# loss and reordering. The payload is followed by exactly the trailers the flags announce.
+# With a CRC flag a uint32 checksum follows the header; it covers the header and everything
+# after the checksum. CRC32C needs the crc32c package, senders without it use zlib CRC-32.
+# Which checksum applies depends on the flags, so CRC packets also carry header_check, the low
+# 16 bits of the zlib CRC-32 of the header with header_check 0. It does not depend on the
+# flags, so a corrupted flags byte cannot switch the verification off. Without a CRC flag
+# header_check is 0.
+V2_MAGIC = b'RGD2'
+V2_VERSION = 2
+V2_FORMAT = '<4sBBBBHHHHIIQHHI'
+V2_STRUCT = struct.Struct(V2_FORMAT)
+V2_HEADER_SIZE = V2_STRUCT.size
+CRC_SIZE = 4
+FLAG_TIMING = 0x01  # stage timing trailer follows the payload
+FLAG_CRC32C = 0x02
+FLAG_CRC32 = 0x04
+CRC_FLAGS = FLAG_CRC32C | FLAG_CRC32
+KNOWN_FLAGS = FLAG_TIMING | CRC_FLAGS
+HEADER_CHECK_OFFSET = 14
+CODEC_IDS = {'raw': 0, 'jpeg': 1, 'webp': 2, 'png': 3, 'json': 4}
+CODEC_NAMES = {value: name for name, value in CODEC_IDS.items()}
+SEQ_MODULO = 1 << 32
+
+# Stage timing trailer, appended after the payload so receivers that only read
+# data_size bytes of payload keep working.
+# magic(2s), flags(uint8), sensor_us(uint64), capture_us(uint64), encode_us(uint64), send_us(uint64)
+TIMING_MAGIC = b'RT'
+TIMING_FORMAT = '<2sBQQQQ'
+TIMING_SIZE = struct.calcsize(TIMING_FORMAT)
+TIMING_FLAG_GLOBAL_CLOCK = 0x01  # sensor_us is in the Pi system clock domain
+TIMING_FLAG_PROVISIONAL = 0x02  # sent during camera warm-up, auto-exposure had not settled
+
+# Control channel messages travel on control_port(stream_id), CONTROL_PORT for stream 0, so
+# streamers for several cameras on one host each have their own: magic(4s), kind(uint8), payload
+CONTROL_MAGIC = b'RGBC'
+CONTROL_FORMAT = '<4sB'
+CONTROL_SIZE = struct.calcsize(CONTROL_FORMAT)
+CTRL_CLOCK_PROBE = 1  # payload: t0(uint64), host clock at send
+CTRL_CLOCK_REPLY = 2  # payload: t0, t1, t2(uint64), Pi clock at receive and reply
+CTRL_ROI = 3  # payload: frame width, height, count (uint16 x3), then count boxes x, y (int16), w, h (uint16)
+CTRL_CONFIG_GET = 4  # receiver asks for the stream configuration, empty payload
+CTRL_CONFIG_SET = 5  # receiver asks for changes, payload: JSON {key: value}, see rgbd_config
+CTRL_CONFIG = 6  # streamer announces its configuration, payload: JSON, see rgbd_config
+CLOCK_PROBE_FORMAT = '<Q'
+CLOCK_REPLY_FORMAT = '<QQQ'
+ROI_FORMAT = '<HHH'
+ROI_BOX_FORMAT = '<hhHH'
+
+
+def pack_header(frame_id, typ, timestamp, width, height, data_size):
+    return struct.pack(HEADER_FORMAT, frame_id, typ, timestamp, width, height, data_size)
+
+
+def unpack_header(packet):
+    return struct.unpack(HEADER_FORMAT, packet[:HEADER_SIZE])
+
+
+def control_port(stream_id=0):
+    return CONTROL_PORT + stream_id
+
+
+def codec_id(spec):
+    # "jpeg:80" -> CODEC_IDS['jpeg']
+    return CODEC_IDS.get(spec.partition(':')[0], CODEC_IDS['raw'])
+
+
+def checksum(flags, data, value=0):
+    if flags & FLAG_CRC32C and crc32c is not None:
+        return crc32c(data, value)
+    return zlib.crc32(data, value)
+
+
+def header_check(header):
+    # zlib CRC-32 of a v2 header with its header_check field zeroed, low 16 bits
+    value = zlib.crc32(header[:HEADER_CHECK_OFFSET])
+    value = zlib.crc32(header[HEADER_CHECK_OFFSET + 2:V2_HEADER_SIZE], zlib.crc32(b'\0\0', value))
+    return value & 0xFFFF
+
+
+def pack_packet_v2(typ, frame_id, seq, timestamp, width, height, payload, trailer=b'', stream_id=0, codec=0,
+                   crc=False, frag_index=0, frag_count=1):
+    flags = FLAG_TIMING if trailer else 0
+    if crc:
+        flags |= FLAG_CRC32C if crc32c is not None else FLAG_CRC32
+    fields = [V2_MAGIC, V2_VERSION, typ, codec, flags, stream_id, frag_index, frag_count, 0,
+              seq % SEQ_MODULO, frame_id, timestamp, width, height, len(payload)]
+    header = V2_STRUCT.pack(*fields)
+    if not crc:
+        return b''.join((header, payload, trailer))
+    fields[8] = header_check(header)
+    header = V2_STRUCT.pack(*fields)
+    value = checksum(flags, trailer, checksum(flags, payload, checksum(flags, header)))
+    return b''.join((header, struct.pack('<I', value), payload, trailer))
+
+
+class Packet:
+    # One parsed datagram of either protocol version; v1 packets get stream_id 0 and seq None
+    __slots__ = ('version', 'type', 'frame_id', 'timestamp', 'width', 'height', 'data', 'trailer',
+                 'stream_id', 'seq', 'codec', 'flags', 'frag_index', 'frag_count')
+
+    def __init__(self, version, typ, frame_id, timestamp, width, height, data, trailer,
+                 stream_id=0, seq=None, codec=0, flags=0, frag_index=0, frag_count=1):
+        self.version = version
+        self.type = typ
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.width = width
+        self.height = height
+        self.data = data
+        self.trailer = trailer
+        self.stream_id = stream_id
+        self.seq = seq
+        self.codec = codec
+        self.flags = flags
+        self.frag_index = frag_index
+        self.frag_count = frag_count
+
+
+def unpack_packet(packet, verify_crc=True):
+    # Parses a v1 or v2 datagram. Raises ValueError whose message is the drop reason:
+    # too_small, incomplete, bad_flags, bad_header, bad_length or bad_crc. CRC32C payloads
+    # are only verified when crc32c is installed; their header_check always is.
+    if packet[:4] == V2_MAGIC and len(packet) > 4 and packet[4] == V2_VERSION:
+        if len(packet) < V2_HEADER_SIZE:
+            raise ValueError('too_small')
+        (_, version, typ, codec, flags, stream_id, frag_index, frag_count, check, seq, frame_id, timestamp,
+         width, height, data_size) = V2_STRUCT.unpack_from(packet)
+        if flags & ~KNOWN_FLAGS or flags & CRC_FLAGS == CRC_FLAGS:
+            raise ValueError('bad_flags')
+        start = V2_HEADER_SIZE
+        if (flags & CRC_FLAGS or check) and verify_crc and check != header_check(packet):
+            # Also catches a CRC flag flipped on (header_check 0) or off (header_check left set)
+            raise ValueError('bad_header')
+        if flags & CRC_FLAGS:
+            start += CRC_SIZE
+            if len(packet) < start:
+                raise ValueError('too_small')
+            if verify_crc and (flags & FLAG_CRC32 or crc32c is not None):
+                view = memoryview(packet)
+                value = checksum(flags, view[start:], checksum(flags, view[:V2_HEADER_SIZE]))
+                if value != struct.unpack_from('<I', packet, V2_HEADER_SIZE)[0]:
+                    raise ValueError('bad_crc')
+        data = packet[start:start + data_size]
+        if len(data) != data_size:
+            raise ValueError('incomplete')
+        trailer = packet[start + data_size:]
+        if len(trailer) != (TIMING_SIZE if flags & FLAG_TIMING else 0):
+            raise ValueError('bad_length')
+        return Packet(version, typ, frame_id, timestamp, width, height, data, trailer,
+                      stream_id, seq, codec, flags, frag_index, frag_count)
+    if len(packet) < HEADER_SIZE:
+        raise ValueError('too_small')
+    frame_id, typ, timestamp, width, height, data_size = unpack_header(packet)
+    data = packet[HEADER_SIZE:HEADER_SIZE + data_size]
+    if len(data) != data_size:
+        raise ValueError('incomplete')
+    # v1 has no flags: the payload is followed by nothing or a timing trailer. This also keeps
+    # v2 packets with a corrupted magic from passing as v1.
+    trailer = packet[HEADER_SIZE + data_size:]
+    if trailer and (len(trailer) != TIMING_SIZE or trailer[:2] != TIMING_MAGIC):
+        raise ValueError('bad_length')
+    return Packet(1, typ, frame_id, timestamp, width, height, data, trailer)
+
+
+class SequenceTracker:
+    # Loss, reordering and duplication of one stream's v2 packets from their sequence numbers.
+    # Skipped seqs are remembered (the newest MISSING_WINDOW of them) so a late arrival only
+    # cancels a loss that was actually counted; anything else behind the stream is a duplicate.
+    RESET_GAP = 10000  # a jump this large means the sender restarted
+    MISSING_WINDOW = 1024
+
+    def __init__(self):
+        self.expected = None
+        self.missing = {}  # seqs counted lost, oldest first
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+
+    def restart(self, seq):
+        self.expected = (seq + 1) % SEQ_MODULO
+        self.missing.clear()
+
+    def update(self, seq):
+        # Returns (change in lost, reordered, duplicate) for this packet
+        if seq is None:
+            return 0, False, False
+        if self.expected is None:
+            self.restart(seq)
+            return 0, False, False
+        gap = (seq - self.expected) % SEQ_MODULO
+        if gap < self.RESET_GAP:
+            for skipped in range(max(0, gap - self.MISSING_WINDOW), gap):
+                self.missing[(self.expected + skipped) % SEQ_MODULO] = True
+            while len(self.missing) > self.MISSING_WINDOW:
+                del self.missing[next(iter(self.missing))]
+            self.expected = (seq + 1) % SEQ_MODULO
+            self.lost += gap
+            return gap, False, False
+        if SEQ_MODULO - gap <= self.RESET_GAP:
+            if self.missing.pop(seq, None):
+                # Arrived after later packets: it was counted lost when they came
+                self.lost -= 1
+                self.reordered += 1
+                return -1, True, False
+            self.duplicates += 1
+            return 0, False, True
+        self.restart(seq)
+        return 0, False, False
+
+
+def pack_timing(flags, sensor_us, capture_us, encode_us, send_us):
+    return struct.pack(TIMING_FORMAT, TIMING_MAGIC, flags, sensor_us, capture_us, encode_us, send_us)
+
+
+def unpack_timing(trailer):
+    # Returns None when the sender did not attach a timing trailer
+    if len(trailer) < TIMING_SIZE:
+        return None
+    magic, flags, sensor_us, capture_us, encode_us, send_us = struct.unpack(TIMING_FORMAT, trailer[:TIMING_SIZE])
+    if magic != TIMING_MAGIC:
+        return None
+    return {
+        'flags': flags,
+        'sensor': sensor_us,
+        'capture': capture_us,
+        'encode': encode_us,
+        'send': send_us,
+    }
+
+
+def pack_control(kind, payload=b''):
+    return struct.pack(CONTROL_FORMAT, CONTROL_MAGIC, kind) + payload
+
+
+def unpack_control(message):
+    # Returns (kind, payload) or None for anything that is not a control message
+    if len(message) < CONTROL_SIZE:
+        return None
+    magic, kind = struct.unpack(CONTROL_FORMAT, message[:CONTROL_SIZE])
+    if magic != CONTROL_MAGIC:
+        return None
+    return kind, message[CONTROL_SIZE:]
@@ -0,0 +1,237 @@
+import argparse
+import collections
+import os
+import socket
+import struct
+import time
+
+from rgbd_protocol import TYPE_RGB, TYPE_DEPTH, TYPE_CALIB, CODEC_NAMES, pack_packet_v2
+
+# Receiver-side recording: the payloads that passed the receiver's checks, stored exactly as
+# received (no decode, no re-encode), followed by an index so players can seek by frame.
+#
+# File: magic(8s), start_us(uint64), records, then the index:
+#   record: RECORD_FORMAT header, payload, timing trailer (as sent by the streamer)
+#   index:  INDEX_FORMAT entry per record, then FOOTER_FORMAT (index offset, entry count, magic)
+# A recording that was not closed cleanly has no footer; readers rebuild the index by scanning.
+
+RECORDING_MAGIC = b'RGBDREC1'
+FILE_HEADER_FORMAT = '<8sQ'
+RECORD_FORMAT = '<QQ4sHHBBIHHII'  # receive_us, timestamp, src ip, src port, stream_id, type, codec,
+                                  # frame_id, width, height, payload length, trailer length
+INDEX_FORMAT = '<QIHB'  # record offset, frame_id, stream_id, type
+FOOTER_FORMAT = '<QI8s'
+FILE_HEADER_SIZE = struct.calcsize(FILE_HEADER_FORMAT)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+FOOTER_SIZE = struct.calcsize(FOOTER_FORMAT)
+INDEX_MAGIC = b'RGBDIDX1'
+RECORD_TYPES = (TYPE_RGB, TYPE_DEPTH, TYPE_CALIB)
+
+Record = collections.namedtuple('Record', 'receive_us timestamp addr stream_id type codec frame_id width height '
+                                          'data trailer')
+
+
+class RecordingWriter:
+    # Appends one record per accepted packet; buffered so the receive loop only pays for a memcpy
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self.file = open(path, 'wb', buffering=buffer_size)
+        self.file.write(struct.pack(FILE_HEADER_FORMAT, RECORDING_MAGIC, time.time_ns() // 1000))
+        self.offset = FILE_HEADER_SIZE
+        self.index = []
+        self.frames = set()
+        self.bytes = 0
+
+    def write(self, parsed, addr, receive_us):
+        # parsed: rgbd_protocol.Packet
+        self.write_payload(parsed.type, parsed.frame_id, parsed.timestamp, parsed.width, parsed.height, parsed.data,
+                           parsed.trailer, receive_us, addr, parsed.stream_id, parsed.codec)
+
+    def write_payload(self, typ, frame_id, timestamp, width, height, data, trailer=b'', receive_us=0,
+                      addr=('0.0.0.0', 0), stream_id=0, codec=0):
+        header = struct.pack(RECORD_FORMAT, receive_us, timestamp, socket.inet_aton(addr[0]), addr[1], stream_id,
+                             typ, codec, frame_id, width, height, len(data), len(trailer))
+        self.file.write(header)
+        self.file.write(data)
+        self.file.write(trailer)
+        self.index.append((self.offset, frame_id, stream_id, typ))
+        self.offset += len(header) + len(data) + len(trailer)
+        self.bytes += len(data)
+        if typ == TYPE_RGB:
+            self.frames.add((addr, stream_id, frame_id))
+
+    def close(self):
+        for entry in self.index:
+            self.file.write(struct.pack(INDEX_FORMAT, *entry))
+        self.file.write(struct.pack(FOOTER_FORMAT, self.offset, len(self.index), INDEX_MAGIC))
+        self.file.close()
+
+
+class RecordingReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        magic, self.start_us = struct.unpack(FILE_HEADER_FORMAT, self.file.read(FILE_HEADER_SIZE))
+        if magic != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not an RGB-D recording")
+        self.index, self.end = self.load_index()
+
+    def load_index(self):
+        # Returns ([(offset, frame_id, stream_id, type)], end of the records)
+        size = os.fstat(self.file.fileno()).st_size
+        if size >= FILE_HEADER_SIZE + FOOTER_SIZE:
+            self.file.seek(size - FOOTER_SIZE)
+            index_offset, count, magic = struct.unpack(FOOTER_FORMAT, self.file.read(FOOTER_SIZE))
+            if magic == INDEX_MAGIC and index_offset + count * INDEX_SIZE + FOOTER_SIZE == size:
+                self.file.seek(index_offset)
+                data = self.file.read(count * INDEX_SIZE)
+                return list(struct.iter_unpack(INDEX_FORMAT, data)), index_offset
+        # No footer: the receiver was killed; scan the records up to the last complete one
+        index = []
+        offset = FILE_HEADER_SIZE
+        self.file.seek(offset)
+        while True:
+            header = self.file.read(RECORD_SIZE)
+            if len(header) < RECORD_SIZE:
+                break
+            fields = struct.unpack(RECORD_FORMAT, header)
+            length = RECORD_SIZE + fields[-2] + fields[-1]
+            if offset + length > size or fields[5] not in RECORD_TYPES or fields[0] < self.start_us:
+                break  # truncated record, or the start of a partly written index
+            index.append((offset, fields[7], fields[4], fields[5]))
+            offset += length
+            self.file.seek(offset)
+        return index, offset
+
+    def read(self, offset):
+        self.file.seek(offset)
+        fields = struct.unpack(RECORD_FORMAT, self.file.read(RECORD_SIZE))
+        receive_us, timestamp, ip, port, stream_id, typ, codec, frame_id, width, height, length, trailer = fields
+        data = self.file.read(length)
+        return Record(receive_us, timestamp, (socket.inet_ntoa(ip), port), stream_id, typ, codec, frame_id,
+                      width, height, data, self.file.read(trailer))
+
+    def records(self, start_frame=None):
+        # Records in arrival order, optionally from the first record of start_frame on
+        first = 0
+        if start_frame is not None:
+            first = next((i for i, entry in enumerate(self.index) if entry[1] >= start_frame), len(self.index))
+        for entry in self.index[first:]:
+            yield self.read(entry[0])
+
+    def frame_ids(self, typ=TYPE_RGB):
+        return sorted({entry[1] for entry in self.index if entry[3] == typ})
+
+    def close(self):
+        self.file.close()
+
+
+def schedule(reader, speed=1.0, start_frame=None, loop=False):
+    # Yields (offset s, packet, addr): the records rebuilt as v2 datagrams and when to deliver
+    # them relative to the start, from the recorded arrival times (speed 2 = twice as fast,
+    # 0 = as fast as possible). Looped passes continue the frame_ids so receivers do not treat
+    # them as stale.
+    seq = collections.Counter()
+    base = offset = 0.0
+    shift = next_shift = 0
+    while True:
+        first_us = None
+        for record in reader.records(start_frame):
+            if first_us is None:
+                first_us = record.receive_us
+            if speed > 0:
+                offset = base + (record.receive_us - first_us) / 1e6 / speed
+            key = (record.addr, record.stream_id)
+            frame_id = record.frame_id + shift
+            next_shift = max(next_shift, frame_id + 1)
+            packet = pack_packet_v2(record.type, frame_id, seq[key], record.timestamp, record.width,
+                                    record.height, record.data, record.trailer, record.stream_id, record.codec)
+            seq[key] += 1
+            yield offset, packet, record.addr
+        if not loop or first_us is None:
+            return
+        base, shift = offset, next_shift
+
+
+def play(reader, speed=1.0, start_frame=None, loop=False):
+    # Yields (packet, addr) at the scheduled times, for a receiver's normal packet path
+    start = time.perf_counter()
+    for offset, packet, addr in schedule(reader, speed, start_frame, loop):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        yield packet, addr
+
+
+def sniff_extension(data):
+    if data.startswith(b'\xff\xd8'):
+        return '.jpg'
+    if data.startswith(b'\x89PNG'):
+        return '.png'
+    if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return '.webp'
+    return '.bin'
+
+
+def export(reader, root):
+    # Payloads as files in record_and_store.py's layout (rgb_frames/, depth_frames/), byte for byte
+    names = {TYPE_RGB: 'rgb', TYPE_DEPTH: 'depth'}
+    for name in names.values():
+        os.makedirs(os.path.join(root, f'{name}_frames'), exist_ok=True)
+    count = 0
+    for record in reader.records():
+        name = names.get(record.type)
+        if name is None:
+            continue
+        path = os.path.join(root, f'{name}_frames', f'{name}_{record.frame_id:06d}{sniff_extension(record.data)}')
+        with open(path, 'wb') as f:
+            f.write(record.data)
+        count += 1
+    return count
+
+
+def info(reader):
+    counts = collections.Counter()
+    payload = collections.Counter()
+    codecs = collections.Counter()
+    first_us = last_us = None
+    for record in reader.records():
+        first_us = record.receive_us if first_us is None else first_us
+        last_us = record.receive_us
+        counts[record.type] += 1
+        payload[record.type] += len(record.data)
+        codecs[(record.type, CODEC_NAMES.get(record.codec, record.codec))] += 1
+    duration = (last_us - first_us) / 1e6 if first_us is not None else 0.0
+    frames = len(reader.frame_ids())
+    print(f"{reader.path}: {frames} frames, {len(reader.index)} records over {duration:.1f} s"
+          f" ({frames / duration if duration else 0:.1f} fps)")
+    names = {TYPE_RGB: 'rgb', TYPE_DEPTH: 'depth', TYPE_CALIB: 'calibration'}
+    for typ, count in sorted(counts.items()):
+        print(f"  {names.get(typ, typ)}: {count} records, {payload[typ] / count / 1024:.1f} KiB average")
+    for (typ, codec), count in sorted(codecs.items(), key=str):
+        print(f"  {names.get(typ, typ)} codec {codec}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or export recordings written with --record")
+    sub = parser.add_subparsers(dest='command', required=True)
+    info_parser = sub.add_parser('info', help="Summarize a recording")
+    info_parser.add_argument('path')
+    export_parser = sub.add_parser('export', help="Write the payloads as image files without re-encoding")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--out', default='.', help="Directory for rgb_frames/ and depth_frames/")
+    args = parser.parse_args()
+
+    reader = RecordingReader(args.path)
+    try:
+        if args.command == 'info':
+            info(reader)
+        else:
+            print(f"Exported {export(reader, args.out)} payloads to {args.out}")
+    finally:
+        reader.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import struct
+import time
+
+import cv2
+import numpy as np
+
+from rgbd_protocol import CTRL_ROI, ROI_FORMAT, ROI_BOX_FORMAT, pack_control
+from rgbd_codec import encode_rgb
+
+# Region-of-interest RGB encoding. The regions (receiver detections fed back over the control
+# channel, and/or a static mask) keep full detail; everything else is replaced by a
+# downscaled-and-upscaled copy, which has almost no high-frequency content and so costs few
+# JPEG bits. The result is still one ordinary JPEG, so receivers need no changes.
+
+ROI_TIMEOUT = 1.0  # feedback older than this is ignored and frames go out at full detail
+DEFAULT_MARGIN = 0.25  # grow boxes by this fraction on each side to cover motion until the next update
+DEFAULT_BACKGROUND_SCALE = 0.25
+DEFAULT_REFRESH = 15  # every Nth frame goes out at full detail so new grapes can be detected
+MAX_ROI_BOXES = 256
+
+
+def pack_roi(boxes, width, height):
+    # boxes: [x, y, w, h] in a width x height frame
+    boxes = boxes[:MAX_ROI_BOXES]
+    payload = struct.pack(ROI_FORMAT, width, height, len(boxes))
+    payload += b''.join(struct.pack(ROI_BOX_FORMAT, *(int(v) for v in box)) for box in boxes)
+    return pack_control(CTRL_ROI, payload)
+
+
+def unpack_roi(payload):
+    # Returns (width, height, boxes) or None if malformed
+    header = struct.calcsize(ROI_FORMAT)
+    box_size = struct.calcsize(ROI_BOX_FORMAT)
+    if len(payload) < header:
+        return None
+    width, height, count = struct.unpack(ROI_FORMAT, payload[:header])
+    if len(payload) < header + count * box_size or not width or not height:
+        return None
+    boxes = [list(struct.unpack_from(ROI_BOX_FORMAT, payload, header + i * box_size)) for i in range(count)]
+    return width, height, boxes
+
+
+def load_mask(path):
+    mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise ValueError(f"Cannot read ROI mask {path}")
+    return mask
+
+
+class RoiEncoder:
+    def __init__(self, spec, static_mask=None, feedback=True, margin=DEFAULT_MARGIN,
+                 background_scale=DEFAULT_BACKGROUND_SCALE, refresh=DEFAULT_REFRESH):
+        self.spec = spec
+        self.static_mask = static_mask  # grayscale, non-zero = ROI; resized to the frame
+        self.feedback = feedback
+        self.margin = margin
+        self.background_scale = background_scale
+        self.refresh = refresh
+        self.boxes = None  # (width, height, boxes) from the receiver
+        self.updated = 0.0
+        self.frames = 0
+        self.mask_cache = None
+
+    def update(self, payload):
+        parsed = unpack_roi(payload)
+        if parsed is not None and self.feedback:
+            self.boxes = parsed
+            self.updated = time.monotonic()
+
+    def mask(self, shape):
+        # Boolean ROI mask for a frame of this shape, or None to send the full frame
+        height, width = shape[:2]
+        fresh = self.boxes is not None and time.monotonic() - self.updated <= ROI_TIMEOUT
+        if self.static_mask is None and not fresh:
+            return None
+        if self.static_mask is not None:
+            if self.mask_cache is None or self.mask_cache.shape != (height, width):
+                self.mask_cache = cv2.resize(self.static_mask, (width, height), interpolation=cv2.INTER_NEAREST) > 0
+            mask = self.mask_cache.copy()
+        else:
+            mask = np.zeros((height, width), bool)
+        if fresh:
+            box_w, box_h, boxes = self.boxes
+            sx, sy = width / box_w, height / box_h
+            for x, y, w, h in boxes:
+                x0 = int(max(0, (x - self.margin * w) * sx))
+                y0 = int(max(0, (y - self.margin * h) * sy))
+                x1 = int(min(width, (x + w * (1 + self.margin)) * sx + 1))
+                y1 = int(min(height, (y + h * (1 + self.margin)) * sy + 1))
+                mask[y0:y1, x0:x1] = True
+        return mask
+
+    def compose(self, color, mask):
+        height, width = color.shape[:2]
+        small = cv2.resize(color, None, fx=self.background_scale, fy=self.background_scale,
+                           interpolation=cv2.INTER_AREA)
+        out = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+        np.copyto(out, color, where=mask[:, :, None])
+        return out
+
+    def encode(self, color, bgr=False):
+        # Returns (encoded bytes, True if ROI encoding was applied)
+        self.frames += 1
+        if self.refresh and self.frames % self.refresh == 0:
+            return encode_rgb(color, self.spec, bgr), False
+        mask = self.mask(color.shape)
+        if mask is None:
+            return encode_rgb(color, self.spec, bgr), False
+        return encode_rgb(self.compose(color, mask), self.spec, bgr), True
@@ -0,0 +1,205 @@
+import argparse
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Single-writer, multi-reader ring of decoded frames in shared memory.
+#
+# Ring header: magic(8s), slots(uint32), slot_size(uint32), max rgb h/w, max depth h/w (uint16 x4),
+#              head(uint64) = sequence number of the newest published frame (0 = none yet)
+# Slot header: lock(uint64) seqlock, odd while the writer is inside the slot
+#              seq(uint64), frame_id(uint32), timestamp(uint64), rgb h/w, depth h/w (uint16 x4)
+# followed by the RGB (uint8 HWC, BGR) and depth (uint16 HW) pixels.
+# timestamp is the stream timestamp from the packet header (us, streamer clock), the same in
+# both receivers.
+#
+# Readers never write. They read the lock, use the data, and re-check the lock: if it moved,
+# the writer lapped them and the frame must be discarded. Python gives no memory fences, but
+# every field is written by a single memcpy-sized store in program order, and readers
+# validate with the lock afterwards, which is enough on x86 and in practice on ARM64.
+
+RING_MAGIC = b'RGBDRNG1'
+RING_FORMAT = '<8sIIHHHHQ'
+RING_HEADER_SIZE = 64
+HEAD_OFFSET = struct.calcsize(RING_FORMAT) - 8
+SLOT_FORMAT = '<QQIQHHHH'
+SLOT_HEADER_SIZE = 64
+
+
+class FrameView:
+    def __init__(self, ring, slot, lock, seq, frame_id, timestamp, rgb, depth):
+        self.ring = ring
+        self.slot = slot
+        self.lock = lock
+        self.seq = seq
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+        self.rgb = rgb
+        self.depth = depth
+
+    def valid(self):
+        # True while the writer has not started overwriting this slot
+        return self.ring._lock(self.slot) == self.lock
+
+
+class ShmFrameRing:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        magic, self.slots, self.slot_size, rgb_h, rgb_w, depth_h, depth_w, _ = struct.unpack_from(RING_FORMAT, shm.buf)
+        if magic != RING_MAGIC:
+            raise ValueError(f"{shm.name} is not an RGB-D frame ring")
+        self.max_rgb = (rgb_h, rgb_w)
+        self.max_depth = (depth_h, depth_w)
+        self.seq = struct.unpack_from('<Q', shm.buf, HEAD_OFFSET)[0]
+        self.missed = 0
+
+    @classmethod
+    def create(cls, name, slots=8, max_rgb=(720, 1280), max_depth=(720, 1280)):
+        slot_size = SLOT_HEADER_SIZE + max_rgb[0] * max_rgb[1] * 3 + max_depth[0] * max_depth[1] * 2
+        slot_size = (slot_size + 63) // 64 * 64
+        try:
+            # A receiver that crashed leaves its ring behind; take the name over
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=RING_HEADER_SIZE + slots * slot_size)
+        struct.pack_into(RING_FORMAT, shm.buf, 0, RING_MAGIC, slots, slot_size, *max_rgb, *max_depth, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        # Readers are unrelated processes: before Python 3.13 their resource tracker would
+        # unlink the receiver's segment when they exit, so opt out of tracking.
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            from multiprocessing import resource_tracker
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def _offset(self, slot):
+        return RING_HEADER_SIZE + slot * self.slot_size
+
+    def _lock(self, slot):
+        return struct.unpack_from('<Q', self.shm.buf, self._offset(slot))[0]
+
+    def head(self):
+        return struct.unpack_from('<Q', self.shm.buf, HEAD_OFFSET)[0]
+
+    def publish(self, frame_id, timestamp, rgb, depth):
+        # Writer side; returns the sequence number given to the frame
+        rgb_shape = rgb.shape[:2] if rgb is not None else (0, 0)
+        depth_shape = depth.shape if depth is not None else (0, 0)
+        if rgb_shape[0] * rgb_shape[1] > self.max_rgb[0] * self.max_rgb[1] or \
+                depth_shape[0] * depth_shape[1] > self.max_depth[0] * self.max_depth[1]:
+            raise ValueError(f"Frame {rgb_shape}/{depth_shape} does not fit ring slots {self.max_rgb}/{self.max_depth}")
+        self.seq += 1
+        slot = self.seq % self.slots
+        offset = self._offset(slot)
+        lock = self._lock(slot)
+        struct.pack_into('<Q', self.shm.buf, offset, lock + 1)
+        struct.pack_into(SLOT_FORMAT, self.shm.buf, offset, lock + 1, self.seq, frame_id, timestamp,
+                         *rgb_shape, *depth_shape)
+        rgb_view, depth_view = self._views(offset, rgb_shape, depth_shape)
+        if rgb is not None:
+            rgb_view[...] = rgb
+        if depth is not None:
+            depth_view[...] = depth
+        struct.pack_into('<Q', self.shm.buf, offset, lock + 2)
+        struct.pack_into('<Q', self.shm.buf, HEAD_OFFSET, self.seq)
+        return self.seq
+
+    def _views(self, offset, rgb_shape, depth_shape):
+        base = offset + SLOT_HEADER_SIZE
+        rgb = np.ndarray((*rgb_shape, 3), np.uint8, self.shm.buf, base)
+        depth = np.ndarray(depth_shape, np.uint16, self.shm.buf, base + self.max_rgb[0] * self.max_rgb[1] * 3)
+        return rgb, depth
+
+    def read(self, seq=None):
+        # Zero-copy read of frame seq (default: newest). Returns None if it is not available,
+        # being written, or already overwritten. Check view.valid() after using the arrays.
+        seq = self.head() if seq is None else seq
+        if seq == 0:
+            return None
+        slot = seq % self.slots
+        offset = self._offset(slot)
+        lock, slot_seq, frame_id, timestamp, rgb_h, rgb_w, depth_h, depth_w = \
+            struct.unpack_from(SLOT_FORMAT, self.shm.buf, offset)
+        if lock % 2 or slot_seq != seq:
+            return None
+        rgb, depth = self._views(offset, (rgb_h, rgb_w), (depth_h, depth_w))
+        view = FrameView(self, slot, lock, seq, frame_id, timestamp, rgb if rgb_h else None, depth if depth_h else None)
+        return view if view.valid() else None
+
+    def read_copy(self, seq=None):
+        # Copying read, validated after the copy
+        view = self.read(seq)
+        if view is None:
+            return None
+        rgb = view.rgb.copy() if view.rgb is not None else None
+        depth = view.depth.copy() if view.depth is not None else None
+        if not view.valid():
+            return None
+        view.rgb, view.depth = rgb, depth
+        return view
+
+    def follow(self, poll_interval=0.001):
+        # Yields every frame from now on; counts frames lost to the writer lapping us in .missed
+        seq = self.head()
+        while True:
+            head = self.head()
+            if head <= seq:
+                time.sleep(poll_interval)
+                continue
+            if head - seq > self.slots - 1:
+                self.missed += head - seq - (self.slots - 1)
+                seq = head - (self.slots - 1)
+            else:
+                seq += 1
+            view = self.read(seq)
+            if view is None:
+                self.missed += 1
+                continue
+            yield view
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a frame ring published by the receiver")
+    parser.add_argument('name')
+    parser.add_argument('--report-interval', type=float, default=1.0)
+    args = parser.parse_args()
+
+    ring = ShmFrameRing.attach(args.name)
+    count = 0
+    last = time.monotonic()
+    try:
+        for view in ring.follow():
+            count += 1
+            now = time.monotonic()
+            if now - last >= args.report_interval:
+                rgb_shape = view.rgb.shape if view.rgb is not None else None
+                depth_shape = view.depth.shape if view.depth is not None else None
+                print(f"seq {view.seq} frame {view.frame_id} | {count / (now - last):.1f} fps"
+                      f" | rgb {rgb_shape} depth {depth_shape} | missed {ring.missed}")
+                count = 0
+                last = now
+            del view
+    except KeyboardInterrupt:
+        print("Stopped.")
+    finally:
+        ring.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import multiprocessing as mp
+import queue
+import signal
+import time
+import zlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from rgbd_codec import decode_rgb, decode_depth
+from rgbd_latency import now_us
+from grape_detector import load_yolo, detect
+from grape_localize import localize
+from rgbd_align import DepthToColorAligner
+
+# Decode + inference in worker processes. Sessions are pinned to a worker by hash so
+# per-session frame order is kept. Compressed payloads go to workers over a queue (small,
+# cheap to pickle); decoded frames come back through per-worker shared-memory slots, and
+# only their shape and the detections are pickled.
+#
+# A worker that dies (OOM kill, a native crash in cv2) is restarted on its shared memory and
+# gets all its slots back; frames it had in flight are lost. Results carry the worker's
+# generation, so late results from the dead process are discarded. A worker that keeps dying
+# (MAX_RESTARTS within RESTART_WINDOW seconds) stops the pool with RuntimeError.
+
+MAX_WIDTH = 1280
+MAX_HEIGHT = 720
+MAX_RESTARTS = 5
+RESTART_WINDOW = 60.0
+
+
+def slot_views(buf, slot, slot_size, rgb_shape, depth_shape, depth_dtype=np.uint16):
+    # numpy views over one slot: RGB (uint8 HWC) first, depth right after it
+    base = slot * slot_size
+    rgb_bytes = int(np.prod(rgb_shape)) if rgb_shape else 0
+    rgb = np.ndarray(rgb_shape, np.uint8, buf, base) if rgb_shape else None
+    depth = np.ndarray(depth_shape, depth_dtype, buf, base + rgb_bytes) if depth_shape else None
+    return rgb, depth
+
+
+def worker_main(index, generation, shm_name, slot_size, jobs, results, detect_enabled):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C goes to the supervisor, which shuts us down
+    # Spawned workers share the supervisor's resource tracker, which unlinks the segment once
+    shm = shared_memory.SharedMemory(name=shm_name)
+    net, classes = load_yolo() if detect_enabled else (None, None)
+    aligners = {}  # session -> DepthToColorAligner, rebuilt when the calibration changes
+    parent = mp.parent_process()
+    try:
+        while True:
+            try:
+                job = jobs.get(timeout=1.0)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    break  # supervisor died without shutting us down
+                continue
+            if job is None:
+                break
+            session, frame_id, slot, rgb_data, depth_data, timing, calib, scale, size = job
+            start = time.perf_counter()
+            rgb = decode_rgb(rgb_data, scale)
+            depth = decode_depth(depth_data)
+            if calib is not None and rgb is not None and depth is not None:
+                aligner = aligners.get(session)
+                if aligner is None or aligner.calib != calib:
+                    aligner = aligners[session] = DepthToColorAligner(calib)
+                depth = aligner.align(depth, (rgb.shape[1], rgb.shape[0]))
+            decoded = time.perf_counter()
+            rgb_shape = rgb.shape if rgb is not None else None
+            depth_shape = depth.shape if depth is not None else None
+            if sum(image.nbytes for image in (rgb, depth) if image is not None) > slot_size:
+                results.put((index, generation, session, frame_id, slot, None, None, [], timing, scale, size, 0.0,
+                             0.0, 'too_large'))
+                continue
+            rgb_view, depth_view = slot_views(shm.buf, slot, slot_size, rgb_shape, depth_shape)
+            if rgb is not None:
+                rgb_view[...] = rgb
+            if depth is not None:
+                depth_view[...] = depth
+            detections = []
+            if net is not None and rgb is not None:
+                detections = detect(rgb_view, net, classes, scale)
+                if calib is not None and depth is not None:
+                    localize(detections, depth, calib, size)
+            done = time.perf_counter()
+            # Same host clock as the supervisor, so queueing time lands in the decode stage
+            timing['inference'] = now_us()
+            timing['decode'] = timing['inference'] - int((done - decoded) * 1e6)
+            results.put((index, generation, session, frame_id, slot, rgb_shape, depth_shape, detections, timing,
+                         scale, size, (decoded - start) * 1000, (done - decoded) * 1000, None))
+            del rgb_view, depth_view
+    finally:
+        shm.close()
+
+
+class WorkerPool:
+    def __init__(self, workers, detect=True, slots=4, max_width=MAX_WIDTH, max_height=MAX_HEIGHT):
+        self.ctx = mp.get_context('spawn')
+        self.detect = detect
+        self.slot_size = max_width * max_height * (3 + 2)
+        self.slots = slots
+        self.results = self.ctx.Queue()
+        self.workers = []
+        for index in range(workers):
+            shm = shared_memory.SharedMemory(create=True, size=self.slot_size * slots)
+            worker = {'shm': shm, 'generation': 0, 'restarts': []}
+            self.workers.append(worker)
+            self.start_worker(index)
+
+    def start_worker(self, index):
+        # (Re)starts a worker process on its shared memory with every slot free
+        worker = self.workers[index]
+        worker['jobs'] = self.ctx.Queue()
+        worker['free'] = list(range(self.slots))
+        worker['process'] = self.ctx.Process(target=worker_main, daemon=True,
+                                             args=(index, worker['generation'], worker['shm'].name, self.slot_size,
+                                                   worker['jobs'], self.results, self.detect))
+        worker['process'].start()
+
+    def check_workers(self):
+        for index, worker in enumerate(self.workers):
+            process = worker['process']
+            if process.is_alive():
+                continue
+            now = time.monotonic()
+            worker['restarts'] = [t for t in worker['restarts'] if now - t < RESTART_WINDOW] + [now]
+            if len(worker['restarts']) > MAX_RESTARTS:
+                raise RuntimeError(f"Worker {index} died {len(worker['restarts'])} times in {RESTART_WINDOW:.0f} s "
+                                   f"(last exit code {process.exitcode})")
+            print(f"Worker {index} exited with code {process.exitcode}; restarting it, "
+                  f"{self.slots - len(worker['free'])} frames in flight are lost")
+            worker['jobs'].cancel_join_thread()
+            worker['jobs'].close()
+            worker['generation'] += 1
+            self.start_worker(index)
+
+    def worker_for(self, session):
+        return zlib.crc32(session.encode()) % len(self.workers)
+
+    def submit(self, session, frame_id, rgb_data, depth_data, timing, calib=None, scale=1, size=None):
+        # size is the stream (width, height); RGB is decoded at 1/scale of it
+        # False when the session's worker has no free slot (it is behind); the caller drops the frame
+        worker = self.workers[self.worker_for(session)]
+        if not worker['free']:
+            return False
+        slot = worker['free'].pop()
+        worker['jobs'].put((session, frame_id, slot, rgb_data, depth_data, timing, calib, scale, size))
+        return True
+
+    def poll(self):
+        # Yields finished frames as dicts; 'rgb' and 'depth' are views into shared memory,
+        # valid until release(result) is called.
+        self.check_workers()
+        while True:
+            try:
+                (index, generation, session, frame_id, slot, rgb_shape, depth_shape, detections, timing, scale, size,
+                 dec_ms, inf_ms, error) = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if generation != self.workers[index]['generation']:
+                continue  # from a worker that died since; its slots were reclaimed
+            rgb, depth = slot_views(self.workers[index]['shm'].buf, slot, self.slot_size, rgb_shape, depth_shape)
+            yield {'worker': index, 'slot': slot, 'session': session, 'frame_id': frame_id, 'rgb': rgb,
+                   'depth': depth, 'detections': detections, 'timing': timing, 'scale': scale, 'size': size,
+                   'decode_ms': dec_ms,
+                   'inference_ms': inf_ms, 'error': error}
+
+    def release(self, result):
+        self.workers[result['worker']]['free'].append(result['slot'])
+
+    def close(self):
+        for worker in self.workers:
+            worker['jobs'].put(None)
+        for worker in self.workers:
+            worker['process'].join(timeout=5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+            worker['shm'].close()
+            worker['shm'].unlink()
@@ -0,0 +1,53 @@
+import numpy as np
+
+from rgbd_align import DepthToColorAligner
+
+# D435 at 424x240: wide depth FOV (~87 deg), narrower color FOV (~69 deg), 15 mm baseline
+DEPTH_INTRINSICS = {'width': 424, 'height': 240, 'ppx': 212.6, 'ppy': 119.4, 'fx': 213.3, 'fy': 213.3,
+                    'model': 'brown_conrady', 'coeffs': [0, 0, 0, 0, 0]}
+COLOR_INTRINSICS = {'width': 424, 'height': 240, 'ppx': 213.2, 'ppy': 121.8, 'fx': 306.9, 'fy': 306.7,
+                    'model': 'inverse_brown_conrady', 'coeffs': [0, 0, 0, 0, 0]}
+CALIBRATION = {
+    'depth_intrinsics': DEPTH_INTRINSICS,
+    'color_intrinsics': COLOR_INTRINSICS,
+    'depth_to_color': {'rotation': [0.99999, 0.0038, -0.0021, -0.0038, 0.99999, 0.0012, 0.0021, -0.0012, 0.99999],
+                       'translation': [0.0148, 0.0001, 0.0003]},
+    'depth_scale': 0.001,
+}
+
+
+def test_plane_has_no_holes():
+    # A wall 1 m away fills the whole color view; every color pixel should get depth
+    depth = np.full((240, 424), 1000, np.uint16)
+    aligned = DepthToColorAligner(CALIBRATION).align(depth)
+    assert aligned.shape == (240, 424)
+    assert np.count_nonzero(aligned) / aligned.size > 0.99
+    assert abs(int(np.median(aligned[aligned > 0])) - 1000) <= 2
+
+
+def test_plane_at_larger_output_size():
+    depth = np.full((240, 424), 2000, np.uint16)
+    aligned = DepthToColorAligner(CALIBRATION).align(depth, (848, 480))
+    assert aligned.shape == (480, 848)
+    assert np.count_nonzero(aligned) / aligned.size > 0.99
+
+
+def test_plane_at_reduced_output_size():
+    depth = np.full((240, 424), 2000, np.uint16)
+    aligned = DepthToColorAligner(CALIBRATION).align(depth, (212, 120))
+    assert aligned.shape == (120, 212)
+    assert np.count_nonzero(aligned) / aligned.size > 0.99
+    assert abs(int(np.median(aligned[aligned > 0])) - 2000) <= 4
+
+
+def test_nearer_surface_wins():
+    depth = np.full((240, 424), 3000, np.uint16)
+    depth[100:140, 190:230] = 800  # box in front of the wall
+    aligned = DepthToColorAligner(CALIBRATION).align(depth)
+    centre = aligned[110:130, 200:225]
+    assert (centre == 800).all()
+
+
+def test_no_depth_stays_empty():
+    aligned = DepthToColorAligner(CALIBRATION).align(np.zeros((240, 424), np.uint16))
+    assert not aligned.any()
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from rgbd_depth_filters import DepthFilterChain
+
+BUDGET_MS = 10.0
+SETTLE = 5
+RETRY = 100
+DEPTH = np.zeros((4, 4), np.uint16)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeFilter:
+    # Takes cost_ms on the fake clock per frame
+    can_disable = True
+
+    def __init__(self, name, cost_ms, clock):
+        self.name = name
+        self.cost_ms = cost_ms
+        self.clock = clock
+
+    def __call__(self, depth):
+        self.clock.now += self.cost_ms / 1000
+        return depth
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr('rgbd_depth_filters.time.perf_counter', clock)
+    return clock
+
+
+def run(chain, frames):
+    for _ in range(frames):
+        chain(DEPTH)
+
+
+def test_stall_does_not_disable_for_good(clock):
+    spatial, temporal = FakeFilter('spatial', 3, clock), FakeFilter('temporal', 2, clock)
+    chain = DepthFilterChain([spatial, temporal], BUDGET_MS, settle=SETTLE, retry=RETRY)
+    run(chain, SETTLE)
+    spatial.cost_ms = 200  # one frame with a GC pause
+    run(chain, 1)
+    spatial.cost_ms = 3
+    assert not chain.enabled['spatial']
+    run(chain, RETRY + SETTLE)
+    assert chain.enabled['spatial'] and chain.enabled['temporal']
+    assert chain.cost_ms['spatial'] == pytest.approx(3)
+    run(chain, 10 * RETRY)
+    assert chain.enabled['spatial']
+
+
+def test_reenables_once_under_budget_with_headroom(clock):
+    spatial, temporal = FakeFilter('spatial', 4, clock), FakeFilter('temporal', 8, clock)
+    chain = DepthFilterChain([spatial, temporal], BUDGET_MS, settle=SETTLE, retry=10 * RETRY)
+    run(chain, SETTLE + 1)
+    assert chain.enabled == {'spatial': True, 'temporal': False}
+    run(chain, 3 * SETTLE)
+    assert not chain.enabled['temporal']  # 4 + 8 ms does not fit, no flapping
+    spatial.cost_ms = 0.5
+    run(chain, 3 * SETTLE)
+    assert not chain.enabled['temporal']  # 0.5 + 8 ms fits the budget but not the headroom
+    temporal.cost_ms = 5
+    spatial.cost_ms = 1
+    run(chain, 30 * SETTLE)
+    assert not chain.enabled['temporal']  # only the old 8 ms are known until the retry
+    run(chain, 10 * RETRY)
+    assert chain.enabled['temporal']
+
+
+def test_retry_backs_off_while_too_expensive(clock):
+    spatial = FakeFilter('spatial', 20, clock)
+    chain = DepthFilterChain([spatial], BUDGET_MS, settle=SETTLE, retry=RETRY)
+    run(chain, SETTLE + 1)
+    assert not chain.enabled['spatial']
+    enabled_frames = []
+    for _ in range(8 * RETRY):
+        run(chain, 1)
+        enabled_frames.append(chain.enabled['spatial'])
+    assert sum(enabled_frames) <= 3 * SETTLE
+    assert chain.retry['spatial'] >= 4 * RETRY
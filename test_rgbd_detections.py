@@ -0,0 +1,30 @@
+from rgbd_detections import DetectionWriter, detection_record, pack_detections, read_detections, unpack_detections
+
+SOURCE = ('192.168.1.20', 40000, 2)
+DETECTIONS = [{'box': [10, 20, 30, 40], 'class_id': 0, 'label': 'grape', 'confidence': 0.9,
+               'depth_m': 0.75, 'xyz': [0.1, -0.2, 0.75]}]
+
+
+def test_binary_carries_provisional():
+    for provisional in (False, True):
+        record, end = unpack_detections(pack_detections(SOURCE, 5, 123, DETECTIONS, provisional))
+        assert record['provisional'] is provisional
+        assert (record['source'], record['stream_id'], record['frame_id']) == ('192.168.1.20:40000', 2, 5)
+        assert record['detections'][0]['box'] == [10, 20, 30, 40]
+
+
+def test_json_carries_provisional():
+    assert detection_record(SOURCE, 5, 123, DETECTIONS)['provisional'] is False
+    assert detection_record(SOURCE, 5, 123, DETECTIONS, provisional=True)['provisional'] is True
+
+
+def test_writer_round_trip(tmp_path):
+    for name in ('dets.jsonl', 'dets.bin'):
+        path = str(tmp_path / name)
+        writer = DetectionWriter(path)
+        writer.write(SOURCE, 1, 100, DETECTIONS, provisional=True)
+        writer.write(SOURCE, 2, 200, [])
+        writer.close()
+        records = list(read_detections(path))
+        assert [(r['frame_id'], r['provisional'], len(r['detections'])) for r in records] == \
+            [(1, True, 1), (2, False, 0)]
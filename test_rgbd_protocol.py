@@ -0,0 +1,168 @@
+import random
+
+import pytest
+
+from rgbd_protocol import (FLAG_TIMING, FLAG_CRC32, FLAG_CRC32C, CRC_FLAGS, SEQ_MODULO, TIMING_FLAG_GLOBAL_CLOCK,
+                           TYPE_RGB, TYPE_DEPTH, V2_HEADER_SIZE, CRC_SIZE, SequenceTracker, crc32c, pack_header,
+                           pack_packet_v2, pack_timing, unpack_packet, unpack_timing)
+
+PAYLOAD = bytes(range(256)) * 4
+
+
+def test_v2_round_trip():
+    trailer = pack_timing(TIMING_FLAG_GLOBAL_CLOCK, 1, 2, 3, 4)
+    packet = pack_packet_v2(TYPE_RGB, 7, 41, 123456, 424, 240, PAYLOAD, trailer, stream_id=3, codec=1)
+    parsed = unpack_packet(packet)
+    assert (parsed.version, parsed.type, parsed.frame_id, parsed.seq, parsed.stream_id, parsed.codec) == \
+        (2, TYPE_RGB, 7, 41, 3, 1)
+    assert (parsed.timestamp, parsed.width, parsed.height) == (123456, 424, 240)
+    assert parsed.data == PAYLOAD
+    assert parsed.flags & FLAG_TIMING and not parsed.flags & CRC_FLAGS
+    assert unpack_timing(parsed.trailer) == {'flags': TIMING_FLAG_GLOBAL_CLOCK, 'sensor': 1, 'capture': 2,
+                                             'encode': 3, 'send': 4}
+
+
+def test_v2_seq_wraps_into_header():
+    assert unpack_packet(pack_packet_v2(TYPE_DEPTH, 1, SEQ_MODULO + 5, 0, 1, 1, b'x')).seq == 5
+
+
+def test_v1_round_trip():
+    packet = pack_header(9, TYPE_DEPTH, 55, 424, 240, len(PAYLOAD)) + PAYLOAD
+    parsed = unpack_packet(packet)
+    assert (parsed.version, parsed.type, parsed.frame_id, parsed.seq, parsed.data) == (1, TYPE_DEPTH, 9, None, PAYLOAD)
+    assert unpack_timing(parsed.trailer) is None
+
+
+def test_crc_flag_matches_available_implementation():
+    parsed = unpack_packet(pack_packet_v2(TYPE_RGB, 1, 1, 0, 1, 1, PAYLOAD, crc=True))
+    assert parsed.flags & CRC_FLAGS == (FLAG_CRC32C if crc32c is not None else FLAG_CRC32)
+    assert parsed.data == PAYLOAD
+
+
+def crc_packet():
+    return pack_packet_v2(TYPE_RGB, 1, 1, 0, 1, 1, PAYLOAD, pack_timing(0, 1, 2, 3, 4), crc=True)
+
+
+@pytest.mark.parametrize('offset, reason', [(20, 'bad_header'), (V2_HEADER_SIZE + 1, 'bad_crc'),
+                                            (V2_HEADER_SIZE + 100, 'bad_crc'), (-1, 'bad_crc')])
+def test_crc_detects_corruption(offset, reason):
+    packet = bytearray(crc_packet())
+    packet[offset] ^= 0x40
+    with pytest.raises(ValueError, match=reason):
+        unpack_packet(bytes(packet))
+
+
+@pytest.mark.parametrize('flags', [0, FLAG_TIMING, FLAG_TIMING | FLAG_CRC32, FLAG_TIMING | FLAG_CRC32C,
+                                   FLAG_TIMING | CRC_FLAGS, 0x80 | FLAG_TIMING | FLAG_CRC32])
+def test_corrupted_flags_do_not_skip_the_crc(flags):
+    packet = bytearray(crc_packet())
+    if packet[7] == flags:
+        return
+    packet[7] = flags
+    with pytest.raises(ValueError):
+        unpack_packet(bytes(packet))
+
+
+def test_crc_flag_set_on_plain_packet():
+    packet = bytearray(pack_packet_v2(TYPE_RGB, 1, 1, 0, 1, 1, PAYLOAD, pack_timing(0, 1, 2, 3, 4)))
+    packet[7] |= FLAG_CRC32
+    with pytest.raises(ValueError, match='bad_header'):
+        unpack_packet(bytes(packet))
+
+
+def test_extra_bytes_rejected():
+    with pytest.raises(ValueError, match='bad_length'):
+        unpack_packet(pack_packet_v2(TYPE_RGB, 1, 1, 0, 1, 1, PAYLOAD, pack_timing(0, 1, 2, 3, 4)) + b'\0')
+    with pytest.raises(ValueError, match='bad_length'):
+        unpack_packet(pack_packet_v2(TYPE_RGB, 1, 1, 0, 1, 1, PAYLOAD) + b'\0' * CRC_SIZE)
+    with pytest.raises(ValueError, match='bad_length'):
+        unpack_packet(pack_header(9, TYPE_DEPTH, 55, 424, 240, len(PAYLOAD)) + PAYLOAD + b'\0' * 8)
+
+
+@pytest.mark.parametrize('crc_lib', [None, 'installed'])
+def test_header_fuzz_never_accepts_crc_packet(monkeypatch, crc_lib):
+    # Like bench_protocol.py's 'header' mutation: 1-3 random bytes of the header or checksum
+    if crc_lib is None:
+        monkeypatch.setattr('rgbd_protocol.crc32c', None)
+    elif crc32c is None:
+        pytest.skip("crc32c not installed")
+    rng = random.Random(0)
+    packet = crc_packet()
+    for _ in range(5000):
+        data = bytearray(packet)
+        for _ in range(rng.randint(1, 3)):
+            data[rng.randrange(V2_HEADER_SIZE + CRC_SIZE)] = rng.randrange(256)
+        if data == packet:
+            continue
+        with pytest.raises(ValueError):
+            unpack_packet(bytes(data))
+
+
+def test_unverified_crc_is_accepted():
+    packet = bytearray(pack_packet_v2(TYPE_RGB, 1, 1, 0, 1, 1, PAYLOAD, crc=True))
+    packet[-1] ^= 0x01
+    assert unpack_packet(bytes(packet), verify_crc=False).data[-1] != PAYLOAD[-1]
+
+
+@pytest.mark.parametrize('length, reason', [(10, 'too_small'), (V2_HEADER_SIZE + 10, 'incomplete')])
+def test_truncated_packets(length, reason):
+    packet = pack_packet_v2(TYPE_RGB, 1, 1, 0, 1, 1, PAYLOAD)
+    with pytest.raises(ValueError, match=reason):
+        unpack_packet(packet[:length])
+
+
+def track(seqs):
+    tracker = SequenceTracker()
+    for seq in seqs:
+        tracker.update(seq)
+    return tracker
+
+
+def test_tracker_in_order():
+    tracker = track(range(100))
+    assert (tracker.lost, tracker.reordered, tracker.duplicates) == (0, 0, 0)
+
+
+def test_tracker_loss_and_late_arrival():
+    tracker = track([0, 1, 4, 5])
+    assert tracker.lost == 2
+    assert tracker.update(2) == (-1, True, False)
+    assert (tracker.lost, tracker.reordered) == (1, 1)
+    # 2 came once already; a second copy does not cancel the loss of 3
+    assert tracker.update(2) == (0, False, True)
+    assert (tracker.lost, tracker.reordered, tracker.duplicates) == (1, 1, 1)
+
+
+def test_tracker_duplicates_never_make_loss_negative():
+    tracker = track([0, 1, 2, 2, 2, 2])
+    assert (tracker.lost, tracker.reordered, tracker.duplicates) == (0, 0, 3)
+    tracker = track([0, 1, 2, 3, 1, 0, 3])
+    assert (tracker.lost, tracker.reordered, tracker.duplicates) == (0, 0, 3)
+
+
+def test_tracker_wraps_around():
+    tracker = track([SEQ_MODULO - 2, SEQ_MODULO - 1, 0, 2, 1])
+    assert (tracker.lost, tracker.reordered, tracker.duplicates) == (0, 1, 0)
+    tracker = track([SEQ_MODULO - 1, 1, SEQ_MODULO - 1])
+    assert (tracker.lost, tracker.duplicates) == (1, 1)
+
+
+def test_tracker_restart():
+    tracker = track([5000000, 5000001, 3, 4])
+    assert (tracker.lost, tracker.reordered, tracker.duplicates) == (0, 0, 0)
+    # A seq far behind is another restart, not a late arrival or a duplicate
+    tracker = track([100, 102, 50000, 101])
+    assert (tracker.lost, tracker.reordered, tracker.duplicates) == (1, 0, 0)
+
+
+def test_tracker_forgets_old_losses():
+    window = SequenceTracker.MISSING_WINDOW
+    tracker = track([0, window + 11])
+    assert tracker.lost == window + 10
+    assert tracker.update(1)[2]  # too old to be matched to its loss
+    assert tracker.update(window + 10)[1]
+    assert tracker.lost == window + 9
+
+
+def test_tracker_ignores_v1():
+    assert SequenceTracker().update(None) == (0, False, False)
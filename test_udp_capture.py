@@ -0,0 +1,35 @@
+import socket
+
+from rgbd_protocol import TYPE_RGB, TYPE_DEPTH, SequenceTracker, pack_header, pack_packet_v2, unpack_packet
+from udp_capture import CaptureWriter, replay
+
+SOURCE = ('192.168.1.20', 40000)
+
+
+def test_looped_replay_continues_frames_and_seqs(tmp_path):
+    path = str(tmp_path / 'session.rgbdcap')
+    writer = CaptureWriter(path)
+    seq = 100
+    for frame_id in range(50, 53):
+        for typ in (TYPE_RGB, TYPE_DEPTH):
+            writer.write(pack_packet_v2(typ, frame_id, seq, frame_id * 1000, 4, 2, b'x' * 8, crc=True),
+                         SOURCE, frame_id)
+            seq += 1
+    writer.write(pack_header(7, TYPE_RGB, 0, 4, 2, 3) + b'abc', ('192.168.1.21', 40000), 60)
+    writer.close()
+
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(1)
+    sent, _ = replay(path, receiver.getsockname(), speed=0, loops=3)
+    assert sent == 21
+    packets = [unpack_packet(receiver.recv(65536)) for _ in range(sent)]
+    receiver.close()
+
+    v2 = [p for p in packets if p.version == 2]
+    assert [p.frame_id for p in v2[::2]] == [50, 51, 52, 103, 104, 105, 156, 157, 158]
+    tracker = SequenceTracker()
+    for p in v2:
+        tracker.update(p.seq)
+    assert (tracker.lost, tracker.duplicates) == (0, 0)
+    assert [p.frame_id for p in packets if p.version == 1] == [7, 60, 113]
@@ -0,0 +1,166 @@
+import argparse
+import collections
+import socket
+import struct
+import time
+
+from rgbd_protocol import PORT, CRC_FLAGS, pack_header, pack_packet_v2, unpack_packet
+from udp_netem_relay import parse_addr
+
+# Capture file: magic(8s), start_us(uint64), then one record per datagram:
+# arrival_us(uint64), src_ip(4s), src_port(uint16), length(uint32), datagram bytes
+CAPTURE_MAGIC = b'RGBDCAP1'
+FILE_HEADER_FORMAT = '<8sQ'
+RECORD_FORMAT = '<Q4sHI'
+FILE_HEADER_SIZE = struct.calcsize(FILE_HEADER_FORMAT)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+
+class CaptureWriter:
+    # Appends datagrams as they arrive; buffered so the receive loop only pays for a memcpy
+    def __init__(self, path, buffer_size=1 << 20):
+        self.file = open(path, 'wb', buffering=buffer_size)
+        self.file.write(struct.pack(FILE_HEADER_FORMAT, CAPTURE_MAGIC, time.time_ns() // 1000))
+        self.packets = 0
+
+    def write(self, packet, addr, arrival_us):
+        self.file.write(struct.pack(RECORD_FORMAT, arrival_us, socket.inet_aton(addr[0]), addr[1], len(packet)))
+        self.file.write(packet)
+        self.packets += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_capture(path):
+    # Yields (arrival_us, (ip, port), datagram)
+    with open(path, 'rb') as f:
+        magic, _ = struct.unpack(FILE_HEADER_FORMAT, f.read(FILE_HEADER_SIZE))
+        if magic != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not an RGB-D capture file")
+        while True:
+            record = f.read(RECORD_SIZE)
+            if len(record) < RECORD_SIZE:
+                return
+            arrival_us, ip, port, length = struct.unpack(RECORD_FORMAT, record)
+            packet = f.read(length)
+            if len(packet) < length:
+                return  # truncated tail, e.g. receiver killed mid-write
+            yield arrival_us, (socket.inet_ntoa(ip), port), packet
+
+
+def loop_spans(path):
+    # (frame_id span, {(source, stream_id): seq span}) of a capture: how far each pass of a
+    # looped replay moves its frame_ids and v2 seqs so they continue where the last pass ended
+    frames = 0
+    seqs = {}
+    for _, addr, packet in read_capture(path):
+        try:
+            parsed = unpack_packet(packet, verify_crc=False)
+        except ValueError:
+            continue
+        frames = max(frames, parsed.frame_id + 1)
+        if parsed.seq is not None:
+            first, last = seqs.get((addr, parsed.stream_id), (parsed.seq, parsed.seq))
+            seqs[(addr, parsed.stream_id)] = (min(first, parsed.seq), max(last, parsed.seq))
+    return frames, {key: last - first + 1 for key, (first, last) in seqs.items()}
+
+
+def shifted(packet, addr, loop, spans):
+    # The datagram as sent on pass loop (0 = unchanged). Packets that do not parse or fail
+    # their CRC go out as captured, so the receiver drops them the same way.
+    try:
+        parsed = unpack_packet(packet)
+    except ValueError:
+        return packet
+    frame_id = parsed.frame_id + loop * spans[0]
+    if parsed.version == 1:
+        return pack_header(frame_id, parsed.type, parsed.timestamp, parsed.width, parsed.height,
+                           len(parsed.data)) + parsed.data + parsed.trailer
+    seq = parsed.seq + loop * spans[1][(addr, parsed.stream_id)]
+    return pack_packet_v2(parsed.type, frame_id, seq, parsed.timestamp, parsed.width, parsed.height, parsed.data,
+                          parsed.trailer, parsed.stream_id, parsed.codec, bool(parsed.flags & CRC_FLAGS),
+                          parsed.frag_index, parsed.frag_count)
+
+
+def replay(path, target, speed=1.0, loops=1, sock=None):
+    # speed scales the original inter-arrival gaps; 0 sends as fast as possible. Later passes
+    # continue the frame_ids and v2 seqs like rgbd_recording.schedule does for --play-loop, so
+    # receivers do not drop them as stale frames or duplicate packets.
+    sock = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    spans = loop_spans(path) if loops > 1 else None
+    sent = 0
+    start = time.perf_counter()
+    for loop in range(loops):
+        first_us = None
+        loop_start = time.perf_counter()
+        for arrival_us, addr, packet in read_capture(path):
+            if first_us is None:
+                first_us = arrival_us
+            if loop:
+                packet = shifted(packet, addr, loop, spans)
+            if speed > 0:
+                due = loop_start + (arrival_us - first_us) / 1e6 / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            sock.sendto(packet, target)
+            sent += 1
+    return sent, time.perf_counter() - start
+
+
+def info(path):
+    counts = collections.Counter()
+    payload = collections.Counter()
+    sources = collections.Counter()
+    versions = collections.Counter()
+    first_us = last_us = None
+    frames = set()
+    for arrival_us, addr, packet in read_capture(path):
+        first_us = arrival_us if first_us is None else first_us
+        last_us = arrival_us
+        sources[f'{addr[0]}:{addr[1]}'] += 1
+        try:
+            parsed = unpack_packet(packet)
+        except ValueError as e:
+            counts[str(e)] += 1
+            continue
+        counts[parsed.type] += 1
+        payload[parsed.type] += len(parsed.data)
+        versions[parsed.version] += 1
+        frames.add((parsed.stream_id, parsed.frame_id))
+    duration = (last_us - first_us) / 1e6 if first_us is not None else 0.0
+    print(f"{path}: {sum(counts.values())} datagrams, {len(frames)} frames over {duration:.1f} s")
+    for typ, count in sorted(counts.items(), key=str):
+        if isinstance(typ, str):
+            print(f"  {count} datagrams rejected: {typ}")
+        else:
+            print(f"  type {typ}: {count} packets, {payload[typ] / max(count, 1):.0f} B average payload")
+    for version, count in sorted(versions.items()):
+        print(f"  protocol v{version}: {count}")
+    for source, count in sources.most_common():
+        print(f"  from {source}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay RGB-D UDP captures written by the receiver")
+    sub = parser.add_subparsers(dest='command', required=True)
+    replay_parser = sub.add_parser('replay', help="Re-send a capture to a receiver")
+    replay_parser.add_argument('path')
+    replay_parser.add_argument('--target', default=f'127.0.0.1:{PORT}')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help="Timing scale, 2 = twice as fast")
+    replay_parser.add_argument('--fast', action='store_true', help="Ignore original timing")
+    replay_parser.add_argument('--loop', type=int, default=1, help="Number of passes over the capture; later passes continue the frame_ids and sequence numbers")
+    info_parser = sub.add_parser('info', help="Summarize a capture")
+    info_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        info(args.path)
+        return
+    sent, elapsed = replay(args.path, parse_addr(args.target), 0 if args.fast else args.speed, args.loop)
+    print(f"Replayed {sent} datagrams in {elapsed:.2f} s ({sent / elapsed if elapsed else 0:.0f}/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import argparse
+import heapq
+import random
+import select
+import socket
+import threading
+import time
+
+from rgbd_protocol import PORT
+
+# Impairment spec, "key=value,..." e.g. "loss=0.02,delay=20,jitter=5,rate=8000"
+#   loss        independent random loss probability
+#   ge_p, ge_r  Gilbert-Elliott P(good->bad) and P(bad->good) per packet, enables bursty loss
+#   loss_good   loss probability in the good state (default 0)
+#   loss_bad    loss probability in the bad state (default 1)
+#   delay       one-way delay in ms
+#   jitter      uniform +/- jitter in ms
+#   reorder     probability a packet skips the delay line (arrives ahead of earlier ones)
+#   duplicate   probability a packet is sent twice
+#   rate        bottleneck bandwidth in kbit/s, 0 = unlimited
+#   queue       bottleneck queue in ms of backlog; packets beyond it are tail-dropped
+#   seed        RNG seed, fixes the loss/duplicate/reorder pattern for a packet sequence
+NETEM_DEFAULTS = {
+    'loss': 0.0, 'ge_p': 0.0, 'ge_r': 1.0, 'loss_good': 0.0, 'loss_bad': 1.0,
+    'delay': 0.0, 'jitter': 0.0, 'reorder': 0.0, 'duplicate': 0.0,
+    'rate': 0.0, 'queue': 200.0, 'seed': 0,
+}
+
+
+def parse_netem(spec):
+    params = dict(NETEM_DEFAULTS)
+    for item in filter(None, (spec or '').split(',')):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key not in NETEM_DEFAULTS:
+            raise ValueError(f"Unknown netem parameter '{key}', expected one of {sorted(NETEM_DEFAULTS)}")
+        params[key] = type(NETEM_DEFAULTS[key])(float(value))
+    return params
+
+
+class NetemRelay:
+    # Forwards datagrams from listen_addr to target_addr with impairments. Datagrams coming
+    # back from the target are passed to the last sender untouched.
+    def __init__(self, listen_addr, target_addr, **params):
+        self.params = dict(NETEM_DEFAULTS, **params)
+        self.target = target_addr
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        self.sock.bind(listen_addr)
+        self.address = self.sock.getsockname()
+        self.client = None
+        self.rng = random.Random(self.params['seed'])
+        self.bad_state = False
+        self.link_free_at = 0.0
+        self.queue = []  # heap of (departure, seq, packet)
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.running = False
+        self.stats = dict.fromkeys(('received', 'sent', 'lost_random', 'lost_burst', 'lost_queue',
+                                    'duplicated', 'reordered', 'returned'), 0)
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self._receive_loop, daemon=True),
+                        threading.Thread(target=self._send_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _lost(self):
+        p = self.params
+        if p['ge_p'] > 0:
+            # Advance the two-state chain once per packet, then draw loss for the current state
+            if self.bad_state:
+                self.bad_state = self.rng.random() >= p['ge_r']
+            else:
+                self.bad_state = self.rng.random() < p['ge_p']
+            if self.rng.random() < (p['loss_bad'] if self.bad_state else p['loss_good']):
+                self.stats['lost_burst'] += 1
+                return True
+        if p['loss'] > 0 and self.rng.random() < p['loss']:
+            self.stats['lost_random'] += 1
+            return True
+        return False
+
+    def _schedule(self, packet, now):
+        p = self.params
+        departure = now
+        if p['rate'] > 0:
+            # Serialize through the bottleneck; backlog beyond the queue limit is tail-dropped
+            start = max(now, self.link_free_at)
+            if (start - now) * 1000 > p['queue']:
+                self.stats['lost_queue'] += 1
+                return
+            self.link_free_at = start + len(packet) * 8 / (p['rate'] * 1000)
+            departure = self.link_free_at
+        if p['reorder'] > 0 and self.rng.random() < p['reorder']:
+            self.stats['reordered'] += 1
+        else:
+            departure += (p['delay'] + self.rng.uniform(-p['jitter'], p['jitter'])) / 1000
+        copies = 2 if p['duplicate'] > 0 and self.rng.random() < p['duplicate'] else 1
+        self.stats['duplicated'] += copies - 1
+        with self.cond:
+            for _ in range(copies):
+                heapq.heappush(self.queue, (departure, self.seq, packet))
+                self.seq += 1
+            self.cond.notify()
+
+    def _receive_loop(self):
+        while self.running:
+            if not select.select([self.sock], [], [], 0.1)[0]:
+                continue
+            packet, addr = self.sock.recvfrom(65536)
+            if addr == self.target:
+                if self.client is not None:
+                    self.sock.sendto(packet, self.client)
+                    self.stats['returned'] += 1
+                continue
+            self.client = addr
+            self.stats['received'] += 1
+            if not self._lost():
+                self._schedule(packet, time.monotonic())
+
+    def _send_loop(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    timeout = self.queue[0][0] - time.monotonic() if self.queue else None
+                    self.cond.wait(timeout)
+                if not self.running:
+                    return
+                _, _, packet = heapq.heappop(self.queue)
+            self.sock.sendto(packet, self.target)
+            self.stats['sent'] += 1
+
+
+def parse_addr(text, default_host='127.0.0.1'):
+    host, _, port = text.rpartition(':')
+    return (host or default_host, int(port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UDP relay that emulates loss, delay, reordering and bandwidth limits")
+    parser.add_argument('--listen', default=f'0.0.0.0:{PORT - 1}', help="Address the streamer sends to")
+    parser.add_argument('--target', default=f'127.0.0.1:{PORT}', help="Address of the receiver")
+    parser.add_argument('--netem', default='', help="Impairments, e.g. loss=0.02,delay=20,jitter=5,rate=8000")
+    parser.add_argument('--report-interval', type=float, default=5.0)
+    args = parser.parse_args()
+
+    params = parse_netem(args.netem)
+    relay = NetemRelay(parse_addr(args.listen, '0.0.0.0'), parse_addr(args.target), **params)
+    print(f"Relaying {relay.address[0]}:{relay.address[1]} -> {args.target} with {args.netem or 'no impairments'}")
+    relay.start()
+    try:
+        while True:
+            time.sleep(args.report_interval)
+            print(' | '.join(f'{key} {value}' for key, value in relay.stats.items()))
+    except KeyboardInterrupt:
+        print("Stopped.")
+    finally:
+        relay.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,518 @@
+import argparse
+import asyncio
+import time
+
+import cv2
+
+from rgbd_protocol import (PORT, TYPE_RGB, TYPE_DEPTH, TYPE_CALIB, CTRL_CLOCK_REPLY, CTRL_CONFIG,
+                           CTRL_CONFIG_GET, TIMING_FLAG_PROVISIONAL, SequenceTracker, unpack_packet, unpack_timing,
+                           unpack_control, pack_control, control_port)
+from rgbd_latency import ClockOffsetEstimator, StageLatency, now_us
+from rgbd_codec import decode_scale, matches_size
+from rgbd_decode_pool import DecodePool
+from rgbd_detections import DetectionWriter, console_to_stderr
+from rgbd_display import DEFAULT_DISPLAY_FPS, DisplayStage
+from rgbd_recording import RecordingWriter, RecordingReader, schedule
+from rgbd_net import open_receiver_socket
+from rgbd_roi import pack_roi
+from rgbd_calibration import parse_calibration
+from rgbd_config import parse_config_message, describe
+from rgbd_align import DepthToColorAligner
+from rgbd_metrics import REGISTRY, PeriodicReport, start_http_server
+from grape_detector import INPUT_SIZE, load_yolo, detect
+from grape_localize import localize
+from rgbd_workers import WorkerPool
+from rgbd_shm_ring import ShmFrameRing
+
+# Receives from many streamers on one port. Each source address gets its own session
+# (frame buffer, clock offset, latency stats, windows), so colliding frame_ids from
+# different Pis no longer overwrite each other.
+
+CLOCK_PROBE_INTERVAL = 1.0
+SESSION_TIMEOUT = 10.0
+FRAME_HISTORY = 10
+EVENT_INTERVAL = 0.1  # seconds between cv2.waitKey calls when no window changed
+POOL_POLL_INTERVAL = 0.002  # worker processes report through a multiprocessing queue, which is polled
+STREAM_NAMES = {TYPE_RGB: 'rgb', TYPE_DEPTH: 'depth'}
+
+packets_received = REGISTRY.counter('rgbd_packets_received_total', "Packets received", ['session', 'stream'])
+bytes_received = REGISTRY.counter('rgbd_bytes_received_total', "Payload bytes received", ['session', 'stream'])
+drops = REGISTRY.counter('rgbd_packets_dropped_total', "Packets or frames dropped", ['reason'])
+decode_ms = REGISTRY.histogram('rgbd_decode_ms', "Decode time in ms", ['stream'])
+decodes_skipped = REGISTRY.counter('rgbd_decodes_skipped_total', "Payloads dropped without being decoded",
+                                   ['session', 'stream'])
+align_ms = REGISTRY.histogram('rgbd_align_ms', "Depth to color registration time in ms")
+inference_ms = REGISTRY.histogram('rgbd_inference_ms', "Detection time in ms")
+frames_displayed = REGISTRY.counter('rgbd_frames_displayed_total', "Frames displayed", ['session'])
+detections_total = REGISTRY.counter('rgbd_detections_total', "Objects detected", ['session', 'label'])
+packets_lost = REGISTRY.gauge('rgbd_packets_lost', "Packets missing from the v2 sequence", ['session'])
+packets_reordered = REGISTRY.counter('rgbd_packets_reordered_total', "Packets that arrived after later ones",
+                                     ['session'])
+provisional_frames = REGISTRY.counter('rgbd_provisional_frames_total',
+                                      "RGB frames the streamer sent before its camera warm-up ended", ['session'])
+packets_duplicated = REGISTRY.gauge('rgbd_packets_duplicated', "Packets received more than once", ['session'])
+sessions_gauge = REGISTRY.gauge('rgbd_sessions', "Active streamer sessions")
+stage_ms = REGISTRY.histogram('rgbd_stage_latency_ms', "Per-stage latency in ms", ['stage'])
+render_ms = REGISTRY.histogram('rgbd_render_ms', "Overlay drawing and window update time in ms")
+renders_skipped = REGISTRY.counter('rgbd_renders_skipped_total', "Frames not shown because of --display-fps",
+                                   ['session'])
+
+
+def session_key(addr, stream_id=0):
+    # One session per streamer socket and camera; a restarted streamer gets a new source port
+    # and a fresh session. stream_id is always 0 for v1 packets.
+    return addr[0], addr[1], stream_id
+
+
+class Session:
+    def __init__(self, key, clock, report_interval):
+        # Payloads stay compressed until take_ready() picks the frame; a DecodePool or a
+        # WorkerPool decodes them, so superseded frames cost nothing
+        self.key = key
+        self.name = f'{key[0]}:{key[1]}' + (f'/{key[2]}' if key[2] else '')
+        self.control_addr = (key[0], control_port(key[2]))  # the streamer's control socket
+        self.sequence = SequenceTracker()
+        self.clock = clock
+        self.latency = StageLatency(clock, report_interval, stage_ms)
+        self.frame_buffer = {}
+        self.last_displayed = -1
+        self.ready = None  # newest complete frame not yet displayed
+        self.decoding = None  # task awaiting the frame's DecodeJob, at most one in flight to keep order
+        self.last_seen = time.monotonic()
+        self.ring = None
+        self.display = None  # DisplayStage, created on the first frame shown
+        self.calibration = None
+        self.aligner = None
+
+    def set_calibration(self, calib, align):
+        if calib is None or calib == self.calibration:
+            return
+        self.calibration = calib
+        self.aligner = DepthToColorAligner(calib) if align else None
+        print(f"Session {self.name}: received camera calibration")
+
+    def add_packet(self, frame_id, typ, data, trailer, receive_us, size, scale=1, timestamp=0):
+        # size is the header (width, height); RGB will be decoded at 1/scale of it
+        self.last_seen = time.monotonic()
+        stream = STREAM_NAMES.get(typ, 'unknown')
+        if frame_id <= self.last_displayed:
+            drops.inc(reason='stale')
+            decodes_skipped.inc(session=self.name, stream=stream)
+            return
+        entry = self.frame_buffer.setdefault(frame_id, {})
+        packets_received.inc(session=self.name, stream=stream)
+        bytes_received.inc(len(data), session=self.name, stream=stream)
+        if typ == TYPE_RGB:
+            entry['rgb'] = data
+            entry['scale'], entry['size'] = scale, size
+            timing = unpack_timing(trailer) or {}
+            if timing.get('flags', 0) & TIMING_FLAG_PROVISIONAL:
+                provisional_frames.inc(session=self.name)
+            timing['receive'] = receive_us
+            timing['timestamp'] = timestamp  # header timestamp, not a stage
+            entry['timing'] = timing
+        elif typ == TYPE_DEPTH:
+            entry['depth'] = data
+            entry['depth_size'] = size
+        if 'rgb' in entry and 'depth' in entry and (self.ready is None or frame_id > self.ready):
+            self.ready = frame_id
+
+    def take_ready(self):
+        # Newest complete frame, or None; anything older than it is superseded
+        if self.ready is None:
+            return None
+        frame_id, self.ready = self.ready, None
+        entry = self.frame_buffer[frame_id]
+        self.last_displayed = frame_id
+        for old_id in list(self.frame_buffer):
+            if old_id < frame_id - FRAME_HISTORY:
+                old = self.frame_buffer.pop(old_id)
+                if not old.get('shown'):
+                    drops.inc(reason='never_displayed')
+                    for stream in ('rgb', 'depth'):
+                        if stream in old:
+                            decodes_skipped.inc(session=self.name, stream=stream)
+        entry['shown'] = True
+        return frame_id, entry
+
+    def finish_decode(self, entry, job):
+        # Stores the decoded images in entry; False if a payload does not match its header size
+        (rgb, rgb_ms), (depth, depth_ms) = job.result()
+        entry['timing']['decode'] = now_us()
+        decode_ms.observe(rgb_ms, stream='rgb')
+        decode_ms.observe(depth_ms, stream='depth')
+        if ((rgb is not None and not matches_size(rgb, *entry['size'], entry['scale']))
+                or (depth is not None and depth.shape[1::-1] != entry['depth_size'])):
+            drops.inc(reason='size_mismatch')
+            return False
+        entry['rgb'], entry['depth'] = rgb, depth
+        return True
+
+
+class DataProtocol(asyncio.DatagramProtocol):
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def datagram_received(self, data, addr):
+        self.receiver.handle_packet(data, addr)
+
+
+class ControlProtocol(asyncio.DatagramProtocol):
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def datagram_received(self, data, addr):
+        t3 = now_us()
+        parsed = unpack_control(data)
+        if parsed is None:
+            return
+        if parsed[0] == CTRL_CLOCK_REPLY and addr in self.receiver.clocks:
+            self.receiver.clocks[addr].add_reply(parsed[1], t3)
+        elif parsed[0] == CTRL_CONFIG:
+            self.receiver.handle_config(addr, parsed[1])
+
+
+class AsyncReceiver:
+    def __init__(self, args):
+        self.args = args
+        self.sessions = {}
+        # Per streamer control address (ip, control_port(stream_id)): every session of that
+        # camera shares its clock, and its configuration does not apply to other cameras on the host
+        self.clocks = {}
+        self.configs = {}  # (generation, config), from CTRL_CONFIG
+        self.control = None
+        self.running = True
+        self.pool = WorkerPool(args.workers, args.detect, max_width=args.max_width,
+                               max_height=args.max_height) if args.workers else None
+        self.decoder = DecodePool(args.decode_workers) if self.pool is None else None
+        self.net, self.classes = load_yolo() if args.detect and self.pool is None else (None, None)
+        self.report = PeriodicReport(args.report_interval)
+        preview_w, preview_h = (int(v) for v in args.preview_size.split('x')) if args.display else (0, 0)
+        self.decode_target = (max(INPUT_SIZE, preview_w), max(INPUT_SIZE, preview_h))
+        self.preview_size = (preview_w, preview_h)
+        self.recorder = RecordingWriter(args.record) if args.record else None
+        self.rendered = False  # some window changed since the last waitKey
+        self.last_events = 0.0
+        self.wake = None  # asyncio.Event: a frame became ready or a decode finished
+        self.detections = (DetectionWriter(args.detections_out, args.detections_format)
+                           if args.detections_out and args.detect else None)
+
+    def rgb_scale(self, width, height):
+        # Reduced-size RGB decode unless frames are published at full resolution
+        if self.args.decode_scale != 'auto':
+            return int(self.args.decode_scale)
+        return 1 if self.args.publish_shm else decode_scale(width, height, self.decode_target)
+
+    def handle_packet(self, packet, addr):
+        receive_us = now_us()
+        try:
+            parsed = unpack_packet(packet)
+        except ValueError as e:
+            drops.inc(reason=str(e))
+            return
+        if parsed.frag_count > 1:
+            drops.inc(reason='fragmented')  # no sender fragments yet
+            return
+        if self.recorder is not None:
+            self.recorder.write(parsed, addr, receive_us)
+        frame_id, typ, width, height, data = parsed.frame_id, parsed.type, parsed.width, parsed.height, parsed.data
+        key = session_key(addr, parsed.stream_id)
+        session = self.sessions.get(key)
+        if session is None:
+            if len(self.sessions) >= self.args.max_sessions:
+                drops.inc(reason='session_limit')
+                return
+            clock = self.clocks.setdefault((addr[0], control_port(parsed.stream_id)), ClockOffsetEstimator())
+            session = self.sessions[key] = Session(key, clock, self.args.report_interval)
+            sessions_gauge.set(len(self.sessions))
+            print(f"New session {session.name}")
+        if session.sequence.update(parsed.seq)[1]:
+            packets_reordered.inc(session=session.name)
+        packets_lost.set(session.sequence.lost, session=session.name)
+        packets_duplicated.set(session.sequence.duplicates, session=session.name)
+        if typ == TYPE_CALIB:
+            session.set_calibration(parse_calibration(data), self.args.align)
+            return
+        known = self.configs.get(session.control_addr)
+        if typ == TYPE_RGB and known is not None and (width, height) != (known[1]['width'], known[1]['height']):
+            # Stale packets from before a reconfiguration
+            drops.inc(reason='unexpected_size')
+            return
+        scale = self.rgb_scale(width, height) if typ == TYPE_RGB else 1
+        session.add_packet(frame_id, typ, data, parsed.trailer, receive_us, (width, height), scale, parsed.timestamp)
+        if session.ready is not None:
+            self.wake.set()
+
+    def handle_config(self, addr, payload):
+        message = parse_config_message(payload)
+        if message is None:
+            return
+        if self.configs.get(addr, (None,))[0] != message['generation']:
+            self.configs[addr] = (message['generation'], message['config'])
+            print(f"Streamer {addr[0]}:{addr[1]} configuration {message['generation']}: {describe(message['config'])}")
+        for session in self.sessions.values():
+            if session.control_addr == addr:
+                session.set_calibration(message.get('calibration'), self.args.align)
+
+    def process(self, session, frame_id, entry, job):
+        # Alignment and detection in-process once the frame's decode job has finished
+        if not session.finish_decode(entry, job):
+            return
+        timing = entry['timing']
+        if session.aligner is not None and entry['rgb'] is not None and entry['depth'] is not None:
+            start_us = now_us()
+            entry['depth'] = session.aligner.align(entry['depth'], (entry['rgb'].shape[1], entry['rgb'].shape[0]))
+            align_ms.observe((now_us() - start_us) / 1000.0)
+        detections = []
+        if self.net is not None and entry['rgb'] is not None:
+            detections = detect(entry['rgb'], self.net, self.classes, entry['scale'])
+            if session.aligner is not None and entry['depth'] is not None:
+                localize(detections, entry['depth'], session.calibration, entry['size'])
+            timing['inference'] = now_us()
+            inference_ms.observe((timing['inference'] - timing['decode']) / 1000.0)
+        if self.args.publish_shm:
+            self.publish(session, frame_id, entry['rgb'], entry['depth'], timing)
+        self.show(session, frame_id, entry['rgb'], entry['depth'], detections, timing, entry['scale'], entry['size'])
+
+    def dispatch(self, session, frame_id, entry):
+        calib = session.calibration if session.aligner is not None else None
+        if not self.pool.submit(session.name, frame_id, entry['rgb'], entry['depth'], entry['timing'], calib,
+                                entry['scale'], entry['size']):
+            drops.inc(reason='worker_busy')
+
+    def collect(self):
+        # Finished frames from the worker pool; returns whether anything was shown
+        shown = False
+        for result in self.pool.poll():
+            session = next((s for s in self.sessions.values() if s.name == result['session']), None)
+            if session is not None and result['error'] is None:
+                decode_ms.observe(result['decode_ms'], stream='rgbd')
+                if self.args.detect:
+                    inference_ms.observe(result['inference_ms'])
+                if self.args.publish_shm:
+                    self.publish(session, result['frame_id'], result['rgb'], result['depth'], result['timing'])
+                self.show(session, result['frame_id'], result['rgb'], result['depth'], result['detections'],
+                          result['timing'], result['scale'], result['size'])
+                shown = True
+            elif result['error'] is not None:
+                drops.inc(reason=result['error'])
+            result['rgb'] = result['depth'] = None
+            self.pool.release(result)
+        return shown
+
+    def publish(self, session, frame_id, rgb, depth, timing):
+        # One ring per session: <prefix>_<ip>_<port>[_<stream_id>]
+        if session.ring is None:
+            shm_w, shm_h = self.args.max_width, self.args.max_height
+            name = f"{self.args.publish_shm}_{session.key[0].replace('.', '-')}_{session.key[1]}"
+            if session.key[2]:
+                name += f"_{session.key[2]}"
+            session.ring = ShmFrameRing.create(name, self.args.shm_slots, (shm_h, shm_w), (shm_h, shm_w))
+            print(f"Publishing session {session.name} to shared memory '{name}'")
+        try:
+            session.ring.publish(frame_id, timing.get('timestamp', 0), rgb, depth)
+        except ValueError:
+            # Larger than --max-width/--max-height, e.g. after the streamer was reconfigured
+            drops.inc(reason='ring_too_large')
+
+    def show(self, session, frame_id, rgb, depth, detections, timing, scale=1, size=None):
+        # Detection boxes are in stream pixels (size); rgb may be decoded at 1/scale
+        for det in detections:
+            detections_total.inc(session=session.name, label=det['label'])
+        provisional = bool(timing.get('flags', 0) & TIMING_FLAG_PROVISIONAL)
+        if self.detections is not None and rgb is not None:
+            self.detections.write(session.key, frame_id, timing.get('timestamp', 0), detections, provisional)
+        if (self.args.roi_feedback and self.args.detect and rgb is not None and not self.args.play
+                and not provisional):
+            # Warm-up frames are not representative; the streamer keeps its previous ROI until real ones
+            self.control.sendto(pack_roi([det['box'] for det in detections], *size), session.control_addr)
+        if self.args.display:
+            if session.display is None:
+                session.display = DisplayStage(self.preview_size, self.args.display_fps, f' {session.name}')
+            start_us = now_us()
+            if session.display.show(rgb, depth, detections, size):
+                render_ms.observe((now_us() - start_us) / 1000.0)
+                self.rendered = True
+            else:
+                renders_skipped.inc(session=session.name)
+        timing['display'] = now_us()
+        session.latency.record(timing)
+        frames_displayed.inc(session=session.name)
+
+    def expire_sessions(self):
+        now = time.monotonic()
+        for key, session in list(self.sessions.items()):
+            if now - session.last_seen > SESSION_TIMEOUT:
+                del self.sessions[key]
+                sessions_gauge.set(len(self.sessions))
+                if session.ring is not None:
+                    session.ring.close()
+                print(f"Session {session.name} timed out")
+                if not any(other.control_addr == session.control_addr for other in self.sessions.values()):
+                    # Last session of that streamer: stop probing it, fetch its configuration anew if it returns
+                    self.clocks.pop(session.control_addr, None)
+                    self.configs.pop(session.control_addr, None)
+                if self.args.display:
+                    for window in (f'RGB {session.name}', f'Depth {session.name}'):
+                        try:
+                            cv2.destroyWindow(window)
+                        except cv2.error:
+                            pass
+
+    async def probe_clocks(self):
+        while self.running:
+            for addr, clock in list(self.clocks.items()):
+                self.control.sendto(clock.make_probe(), addr)
+                if addr not in self.configs:
+                    self.control.sendto(pack_control(CTRL_CONFIG_GET), addr)
+            await asyncio.sleep(CLOCK_PROBE_INTERVAL)
+
+    async def finish_frame(self, session, frame_id, entry, job):
+        # Runs as soon as the frame's RGB and depth decodes complete on the DecodePool
+        try:
+            await asyncio.gather(asyncio.wrap_future(job.rgb), asyncio.wrap_future(job.depth))
+            self.process(session, frame_id, entry, job)
+        finally:
+            session.decoding = None
+            self.wake.set()  # the session may have a newer frame waiting
+
+    async def display_loop(self):
+        while self.running:
+            for session in list(self.sessions.values()):
+                if self.pool is not None:
+                    ready = session.take_ready()
+                    if ready is not None:
+                        self.dispatch(session, *ready)
+                    continue
+                # Sessions decode in parallel on the DecodePool, one frame each at a time
+                if session.decoding is None:
+                    ready = session.take_ready()
+                    if ready is not None:
+                        job = self.decoder.submit(ready[1]['rgb'], ready[1]['depth'], ready[1]['scale'])
+                        session.decoding = asyncio.create_task(self.finish_frame(session, *ready, job))
+            if self.pool is not None:
+                self.collect()
+            # HighGUI only needs events after a window update, or now and then to stay responsive
+            if self.args.display and (self.rendered or time.monotonic() - self.last_events > EVENT_INTERVAL):
+                self.rendered = False
+                self.last_events = time.monotonic()
+                if cv2.waitKey(1) == 27:
+                    self.running = False
+            self.expire_sessions()
+            if self.report.due():
+                for session in self.sessions.values():
+                    print(f"[{session.name}] {frames_displayed.value(session=session.name)} frames displayed,"
+                          f" {decodes_skipped.value(session=session.name, stream='rgb')} RGB decodes skipped")
+                    print(session.latency.summary())
+            # Sleep until a frame is ready or decoded; worker results have no wakeup and are polled
+            timeout = POOL_POLL_INTERVAL if self.pool is not None else EVENT_INTERVAL
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+    async def play_recording(self, reader):
+        # Feeds a recording through handle_packet like datagrams from the network
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for offset, packet, addr in schedule(reader, self.args.play_speed, self.args.play_from, self.args.play_loop):
+            await asyncio.sleep(max(0.0, start + offset - loop.time()))
+            self.handle_packet(packet, addr)
+        await asyncio.sleep(0.5)  # let the last frames through the display loop
+        print("Playback finished")
+        self.running = False
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        self.control, _ = await loop.create_datagram_endpoint(lambda: ControlProtocol(self), local_addr=('0.0.0.0', 0))
+        if self.args.play:
+            # No network input, and no probes or feedback to the streamers in the recording
+            reader = RecordingReader(self.args.play)
+            data_transport = None
+            input_task = asyncio.create_task(self.play_recording(reader))
+            print(f"Playing {self.args.play}")
+        else:
+            sock = open_receiver_socket(self.args.port, self.args.multicast_group, self.args.multicast_if,
+                                        self.args.rcvbuf)
+            data_transport, _ = await loop.create_datagram_endpoint(lambda: DataProtocol(self), sock=sock)
+            input_task = asyncio.create_task(self.probe_clocks())
+            print(f"Listening on UDP port {self.args.port} for up to {self.args.max_sessions} streamers")
+        try:
+            await self.display_loop()
+        finally:
+            input_task.cancel()
+            if data_transport is not None:
+                data_transport.close()
+            else:
+                reader.close()
+            self.control.close()
+            if self.recorder is not None:
+                self.recorder.close()
+                print(f"Recorded {len(self.recorder.frames)} frames to {self.args.record}")
+            if self.pool is not None:
+                self.pool.close()
+            if self.detections is not None:
+                self.detections.close()
+                print(f"Wrote {self.detections.records} detection records ({self.detections.dropped} dropped)")
+            if self.decoder is not None:
+                self.decoder.close()
+            for session in self.sessions.values():
+                if session.ring is not None:
+                    session.ring.close()
+            if self.args.display:
+                cv2.destroyAllWindows()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive RGB-D streams from several streamers on one UDP port")
+    parser.add_argument('--port', type=int, default=PORT, help="UDP data port")
+    parser.add_argument('--multicast-group', help="Join this multicast group, e.g. 239.0.0.1")
+    parser.add_argument('--multicast-if', help="IP of the interface to join the group on")
+    parser.add_argument('--max-sessions', type=int, default=16)
+    parser.add_argument('--rcvbuf', type=int, default=8 * 1024 * 1024, help="Socket receive buffer in bytes")
+    parser.add_argument('--workers', type=int, default=0, help="Decode/inference processes, 0 = in-process")
+    parser.add_argument('--decode-workers', type=int, default=None,
+                        help="Threads decoding payloads when --workers is 0 (default: 2, inline on one core)")
+    parser.add_argument('--max-width', type=int, default=1280, help="Largest frame the worker and ring slots must hold")
+    parser.add_argument('--max-height', type=int, default=720)
+    parser.add_argument('--record', metavar='FILE', help="Save accepted payloads as received to an indexed recording")
+    parser.add_argument('--play', metavar='FILE', help="Process a recording instead of listening on the network")
+    parser.add_argument('--play-speed', type=float, default=1.0, help="Playback timing scale, 0 = as fast as possible")
+    parser.add_argument('--play-from', type=int, help="Start playback at this frame_id")
+    parser.add_argument('--play-loop', action='store_true', help="Restart the recording at its end")
+    parser.add_argument('--publish-shm', metavar='PREFIX', help="Publish each session's frames to a shared-memory ring")
+    parser.add_argument('--shm-slots', type=int, default=8)
+    parser.add_argument('--no-align', dest='align', action='store_false',
+                        help="Keep raw depth instead of registering it to the color image")
+    parser.add_argument('--no-detect', dest='detect', action='store_false', help="Skip YOLO inference")
+    parser.add_argument('--roi-feedback', action='store_true',
+                        help="Send detections back so each streamer spends RGB bits around them")
+    parser.add_argument('--decode-scale', choices=('auto', '1', '2', '4', '8'), default='auto',
+                        help="Decode RGB at 1/N size; auto picks N from the detector input and --preview-size")
+    parser.add_argument('--preview-size', default='640x360', help="Window size WxH; frames are shrunk to fit before drawing")
+    parser.add_argument('--display-fps', type=float, default=DEFAULT_DISPLAY_FPS,
+                        help="Refresh each session's windows at most this often, 0 = every frame")
+    parser.add_argument('--no-display', '--headless', dest='display', action='store_false',
+                        help="Do not open windows or draw overlays")
+    parser.add_argument('--detections-out', metavar='TARGET',
+                        help="Write detections to a file, '-', udp://host:port or tcp://host:port")
+    parser.add_argument('--detections-format', choices=('json', 'binary'),
+                        help="Default: binary for *.bin files, JSON lines otherwise")
+    parser.add_argument('--metrics-port', type=int, default=9111, help="HTTP metrics port, 0 disables")
+    parser.add_argument('--metrics-host', default='127.0.0.1')
+    parser.add_argument('--report-interval', type=float, default=5.0, help="Seconds between console summaries")
+    args = parser.parse_args()
+    console_to_stderr(args.detections_out)
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port, args.metrics_host)
+    try:
+        asyncio.run(AsyncReceiver(args).run())
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,104 +1,414 @@
 import socket
-import struct
-import numpy as np
+import select
 import cv2
 import time
+import argparse
+import json
 
-PORT = 9999
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock.bind(("", PORT))
+from rgbd_protocol import (PORT, TYPE_RGB, TYPE_DEPTH, TYPE_CALIB, CTRL_CLOCK_REPLY, CTRL_CONFIG,
+                           CTRL_CONFIG_GET, CTRL_CONFIG_SET, TIMING_FLAG_PROVISIONAL, SequenceTracker, unpack_packet,
+                           control_port, unpack_timing, unpack_control, pack_control)
+from rgbd_latency import ClockOffsetEstimator, StageLatency, now_us
+from rgbd_codec import decode_scale, matches_size
+from rgbd_decode_pool import DecodePool
+from rgbd_detections import DetectionWriter, console_to_stderr
+from rgbd_display import DEFAULT_DISPLAY_FPS, DisplayStage
+from udp_capture import CaptureWriter
+from rgbd_recording import RecordingWriter, RecordingReader, play
+from grape_detector import INPUT_SIZE, load_yolo, detect
+from grape_localize import localize
+from rgbd_shm_ring import ShmFrameRing
+from rgbd_calibration import parse_calibration
+from rgbd_config import parse_config_message, parse_changes, describe
+from rgbd_align import DepthToColorAligner
+from rgbd_pointcloud import PointCloudBuilder, PointCloudStreamWriter, voxel_downsample, write_ply
+from rgbd_net import open_receiver_socket
+from rgbd_roi import pack_roi
+from rgbd_metrics import REGISTRY, RateMeter, PeriodicReport, start_http_server
 
-print(f"Listening on UDP port {PORT}")
+CLOCK_PROBE_INTERVAL = 1.0
+MAX_DRAIN = 256  # datagrams read before decoding even if more are queued
+
+parser = argparse.ArgumentParser(description="Receive, detect and display RGB-D frames over UDP")
+parser.add_argument('--port', type=int, default=PORT, help="UDP data port")
+parser.add_argument('--stream-id', type=int, default=0, help="Camera to show when several share an address (v2)")
+parser.add_argument('--multicast-group', help="Join this multicast group, e.g. 239.0.0.1")
+parser.add_argument('--multicast-if', help="IP of the interface to join the group on")
+parser.add_argument('--no-align', dest='align', action='store_false',
+                    help="Show raw depth instead of registering it to the color image")
+parser.add_argument('--roi-feedback', action='store_true',
+                    help="Send detections back so the streamer spends RGB bits around them")
+parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                    help="Ask the streamer for other settings, e.g. --set width=848 --set height=480 --set fps=15")
+parser.add_argument('--headless', action='store_true', help="No windows or overlays, only inference and outputs")
+parser.add_argument('--detections-out', metavar='TARGET',
+                    help="Write detections to a file, '-', udp://host:port or tcp://host:port")
+parser.add_argument('--detections-format', choices=('json', 'binary'),
+                    help="Default: binary for *.bin files, JSON lines otherwise")
+parser.add_argument('--decode-scale', choices=('auto', '1', '2', '4', '8'), default='auto',
+                    help="Decode RGB at 1/N size; auto picks N from the detector input and --preview-size")
+parser.add_argument('--preview-size', default='640x360', help="Window size WxH; frames are shrunk to fit before drawing")
+parser.add_argument('--display-fps', type=float, default=DEFAULT_DISPLAY_FPS,
+                    help="Refresh the windows at most this often, 0 = every frame")
+parser.add_argument('--decode-workers', type=int, default=None,
+                    help="Threads decoding RGB and depth side by side (default: 2, inline on one core), 0 = inline")
+parser.add_argument('--capture', help="Write every received datagram to this capture file")
+parser.add_argument('--record', metavar='FILE', help="Save accepted payloads as received to an indexed recording")
+parser.add_argument('--play', metavar='FILE', help="Process a recording instead of listening on the network")
+parser.add_argument('--play-speed', type=float, default=1.0, help="Playback timing scale, 0 = as fast as possible")
+parser.add_argument('--play-from', type=int, help="Start playback at this frame_id")
+parser.add_argument('--play-loop', action='store_true', help="Restart the recording at its end")
+parser.add_argument('--publish-shm', metavar='NAME', help="Publish decoded frames to a shared-memory ring")
+parser.add_argument('--shm-slots', type=int, default=8)
+parser.add_argument('--shm-max-size', default='1280x720', help="Largest WxH the ring slots hold")
+parser.add_argument('--pointcloud-out', metavar='FILE', help="Append each frame's colored point cloud to FILE")
+parser.add_argument('--pointcloud-ply', metavar='PREFIX', help="Write <PREFIX>_<frame_id>.ply point clouds")
+parser.add_argument('--pointcloud-every', type=int, default=1, help="Export every Nth displayed frame")
+parser.add_argument('--voxel', type=float, default=0.0, help="Voxel size in metres for point clouds, 0 keeps all")
+parser.add_argument('--metrics-port', type=int, default=9111, help="HTTP metrics port, 0 disables")
+parser.add_argument('--metrics-host', default='127.0.0.1')
+parser.add_argument('--report-interval', type=float, default=5.0, help="Seconds between console summaries")
+args = parser.parse_args()
+console_to_stderr(args.detections_out)
+try:
+    requested_changes = parse_changes(args.set)
+except ValueError as e:
+    parser.error(str(e))
+
+# Metrics
+packets_received = REGISTRY.counter('rgbd_packets_received_total', "Packets received", ['stream'])
+bytes_received = REGISTRY.counter('rgbd_bytes_received_total', "Payload bytes received", ['stream'])
+drops = REGISTRY.counter('rgbd_packets_dropped_total', "Packets or frames dropped", ['reason'])
+decode_ms = REGISTRY.histogram('rgbd_decode_ms', "Decode time in ms", ['stream'])
+decodes_skipped = REGISTRY.counter('rgbd_decodes_skipped_total', "Payloads dropped without being decoded",
+                                   ['stream'])
+align_ms = REGISTRY.histogram('rgbd_align_ms', "Depth to color registration time in ms")
+pointcloud_ms = REGISTRY.histogram('rgbd_pointcloud_ms', "Point cloud generation and export time in ms")
+inference_ms = REGISTRY.histogram('rgbd_inference_ms', "Detection time in ms")
+localize_ms = REGISTRY.histogram('rgbd_localize_ms', "Per-frame detection localization time in ms")
+frames_displayed = REGISTRY.counter('rgbd_frames_displayed_total', "Frames displayed")
+packets_lost = REGISTRY.gauge('rgbd_packets_lost', "Packets missing from the v2 sequence")
+packets_duplicated = REGISTRY.gauge('rgbd_packets_duplicated', "Packets received more than once")
+packets_reordered = REGISTRY.counter('rgbd_packets_reordered_total', "Packets that arrived after later ones")
+buffer_depth = REGISTRY.gauge('rgbd_frame_buffer_frames', "Frames waiting in the reassembly buffer")
+provisional_frames = REGISTRY.counter('rgbd_provisional_frames_total',
+                                      "RGB frames the streamer sent before its camera warm-up ended")
+scale_gauge = REGISTRY.gauge('rgbd_decode_scale', "RGB decode reduction factor")
+fps_gauge = REGISTRY.gauge('rgbd_fps', "Frames displayed per second")
+stage_ms = REGISTRY.histogram('rgbd_stage_latency_ms', "Per-stage latency in ms", ['stage'])
+render_ms = REGISTRY.histogram('rgbd_render_ms', "Overlay drawing and window update time in ms")
+renders_skipped = REGISTRY.counter('rgbd_renders_skipped_total', "Frames not shown because of --display-fps")
+fps_meter = RateMeter()
+report = PeriodicReport(args.report_interval)
+if args.metrics_port:
+    start_http_server(args.metrics_port, args.metrics_host)
+STREAM_NAMES = {TYPE_RGB: 'rgb', TYPE_DEPTH: 'depth'}
+
+# A recording replaces the network: packets are rebuilt from it and take the normal path below
+player = None
+if args.play:
+    player = play(RecordingReader(args.play), args.play_speed, args.play_from, args.play_loop)
+    sock = None
+else:
+    sock = open_receiver_socket(args.port, args.multicast_group, args.multicast_if)
+# Control socket for clock probes and configuration requests to the streamer
+ctrl_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+capture = CaptureWriter(args.capture) if args.capture else None
+recorder = RecordingWriter(args.record) if args.record else None
+ring = None
+if args.publish_shm:
+    shm_w, shm_h = (int(v) for v in args.shm_max_size.split('x'))
+    ring = ShmFrameRing.create(args.publish_shm, args.shm_slots, (shm_h, shm_w), (shm_h, shm_w))
+
+# Reduced-size RGB decode only when every consumer is fine with it; the shared-memory ring and
+# point clouds get full-resolution frames
+preview_w, preview_h = (int(v) for v in args.preview_size.split('x')) if not args.headless else (0, 0)
+decode_target = (max(INPUT_SIZE, preview_w), max(INPUT_SIZE, preview_h))
+display = DisplayStage((preview_w, preview_h), args.display_fps) if not args.headless else None
+full_resolution = bool(args.publish_shm or args.pointcloud_out or args.pointcloud_ply)
+
+
+def rgb_scale(width, height):
+    if args.decode_scale != 'auto':
+        return int(args.decode_scale)
+    return 1 if full_resolution else decode_scale(width, height, decode_target)
+
+
+if player is not None:
+    print(f"Playing {args.play}")
+else:
+    print(f"Listening on UDP port {args.port}" + (f" in group {args.multicast_group}" if args.multicast_group else ""))
 
 frame_buffer = {}
 last_displayed = -1
+ready = None  # newest complete frame not yet displayed
+drained = 0
+calibration = None
+aligner = None
+cloud_builder = None
+stream_config = None  # announced by the streamer, see rgbd_config
+config_generation = -1
+cloud_writer = PointCloudStreamWriter(args.pointcloud_out) if args.pointcloud_out else None
+detection_writer = DetectionWriter(args.detections_out, args.detections_format) if args.detections_out else None
+decoder = DecodePool(args.decode_workers)
+
+clock = ClockOffsetEstimator()
+sequence = SequenceTracker()
+latency = StageLatency(clock, args.report_interval, stage_ms)
+last_probe = 0.0
+
+
+def use_calibration(calib):
+    global calibration, aligner, cloud_builder
+    if calib is None or calib == calibration:
+        return
+    calibration = calib
+    aligner = DepthToColorAligner(calib) if args.align else None
+    # Clouds come from registered depth, so they need the alignment as well
+    cloud_builder = PointCloudBuilder.from_calibration(calib) if aligner is not None else None
+    print("Received camera calibration" + (", aligning depth to color" if aligner else ""))
+
+
+def handle_config(payload):
+    global stream_config, config_generation, requested_changes
+    message = parse_config_message(payload)
+    if message is None:
+        return
+    if message.get('error'):
+        print(f"Streamer rejected settings: {message['error']}")
+        requested_changes = {}
+    if message['generation'] != config_generation or stream_config is None:
+        stream_config = message['config']
+        config_generation = message['generation']
+        print(f"Stream configuration {config_generation}: {describe(stream_config)}")
+    use_calibration(message.get('calibration'))
+
+
+def poll_control(streamer_addr):
+    global last_probe, requested_changes
+    while select.select([ctrl_sock], [], [], 0)[0]:
+        message, _ = ctrl_sock.recvfrom(65536)
+        t3 = now_us()
+        parsed = unpack_control(message)
+        if parsed is None:
+            continue
+        if parsed[0] == CTRL_CLOCK_REPLY:
+            clock.add_reply(parsed[1], t3)
+        elif parsed[0] == CTRL_CONFIG:
+            handle_config(parsed[1])
+    now = time.monotonic()
+    if now - last_probe >= CLOCK_PROBE_INTERVAL:
+        last_probe = now
+        target = (streamer_addr[0], control_port(args.stream_id))
+        ctrl_sock.sendto(clock.make_probe(), target)
+        if stream_config is None:
+            ctrl_sock.sendto(pack_control(CTRL_CONFIG_GET), target)
+        elif requested_changes:
+            if any(str(stream_config.get(key)) != str(value) for key, value in requested_changes.items()):
+                ctrl_sock.sendto(pack_control(CTRL_CONFIG_SET, json.dumps(requested_changes).encode()), target)
+            else:
+                requested_changes = {}
+
 
-HEADER_SIZE = 21
+def add_packet(packet, addr, receive_us):
+    # Files the datagram's payload under its frame; ready becomes the newest complete frame
+    global ready
+    # v1 or v2 header, see rgbd_protocol
+    try:
+        parsed = unpack_packet(packet)
+    except ValueError as e:
+        drops.inc(reason=str(e))
+        return
+    if parsed.stream_id != args.stream_id:
+        drops.inc(reason='other_stream')
+        return
+    if parsed.frag_count > 1:
+        drops.inc(reason='fragmented')  # no sender fragments yet
+        return
+    if sequence.update(parsed.seq)[1]:
+        packets_reordered.inc()
+    packets_lost.set(sequence.lost)
+    packets_duplicated.set(sequence.duplicates)
+    if recorder is not None:
+        recorder.write(parsed, addr, receive_us)
+    frame_id, typ, timestamp, width, height = parsed.frame_id, parsed.type, parsed.timestamp, parsed.width, parsed.height
+    data = parsed.data
+    if typ == TYPE_CALIB:
+        use_calibration(parse_calibration(data))
+        return
+    if (typ == TYPE_RGB and stream_config is not None
+            and (width, height) != (stream_config['width'], stream_config['height'])):
+        # Stale packets from before a reconfiguration, or a foreign sender
+        drops.inc(reason='unexpected_size')
+        return
+    stream = STREAM_NAMES.get(typ, 'unknown')
+    packets_received.inc(stream=stream)
+    bytes_received.inc(len(data), stream=stream)
+    if frame_id <= last_displayed:
+        # A newer frame was already shown; this one is never decoded
+        drops.inc(reason='stale')
+        decodes_skipped.inc(stream=stream)
+        return
+    entry = frame_buffer.setdefault(frame_id, {})
+    if typ == TYPE_RGB:
+        # Payloads stay compressed until the frame is picked for display
+        entry['rgb'] = data
+        entry['size'] = (width, height)
+        entry['timestamp'] = timestamp
+        entry['addr'] = addr  # ROI feedback and detection records go to this sender
+        # Stage timestamps follow the RGB payload when the streamer sends them
+        timing = unpack_timing(parsed.trailer) or {}
+        if timing.get('flags', 0) & TIMING_FLAG_PROVISIONAL:
+            provisional_frames.inc()
+        timing['receive'] = receive_us
+        entry['timing'] = timing
+    elif typ == TYPE_DEPTH:
+        entry['depth'] = data
+        entry['depth_size'] = (width, height)
+    if 'rgb' in entry and 'depth' in entry and (ready is None or frame_id > ready):
+        ready = frame_id
 
-def load_yolo():
-    net = cv2.dnn.readNetFromDarknet('yolov3.cfg', 'yv3_grapes.weights')
-    with open('obj.names', 'r') as f:
-        classes = [line.strip() for line in f.readlines()]
-    return net, classes
 
 yolo_net, yolo_classes = load_yolo()
 
-def detect_and_draw(frame, net, classes):
-    blob = cv2.dnn.blobFromImage(frame, 1/255.0, (416, 416), swapRB=True, crop=False)
-    net.setInput(blob)
-    outs = net.forward(net.getUnconnectedOutLayersNames())
-    height, width = frame.shape[:2]
-    class_ids = []
-    confidences = []
-    boxes = []
-    for out in outs:
-        for detection in out:
-            scores = detection[5:]
-            class_id = np.argmax(scores)
-            confidence = scores[class_id]
-            if confidence > 0.5:
-                center_x = int(detection[0] * width)
-                center_y = int(detection[1] * height)
-                w = int(detection[2] * width)
-                h = int(detection[3] * height)
-                x = int(center_x - w / 2)
-                y = int(center_y - h / 2)
-                class_ids.append(class_id)
-                confidences.append(float(confidence))
-                boxes.append([x, y, w, h])
-    indices = cv2.dnn.NMSBoxes(boxes, confidences, 0.5, 0.4)
-    for i in indices:
-        i = i[0] if isinstance(i, (list, np.ndarray)) else i
-        box = boxes[i]
-        x, y, w, h = box
-        label = classes[class_ids[i]]
-        confidence = confidences[i]
-        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        cv2.circle(frame, ((x + int(w / 2)), (y + int(h / 2))), 5, (0, 0, 255), -1)
-        cv2.putText(frame, f'{label}: {confidence:.2f}', (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-    return frame
-
-while True:
-    packet, addr = sock.recvfrom(65536)
-    if len(packet) < HEADER_SIZE:
-        print("Packet too small")
-        continue
-    # Header: frame_id(uint32), type(uint8), timestamp(uint64), width(uint16), height(uint16), data_size(uint32)
-    frame_id, typ, timestamp, width, height, data_size = struct.unpack('<IBQHHI', packet[:HEADER_SIZE])
-    data = packet[HEADER_SIZE:HEADER_SIZE+data_size]
-    if len(data) != data_size:
-        print("Incomplete packet")
-        continue
-    if frame_id not in frame_buffer:
-        frame_buffer[frame_id] = {}
-    if typ == 0:
-        # RGB (display as received, no color conversion)
-        color = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
-        frame_buffer[frame_id]['rgb'] = color
-    elif typ == 1:
-        # Depth
-        depth = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
-        frame_buffer[frame_id]['depth'] = depth
-    # Display if both are present and not already displayed
-    if ('rgb' in frame_buffer[frame_id] and 'depth' in frame_buffer[frame_id]
-        and frame_id > last_displayed):
-        rgb_disp = frame_buffer[frame_id]['rgb']
+try:
+    while True:
+        if player is not None:
+            packet, addr = next(player, (None, None))
+            if packet is None:
+                print("Playback finished")
+                break
+        else:
+            packet, addr = sock.recvfrom(65536)
+        receive_us = now_us()
+        if capture is not None:
+            capture.write(packet, addr, receive_us)
+        if player is None:
+            poll_control(addr)
+        add_packet(packet, addr, receive_us)
+        # Drain queued datagrams first so only the newest complete frame is decoded; playback
+        # processes every frame
+        drained += 1
+        if drained < MAX_DRAIN and sock is not None and select.select([sock], [], [], 0)[0]:
+            continue
+        drained = 0
+        if ready is None:
+            continue
+        frame_id, ready = ready, None
+        entry = frame_buffer[frame_id]
+        timestamp = entry['timestamp']
+        scale = rgb_scale(*entry['size'])
+        (color, rgb_ms), (depth, depth_ms) = decoder.submit(entry['rgb'], entry['depth'], scale).result()
+        entry['timing']['decode'] = now_us()
+        decode_ms.observe(rgb_ms, stream='rgb')
+        decode_ms.observe(depth_ms, stream='depth')
+        if ((color is not None and not matches_size(color, *entry['size'], scale))
+                or (depth is not None and depth.shape[1::-1] != entry['depth_size'])):
+            drops.inc(reason='size_mismatch')
+            del frame_buffer[frame_id]
+            continue
+        scale_gauge.set(scale)
+        entry.update(rgb=color, depth=depth, scale=scale)
+        timing = entry['timing']
+        rgb_disp = entry['rgb']
+        if aligner is not None and rgb_disp is not None and frame_buffer[frame_id]['depth'] is not None:
+            start_us = now_us()
+            frame_buffer[frame_id]['depth'] = aligner.align(frame_buffer[frame_id]['depth'],
+                                                            (rgb_disp.shape[1], rgb_disp.shape[0]))
+            align_ms.observe((now_us() - start_us) / 1000.0)
+        if (cloud_builder is not None and (cloud_writer is not None or args.pointcloud_ply)
+                and frames_displayed.value() % args.pointcloud_every == 0
+                and rgb_disp is not None and frame_buffer[frame_id]['depth'] is not None):
+            start_us = now_us()
+            points, colors = cloud_builder.points(frame_buffer[frame_id]['depth'], rgb_disp)
+            if args.voxel > 0:
+                points, colors = voxel_downsample(points, colors, args.voxel)
+            if cloud_writer is not None:
+                cloud_writer.write(frame_id, timestamp, points, colors)
+            if args.pointcloud_ply:
+                write_ply(f"{args.pointcloud_ply}_{frame_id}.ply", points, colors)
+            pointcloud_ms.observe((now_us() - start_us) / 1000.0)
+        if ring is not None:
+            # Publish before drawing so consumers get clean pixels
+            try:
+                ring.publish(frame_id, timestamp, rgb_disp, frame_buffer[frame_id]['depth'])
+            except ValueError:
+                # Larger than --shm-max-size, e.g. after the streamer was reconfigured
+                drops.inc(reason='ring_too_large')
         if rgb_disp is not None:
-            rgb_disp = detect_and_draw(rgb_disp, yolo_net, yolo_classes)
-            cv2.imshow('RGB', rgb_disp)
-        d = frame_buffer[frame_id]['depth']
-        if d is not None:
-            # Normalize and apply heatmap
-            d_norm = cv2.normalize(d, None, 255, 0, cv2.NORM_MINMAX)
-            d_norm = d_norm.astype(np.uint8)
-            d_heat = cv2.applyColorMap(d_norm, cv2.COLORMAP_JET)
-            cv2.imshow('Depth', d_heat)
-        if cv2.waitKey(1) == 27:
-            break
+            # Boxes come back in stream pixels even when RGB was decoded at reduced size
+            scale, size = frame_buffer[frame_id]['scale'], frame_buffer[frame_id]['size']
+            detections = detect(rgb_disp, yolo_net, yolo_classes, scale)
+            timing['inference'] = now_us()
+            inference_ms.observe((timing['inference'] - timing['decode']) / 1000.0)
+            if aligner is not None and frame_buffer[frame_id]['depth'] is not None:
+                # Boxes and registered depth share the color image, so this is a lookup per box
+                localize(detections, frame_buffer[frame_id]['depth'], calibration, size)
+                localize_ms.observe((now_us() - timing['inference']) / 1000.0)
+            sender = entry['addr']
+            provisional = bool(timing.get('flags', 0) & TIMING_FLAG_PROVISIONAL)
+            if args.roi_feedback and player is None and not provisional:
+                # Warm-up frames are not representative; the streamer keeps its previous ROI until real ones
+                ctrl_sock.sendto(pack_roi([det['box'] for det in detections], *size),
+                                 (sender[0], control_port(args.stream_id)))
+            if detection_writer is not None:
+                detection_writer.write((sender[0], sender[1], args.stream_id), frame_id, timestamp, detections,
+                                       provisional)
+        else:
+            detections = []
+        if display is not None:
+            # Shrunk copies with overlays; the decoded frames stay untouched
+            start_us = now_us()
+            if display.show(rgb_disp, frame_buffer[frame_id]['depth'], detections, entry['size']):
+                render_ms.observe((now_us() - start_us) / 1000.0)
+                if cv2.waitKey(1) == 27:
+                    break
+            else:
+                renders_skipped.inc()
+        timing['display'] = now_us()
+        latency.record(timing)
+        latency.maybe_report()
+        frames_displayed.inc()
+        fps_meter.tick()
         last_displayed = frame_id
+        frame_buffer[frame_id]['shown'] = True
         # Clean up old frames
         for old_id in list(frame_buffer.keys()):
             if old_id < frame_id - 10:
-                del frame_buffer[old_id]
-sock.close()
-cv2.destroyAllWindows() 
\ No newline at end of file
+                old = frame_buffer.pop(old_id)
+                if not old.get('shown'):
+                    drops.inc(reason='never_displayed')
+                    for stream in ('rgb', 'depth'):
+                        if stream in old:
+                            decodes_skipped.inc(stream=stream)
+        buffer_depth.set(len(frame_buffer))
+        if report.due():
+            fps_gauge.set(fps_meter.update())
+            print(f"Displayed {frames_displayed.value()} frames | {fps_gauge.value():.1f} fps"
+                  f" | inference {inference_ms.mean():.1f} ms | {drops.total()} dropped"
+                  f" | {decodes_skipped.total()} decodes skipped"
+                  + (f" | {provisional_frames.value()} provisional" if provisional_frames.value() else ""))
+except KeyboardInterrupt:
+    print("Stopped.")
+finally:
+    if capture is not None:
+        capture.close()
+        print(f"Captured {capture.packets} datagrams to {args.capture}")
+    if recorder is not None:
+        recorder.close()
+        print(f"Recorded {len(recorder.frames)} frames ({recorder.bytes / 1e6:.1f} MB of payload) to {args.record}")
+    if cloud_writer is not None:
+        cloud_writer.close()
+        print(f"Wrote {cloud_writer.frames} point clouds to {args.pointcloud_out}")
+    if detection_writer is not None:
+        detection_writer.close()
+        print(f"Wrote {detection_writer.records} detection records ({detection_writer.dropped} dropped)")
+    if ring is not None:
+        ring.close()
+    decoder.close()
+    if sock is not None:
+        sock.close()
+    ctrl_sock.close()
+    if not args.headless:
+        cv2.destroyAllWindows() 
\ No newline at end of file
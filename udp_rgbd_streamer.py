@@ -1,77 +1,286 @@
-import pyrealsense2 as rs
 import numpy as np
-import cv2
 import socket
-import struct
 import time
-import sys
+import argparse
+import json
+
+from rgbd_protocol import (PORT, MAX_DATAGRAM, HEADER_SIZE, V2_HEADER_SIZE, CRC_SIZE, TIMING_SIZE,
+                           TIMING_FLAG_PROVISIONAL, TYPE_RGB, TYPE_DEPTH, TYPE_CALIB, CTRL_ROI, CTRL_CONFIG_GET,
+                           CTRL_CONFIG_SET, CODEC_IDS, codec_id, control_port, pack_header, pack_packet_v2,
+                           pack_timing)
+from rgbd_latency import now_us, control_messages
+from rgbd_codec import encode_rgb, encode_depth
+from rgbd_calibration import calibration_from_profile, pack_calibration
+from rgbd_config import (add_config_arguments, config_from_args, validate_config, apply_changes, pack_config_message,
+                         describe)
+from rgbd_capture import FrameSource, WarmUp, add_capture_arguments, sensor_stamp
+from rgbd_depth_filters import DepthFilterChain, parse_filters
+from rgbd_roi import DEFAULT_BACKGROUND_SCALE, DEFAULT_REFRESH, RoiEncoder, load_mask
+from rgbd_net import is_multicast, configure_multicast_sender
+from rgbd_metrics import REGISTRY, RateMeter, PeriodicReport, start_http_server
 
 # Settings
-WIDTH = 424
-HEIGHT = 240
-FPS = 30
-PORT = 9999
+CALIB_INTERVAL = 2.0  # resend calibration so late or lossy receivers pick it up
+MAX_CONFIG_CLIENTS = 16  # receivers told about configuration changes
+REOPEN_ATTEMPTS = 5  # restarting the previous settings after a rejected change, e.g. across a USB reset
+REOPEN_DELAY = 1.0
+
+parser = argparse.ArgumentParser(description="Stream RealSense RGB-D frames over UDP")
+parser.add_argument('receiver_ip', help="Receiver address, or a multicast group such as 239.0.0.1")
+add_config_arguments(parser)
+add_capture_arguments(parser)
+parser.add_argument('--depth-filters', default='',
+                    help="Pre-encode depth filters in order, e.g. decimation:2,spatial,temporal,hole")
+parser.add_argument('--depth-filter-budget', type=float, help="ms per frame; expensive filters are switched off above it")
+parser.add_argument('--roi-feedback', action='store_true',
+                    help="Keep full RGB detail only around the boxes the receiver reports back")
+parser.add_argument('--roi-mask', help="Grayscale image, non-zero where RGB keeps full detail")
+parser.add_argument('--roi-background-scale', type=float, default=DEFAULT_BACKGROUND_SCALE,
+                    help="Resolution factor for RGB outside the regions of interest")
+parser.add_argument('--roi-refresh', type=int, default=DEFAULT_REFRESH,
+                    help="Send every Nth frame at full detail, 0 never")
+parser.add_argument('--port', type=int, default=PORT, help="UDP data port")
+parser.add_argument('--protocol', type=int, choices=(1, 2), default=2,
+                    help="Packet header version; 1 for receivers that predate v2")
+parser.add_argument('--stream-id', type=int, default=0, help="Distinguishes cameras sharing one address (v2)")
+parser.add_argument('--crc', action='store_true', help="Checksum every packet (v2)")
+parser.add_argument('--multicast-ttl', type=int, default=1, help="Hops a multicast stream may cross")
+parser.add_argument('--multicast-if', help="IP of the interface to send multicast on")
+parser.add_argument('--metrics-port', type=int, default=9110, help="HTTP metrics port, 0 disables")
+parser.add_argument('--metrics-host', default='127.0.0.1')
+parser.add_argument('--report-interval', type=float, default=5.0, help="Seconds between console summaries")
+args = parser.parse_args()
+
+receiver_ip = args.receiver_ip
+config = config_from_args(args)
+error = validate_config(config)
+if error:
+    parser.error(error)
 
-if len(sys.argv) != 2:
-    print(f"Usage: python {sys.argv[0]} <receiver_ip>")
-    sys.exit(1)
+# Metrics
+frames_sent = REGISTRY.counter('rgbd_frames_sent_total', "Frames sent", ['stream'])
+bytes_sent = REGISTRY.counter('rgbd_bytes_sent_total', "Payload bytes sent", ['stream'])
+drops = REGISTRY.counter('rgbd_frames_dropped_total', "Frames not sent", ['stream', 'reason'])
+encode_ms = REGISTRY.histogram('rgbd_encode_ms', "Encode time in ms", ['stream'])
+roi_frames = REGISTRY.counter('rgbd_roi_frames_total', "RGB frames by encoding mode", ['mode'])
+filter_ms = REGISTRY.histogram('rgbd_depth_filter_ms', "Depth filter time in ms", ['filter'])
+fps_gauge = REGISTRY.gauge('rgbd_fps', "Frames captured per second")
+provisional_frames = REGISTRY.counter('rgbd_provisional_frames_total', "Frames sent before warm-up ended")
+backlog_gauge = REGISTRY.gauge('rgbd_capture_backlog', "Framesets waiting in the capture queue")
+fps_meter = RateMeter()
+report = PeriodicReport(args.report_interval)
+if args.metrics_port:
+    start_http_server(args.metrics_port, args.metrics_host)
 
-receiver_ip = sys.argv[1]
+depth_filters = None
+if args.depth_filters:
+    depth_filters = DepthFilterChain(parse_filters(args.depth_filters), args.depth_filter_budget, filter_ms)
+
+roi = None
+if args.roi_feedback or args.roi_mask:
+    roi = RoiEncoder(config['rgb_codec'], load_mask(args.roi_mask) if args.roi_mask else None, args.roi_feedback,
+                     background_scale=args.roi_background_scale, refresh=args.roi_refresh)
+
+header_size = HEADER_SIZE if args.protocol == 1 else V2_HEADER_SIZE + (CRC_SIZE if args.crc else 0)
+packet_seq = 0
 
 # UDP socket
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+if is_multicast(receiver_ip):
+    # One send reaches every receiver that joined the group
+    configure_multicast_sender(sock, args.multicast_ttl, args.multicast_if)
+# Control socket: clock probes, ROI feedback and configuration requests from receivers
+ctrl_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+ctrl_sock.bind(("", control_port(args.stream_id)))
+config_clients = {}  # control address -> last request time, told about every change
+config_requests = []  # (changes, addr), applied between frames
+generation = 0
 
-# RealSense pipeline
-pipeline = rs.pipeline()
-cfg = rs.config()
-cfg.enable_stream(rs.stream.color, WIDTH, HEIGHT, rs.format.rgb8, FPS)
-cfg.enable_stream(rs.stream.depth, WIDTH, HEIGHT, rs.format.z16, FPS)
-pipeline.start(cfg)
 
-# Warm up
-for _ in range(30):
-    pipeline.wait_for_frames()
+def send_config(addr, error=None):
+    ctrl_sock.sendto(pack_config_message(config, calibration, generation, error), addr)
+
+
+def remember_client(addr):
+    config_clients[addr] = time.monotonic()
+    if len(config_clients) > MAX_CONFIG_CLIENTS:
+        del config_clients[min(config_clients, key=config_clients.get)]
+
+
+def serve_control():
+    # Non-blocking: handle whatever control messages are already queued
+    for kind, payload, addr in control_messages(ctrl_sock):
+        if kind == CTRL_ROI and roi is not None:
+            roi.update(payload)
+        elif kind == CTRL_CONFIG_GET:
+            remember_client(addr)
+            send_config(addr)
+        elif kind == CTRL_CONFIG_SET:
+            remember_client(addr)
+            try:
+                config_requests.append((json.loads(payload.decode()), addr))
+            except (UnicodeDecodeError, ValueError):
+                send_config(addr, "changes must be JSON")
+
+
+def open_camera(settings):
+    # Start (or restart) the camera; returns the pipeline, its calibration and the warm-up, which
+    # is still running with --warmup-stream
+    camera = FrameSource(settings, args.capture, args.frame_queue_capacity)
+    warmup = WarmUp(args.warmup_timeout)
+    if not args.warmup_stream:
+        print(warmup.run(camera).describe())
+    # Intrinsics/extrinsics for depth->color registration on the host
+    return camera, calibration_from_profile(camera.profile), warmup
+
+
+def reopen_camera(settings):
+    # Settings that were running a moment ago; retried in case the device is re-enumerating
+    for attempt in range(REOPEN_ATTEMPTS):
+        try:
+            return open_camera(settings)
+        except RuntimeError as e:
+            print(f"Restarting the camera with {describe(settings)} failed ({attempt + 1}/{REOPEN_ATTEMPTS}): {e}")
+            time.sleep(REOPEN_DELAY)
+    return None
+
+
+def apply_config_requests():
+    # Restarts the camera when a receiver asked for new settings; answers every requester
+    global pipeline, calibration, warmup, calib_bytes, config, generation, last_calib
+    while config_requests:
+        changes, addr = config_requests.pop(0)
+        new, error = apply_changes(config, changes)
+        if error is None and new != config:
+            pipeline.stop()
+            try:
+                pipeline, calibration, warmup = open_camera(new)
+            except RuntimeError as e:
+                # Unsupported mode: go back to what was running
+                error = f"camera rejected {describe(new)}: {e}"
+                reopened = reopen_camera(config)
+                if reopened is None:
+                    pipeline = None
+                    send_config(addr, f"{error}; the camera could not be restarted, the streamer is exiting")
+                    raise SystemExit(f"Camera could not be restarted with {describe(config)}; exiting")
+                pipeline, calibration, warmup = reopened
+                calib_bytes = pack_calibration(calibration)
+                last_calib = 0.0
+            else:
+                config = new
+                generation += 1
+                calib_bytes = pack_calibration(calibration)
+                last_calib = 0.0
+                if roi is not None:
+                    roi.spec = config['rgb_codec']
+                print(f"Reconfigured to {describe(config)} (generation {generation})")
+                for client in config_clients:
+                    if client != addr:
+                        send_config(client)
+        send_config(addr, error)
+
+
+def send_packet(typ, timestamp, width, height, payload, trailer=b'', codec=CODEC_IDS['raw']):
+    global packet_seq
+    if args.protocol == 1:
+        packet = pack_header(frame_id, typ, timestamp, width, height, len(payload)) + payload + trailer
+    else:
+        packet = pack_packet_v2(typ, frame_id, packet_seq, timestamp, width, height, payload, trailer,
+                                args.stream_id, codec, args.crc)
+        packet_seq += 1
+    sock.sendto(packet, (receiver_ip, args.port))
+
+
+# RealSense pipeline
+pipeline, calibration, warmup = open_camera(config)
+calib_bytes = pack_calibration(calibration)
+last_calib = 0.0
 
 frame_id = 0
-print(f"Streaming to {receiver_ip}:{PORT}")
+print(f"Streaming {describe(config)} to {receiver_ip}:{args.port}")
 
 try:
     while True:
+        serve_control()
+        apply_config_requests()
+        if time.monotonic() - last_calib >= CALIB_INTERVAL:
+            last_calib = time.monotonic()
+            send_packet(TYPE_CALIB, int(time.time() * 1e6), config['width'], config['height'], calib_bytes,
+                        codec=CODEC_IDS['json'])
         frames = pipeline.wait_for_frames()
+        capture_us = now_us()
+        for (stream, reason), count in pipeline.take_drops().items():
+            drops.inc(count, stream=stream, reason=reason)
+        provisional = 0
+        if not warmup.done:
+            # --warmup-stream: frames go out flagged until auto-exposure has settled
+            if warmup.update(frames):
+                print(warmup.describe())
+            else:
+                provisional = TIMING_FLAG_PROVISIONAL
+                provisional_frames.inc()
         color_frame = frames.get_color_frame()
         depth_frame = frames.get_depth_frame()
         if not color_frame or not depth_frame:
+            drops.inc(stream='rgbd', reason='incomplete_frameset')
             continue
+        fps_meter.tick()
 
         # Get data
         color = np.asanyarray(color_frame.get_data())  # HWC, RGB
         depth = np.asanyarray(depth_frame.get_data())  # HW, uint16
+        if depth_filters is not None:
+            # Smoother depth with fewer holes compresses better; decimation also shrinks it
+            depth = depth_filters(depth)
+        encode_start_us = now_us()
 
-        # RGB as JPEG
-        _, rgb_jpeg = cv2.imencode('.jpg', cv2.cvtColor(color, cv2.COLOR_RGB2BGR), [int(cv2.IMWRITE_JPEG_QUALITY), 80])
-        rgb_bytes = rgb_jpeg.tobytes()
+        # RGB as JPEG (or --rgb-codec)
+        if roi is not None:
+            rgb_bytes, roi_applied = roi.encode(color)
+            roi_frames.inc(mode='roi' if roi_applied else 'full')
+        else:
+            rgb_bytes = encode_rgb(color, config['rgb_codec'])
+        rgb_encode_us = now_us()
+        encode_ms.observe((rgb_encode_us - encode_start_us) / 1000.0, stream='rgb')
         # Depth as PNG
-        _, depth_png = cv2.imencode('.png', depth)
-        depth_bytes = depth_png.tobytes()
+        depth_bytes = encode_depth(depth, config['depth_codec'])
+        depth_encode_us = now_us()
+        encode_ms.observe((depth_encode_us - rgb_encode_us) / 1000.0, stream='depth')
         timestamp = int(time.time() * 1e6)
-        # Header: frame_id(uint32), type(uint8), timestamp(uint64), width(uint16), height(uint16), data_size(uint32)
-        rgb_header = struct.pack('<IBQHHI', frame_id, 0, timestamp, WIDTH, HEIGHT, len(rgb_bytes))
-        depth_header = struct.pack('<IBQHHI', frame_id, 1, timestamp, WIDTH, HEIGHT, len(depth_bytes))
-        # Send RGB
-        if len(rgb_header) + len(rgb_bytes) <= 65507:
-            sock.sendto(rgb_header + rgb_bytes, (receiver_ip, PORT))
-            print(f"Sent RGB frame {frame_id} | {len(rgb_bytes)} bytes")
+        # Send RGB, stage timestamps ride in a trailer after the payload
+        if header_size + len(rgb_bytes) + TIMING_SIZE <= MAX_DATAGRAM:
+            flags, sensor_us = sensor_stamp(color_frame, provisional)
+            trailer = pack_timing(flags, sensor_us, capture_us, rgb_encode_us, now_us())
+            send_packet(TYPE_RGB, timestamp, color.shape[1], color.shape[0], rgb_bytes, trailer,
+                        codec_id(config['rgb_codec']))
+            frames_sent.inc(stream='rgb')
+            bytes_sent.inc(len(rgb_bytes), stream='rgb')
         else:
-            print(f"RGB frame {frame_id} too large for UDP packet ({len(rgb_bytes)} bytes)")
+            drops.inc(stream='rgb', reason='too_large')
         # Send Depth
-        if len(depth_header) + len(depth_bytes) <= 65507:
-            sock.sendto(depth_header + depth_bytes, (receiver_ip, PORT))
-            print(f"Sent Depth frame {frame_id} | {len(depth_bytes)} bytes")
+        if header_size + len(depth_bytes) + TIMING_SIZE <= MAX_DATAGRAM:
+            flags, sensor_us = sensor_stamp(depth_frame, provisional)
+            trailer = pack_timing(flags, sensor_us, capture_us, depth_encode_us, now_us())
+            send_packet(TYPE_DEPTH, timestamp, depth.shape[1], depth.shape[0], depth_bytes, trailer,
+                        codec_id(config['depth_codec']))
+            frames_sent.inc(stream='depth')
+            bytes_sent.inc(len(depth_bytes), stream='depth')
         else:
-            print(f"Depth frame {frame_id} too large for UDP packet ({len(depth_bytes)} bytes)")
+            drops.inc(stream='depth', reason='too_large')
         frame_id += 1
+        if report.due():
+            fps_gauge.set(fps_meter.update())
+            backlog_gauge.set(pipeline.backlog())
+            print(f"Frame {frame_id} | {fps_gauge.value():.1f} fps"
+                  f" | RGB {frames_sent.value(stream='rgb')} sent, {encode_ms.mean(stream='rgb'):.1f} ms encode"
+                  f" | Depth {frames_sent.value(stream='depth')} sent, {encode_ms.mean(stream='depth'):.1f} ms encode"
+                  f" | {drops.total()} dropped")
+            if depth_filters is not None:
+                print(f"Depth filters: {depth_filters.summary()}")
 except KeyboardInterrupt:
     print("Stopped.")
 finally:
-    pipeline.stop()
-    sock.close() 
+    if pipeline is not None:
+        pipeline.stop()
+    sock.close()
+    ctrl_sock.close()